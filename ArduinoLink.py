@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import threading
+import time
+import serial
+
+READY = '1'
+RESET_COMPLETE = "Reset complete"
+SWEEP_NEXT = 'N'
+SWEEP_STOP = 'Q'
+
+def format_correction(x_distance):
+    """Build the 5-character T correction command (e.g. TP012, TN105) for a step offset."""
+    sign = "N" if x_distance < 0 else "P"
+    return f"T{sign}{abs(int(x_distance)):03d}"
+
+def format_offset(x_distance):
+    """Build the 5-character X pre-compensation command (e.g. XP012) applied with the next hole move.
+
+    The firmware does not answer it, so it is sent in the same write as the hole
+    command. Offsets are clamped to the three digits the protocol allows.
+    """
+    sign = "N" if x_distance < 0 else "P"
+    return f"X{sign}{min(abs(int(x_distance)), 999):03d}"
+
+def hole_command(hole_code, offset=0):
+    """Hole command, preceded by the X pre-compensation when there is one."""
+    return (format_offset(offset) + hole_code) if offset else hole_code
+
+def sweep_command(hole_code, reverse=False, offset=0):
+    """Start a row sweep at hole_code (WF000A0170): the firmware visits the rest of the row, waiting for next_command()."""
+    return (format_offset(offset) if offset else "") + ("WR000" if reverse else "WF000") + hole_code
+
+def next_command(offset=0):
+    """Row sweep handshake: move on to the next hole, pre-compensated by offset steps."""
+    return (format_offset(offset) if offset else "") + SWEEP_NEXT
+
+class ArduinoLink:
+    """Owns the Arduino serial port for the whole process.
+
+    The port is opened (and the board reset) once. A reader thread turns incoming
+    bytes into lines, so callers wait on a condition or an asyncio future instead
+    of polling in_waiting. request() and arequest() send one 5-character command
+    and return the Arduino's reply line, or None on timeout.
+
+    write() and readline() behave like the pyserial methods, so existing helpers
+    that take a ser argument (send_motor_control_command,
+    send_x_distance_to_arduino, ...) can be given a link instead.
+    """
+
+    def __init__(self, port='/dev/ttyACM0', baud_rate=9600, boot_delay=2.0, timeout=10.0):
+        self.port = port
+        self.timeout = timeout
+        self.ser = serial.Serial(port, baud_rate, timeout=0.1)
+        print(f"Connected to Arduino on {port} at {baud_rate} baud.")
+        if boot_delay:
+            time.sleep(boot_delay)  # Opening the port resets the board; this is the only wait
+        self.ser.reset_input_buffer()
+
+        self._lines = collections.deque()
+        self._async_waiters = collections.deque()  # (loop, future) for arequest callers
+        self._condition = threading.Condition()
+        self._running = True
+        self._reader = threading.Thread(target=self._read_lines, daemon=True)
+        self._reader.start()
+
+    def _read_lines(self):
+        buffer = b""
+        while self._running:
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)  # Blocks for up to the 0.1 s port timeout
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._running:
+                    print(f"Error reading from Arduino: {e}")
+                return
+            if not chunk:
+                continue
+            buffer += chunk
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                self._deliver(raw.decode('utf-8', errors='ignore').strip())
+
+    def _deliver(self, line):
+        with self._condition:
+            while self._async_waiters:
+                loop, future = self._async_waiters.popleft()
+                if not future.done():
+                    loop.call_soon_threadsafe(_set_future_result, future, line)
+                    return
+            self._lines.append(line)
+            self._condition.notify_all()
+
+    def clear_replies(self):
+        """Drop replies nobody waited for (e.g. a stale ready signal)."""
+        with self._condition:
+            self._lines.clear()
+
+    def wait_for_line(self, timeout=None):
+        """Block until the Arduino sends a line and return it, or None after timeout seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._lines, timeout):
+                return None
+            return self._lines.popleft()
+
+    def send(self, command):
+        self.ser.write(command.encode())
+        self.ser.flush()
+
+    def request(self, command, timeout=None):
+        """Send a command and block until its reply line arrives. Returns None on timeout."""
+        self.clear_replies()
+        self.send(command)
+        return self.wait_for_line(timeout)
+
+    async def arequest(self, command, timeout=None):
+        """asyncio version of request(); the reply is handed to the event loop by the reader thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            if self._lines:
+                self._lines.clear()
+            self._async_waiters.append((loop, future))
+        self.send(command)
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def move_to_hole(self, hole_code, timeout=None, offset=0):
+        """Send a hole command (e.g. A0170), pre-compensated by offset steps, and wait for the ready signal."""
+        return self.request(hole_command(hole_code, offset), timeout) == READY
+
+    def correct(self, x_distance, timeout=None):
+        """Send a T correction and wait for the ready signal."""
+        return self.request(format_correction(x_distance), timeout) == READY
+
+    def reset(self, timeout=None):
+        """Send RR000 and wait for the stage to return to its start position."""
+        return self.request("RR000", timeout) == RESET_COMPLETE
+
+    async def amove_to_hole(self, hole_code, timeout=None, offset=0):
+        return await self.arequest(hole_command(hole_code, offset), timeout) == READY
+
+    async def acorrect(self, x_distance, timeout=None):
+        return await self.arequest(format_correction(x_distance), timeout) == READY
+
+    async def areset(self, timeout=None):
+        return await self.arequest("RR000", timeout) == RESET_COMPLETE
+
+    # pyserial-style methods for the existing ser helpers
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def readline(self):
+        line = self.wait_for_line()
+        return (line + "\n").encode() if line is not None else b""
+
+    def close(self):
+        self._running = False
+        self._reader.join(timeout=1)
+        self.ser.close()
+
+def _set_future_result(future, line):
+    if not future.done():
+        future.set_result(line)
@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import HoleLayout
+import ImageProcessing
+import ImageQuality
+
+# Synthetic plate geometry (matches the real 640x480 captures)
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+HOLE_RADIUS = 90  # Hole radius in pixels at scale 1.0
+RING_FRACTION = 0.85  # Inner lip of the hole, as a fraction of the radius
+EDGE_FRACTION = (1 + RING_FRACTION) / 2  # Template is centred between the edge and the lip, left of centre
+TEMPLATE_SIZE = 50  # Same template size as ImageProcessing.py
+THRESHOLD = 0.60
+FULL_RUN_HOLES = HoleLayout.TOTAL_HOLES
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Allowed change against the stored baseline before a metric counts as a regression
+TIME_TOLERANCE = 0.25  # Fraction slower
+ERROR_TOLERANCE = 0.25  # Pixels of extra centre error
+AGREEMENT_TOLERANCE = 0.01  # Fraction of pass/fail decisions
+
+def draw_hole(center, radius, blur=0.0, noise=4.0, debris=(), rng=None):
+    """Draw a grayscale plate with one hole at a sub-pixel center, plus optional blur and debris blobs.
+
+    debris is a list of (x, y, axis_x, axis_y, angle, intensity) ellipses.
+    """
+    shift = 4  # Sub-pixel drawing: coordinates are in 1/16 pixel
+    scale = 1 << shift
+    gray = np.full((FRAME_HEIGHT, FRAME_WIDTH), 200, np.uint8)
+    c = (int(round(center[0] * scale)), int(round(center[1] * scale)))
+    cv2.circle(gray, c, int(round(radius * scale)), 60, -1, cv2.LINE_AA, shift)
+    cv2.circle(gray, c, int(round(radius * RING_FRACTION * scale)), 120, 4, cv2.LINE_AA, shift)  # Inner lip
+    for x, y, axis_x, axis_y, angle, intensity in debris:
+        cv2.ellipse(gray, (int(x), int(y)), (int(axis_x), int(axis_y)), angle, 0, 360, int(intensity), -1,
+                    cv2.LINE_AA)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    if blur > 0:
+        gray = cv2.GaussianBlur(gray, (0, 0), blur)
+    if noise:
+        rng = rng or np.random.default_rng()
+        gray = np.clip(gray + rng.normal(0, noise, gray.shape), 0, 255).astype(np.uint8)
+    return gray
+
+def template_window(center, radius):
+    """Where the template (the left edge of the hole) sits in a frame: (x, y, w, h)."""
+    half = TEMPLATE_SIZE / 2
+    return (center[0] - radius * EDGE_FRACTION - half, center[1] - half, TEMPLATE_SIZE, TEMPLATE_SIZE)
+
+def synthetic_case(rng, dirty_fraction=0.3):
+    """Generate one hole image with random position, scale, blur and debris, and its ground truth.
+
+    Small debris is scattered over the plate. In a dirty case the hole is also
+    plugged with plate-coloured residue covering its edge, so the hole should
+    fail.
+    """
+    scale = rng.uniform(0.85, 1.15)
+    radius = HOLE_RADIUS * scale
+    center = (FRAME_WIDTH / 2 + rng.uniform(-40, 40), FRAME_HEIGHT / 2 + rng.uniform(-30, 30))
+    blur = rng.choice([0.0, 0.0, 0.8, 1.5, 2.5])
+
+    debris = []
+    for _ in range(rng.integers(0, 4)):
+        debris.append((rng.uniform(0, FRAME_WIDTH), rng.uniform(0, FRAME_HEIGHT), rng.uniform(2, 10),
+                       rng.uniform(2, 10), rng.uniform(0, 180), rng.choice([20, 255])))
+    dirty = rng.random() < dirty_fraction
+    if dirty:
+        debris.append((center[0] + rng.uniform(-0.05, 0.05) * radius, center[1] + rng.uniform(-0.05, 0.05) * radius,
+                       rng.uniform(1.1, 1.3) * radius, rng.uniform(1.1, 1.3) * radius, rng.uniform(0, 180),
+                       rng.uniform(195, 205)))
+
+    frame = draw_hole(center, radius, blur, debris=debris, rng=rng)
+    return {"frame": frame, "center": center, "scale": scale, "blur": blur, "dirty": dirty}
+
+def generate_dataset(count, seed=0, dirty_fraction=0.3):
+    rng = np.random.default_rng(seed)
+    return [synthetic_case(rng, dirty_fraction) for _ in range(count)]
+
+def write_dataset(cases, folder):
+    """Save the cases as JPEGs named like real captures and return the paths."""
+    paths = []
+    for number, case in enumerate(cases):
+        path = os.path.join(folder, f"H{number:04d}.jpg")
+        cv2.imwrite(path, case["frame"])
+        paths.append(path)
+    return paths
+
+def latency_stats(seconds):
+    values = np.array(seconds) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "max_ms": float(values.max()), "mean_ms": float(values.mean()),
+            "per_second": float(1000 / values.mean()) if values.mean() > 0 else 0.0}
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def error_stats(errors, prefix):
+    if not errors:
+        return {}
+    errors = np.array(errors)
+    return {f"{prefix}_mean_px": float(errors.mean()), f"{prefix}_p95_px": float(np.percentile(errors, 95)),
+            f"{prefix}_max_px": float(errors.max())}
+
+def bench_template(baseline_path):
+    """Time crop_center_template on the clean baseline image."""
+    center_x, center_y = FRAME_WIDTH / 2 - HOLE_RADIUS * EDGE_FRACTION, FRAME_HEIGHT / 2
+    times = []
+    template = None
+    with contextlib.redirect_stdout(io.StringIO()):  # It prints the crop coordinates every call
+        for _ in range(50):
+            template, seconds = timed(ImageProcessing.crop_center_template, baseline_path, center_x, center_y,
+                                      TEMPLATE_SIZE, TEMPLATE_SIZE)
+            times.append(seconds)
+    return template, {"crop_center_template": latency_stats(times)}
+
+def bench_matching(template, cases, paths, search):
+    """Time find_center_in_image and check centre and pass/fail against the ground truth."""
+    times, scores, errors = [], [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for case, path in zip(cases, paths):
+            score, seconds = timed(ImageProcessing.find_center_in_image, template, path, [], THRESHOLD,
+                                   search=search)
+            times.append(seconds)
+            scores.append(score)
+
+            # Centre from the matched edge position: the template is the hole's left edge
+            frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            _, loc, match_scale = ImageProcessing.match_template(template, frame, search=search)
+            half = TEMPLATE_SIZE * match_scale / 2
+            center_x = loc[0] + half + HOLE_RADIUS * EDGE_FRACTION * match_scale
+            center_y = loc[1] + half
+            if not case["dirty"]:
+                errors.append(np.hypot(center_x - case["center"][0], center_y - case["center"][1]))
+
+    passed = np.array(scores) >= THRESHOLD
+    expected = ~np.array([case["dirty"] for case in cases])
+    result = latency_stats(times)
+    result.update(error_stats(errors, "center_error"))
+    result["truth_agreement"] = float((passed == expected).mean())
+    return result, passed, np.array(scores)
+
+def bench_detectors(cases):
+    """Time both circle detectors and measure their centre error on the clean (unplugged) holes."""
+    results = {}
+    for name, detector, use_gray in (("detect_circle", ImageQuality.detect_circle, False),
+                                     ("detect_circle_fast", ImageQuality.detect_circle_fast, True)):
+        times, errors = [], []
+        misses = 0
+        for case in cases:
+            frame = case["frame"] if use_gray else cv2.cvtColor(case["frame"], cv2.COLOR_GRAY2BGR)
+            center, seconds = timed(detector, frame, annotate=False)
+            times.append(seconds)
+            if case["dirty"]:
+                continue
+            if center is None:
+                misses += 1
+            else:
+                errors.append(np.hypot(float(center[0]) - case["center"][0], float(center[1]) - case["center"][1]))
+        result = latency_stats(times)
+        result.update(error_stats(errors, "center_error"))
+        result["misses"] = misses
+        results[name] = result
+    return results
+
+def bench_full_run(template, paths, holes, workers):
+    """Score a full plate's worth of images with the batch engine (images are reused to reach the count)."""
+    run_paths = [paths[i % len(paths)] for i in range(holes)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, seconds = timed(ImageProcessing.process_images_parallel, template, run_paths, [], THRESHOLD,
+                           workers=workers)
+    return {"holes": holes, "workers": workers, "seconds": seconds, "holes_per_minute": holes / seconds * 60}
+
+def run_benchmarks(count=60, seed=0, holes=FULL_RUN_HOLES, workers=None):
+    """Run every benchmark on a freshly generated dataset and return the results by name."""
+    cv2.ocl.setUseOpenCL(False)  # CPU only, same as the Raspberry Pi
+    cases = generate_dataset(count, seed)
+    folder = tempfile.mkdtemp(prefix="asml-bench-")
+    try:
+        baseline_path = os.path.join(folder, "baseline.png")
+        cv2.imwrite(baseline_path, draw_hole((FRAME_WIDTH / 2, FRAME_HEIGHT / 2), HOLE_RADIUS, noise=0))
+        paths = write_dataset(cases, folder)
+
+        template, results = bench_template(baseline_path)
+        exhaustive, exhaustive_pass, exhaustive_scores = bench_matching(template, cases, paths, "exhaustive")
+        pyramid, pyramid_pass, pyramid_scores = bench_matching(template, cases, paths, "pyramid")
+        pyramid["exhaustive_agreement"] = float((pyramid_pass == exhaustive_pass).mean())
+        pyramid["max_score_diff"] = float(np.abs(pyramid_scores - exhaustive_scores).max())
+        results["find_center_in_image[exhaustive]"] = exhaustive
+        results["find_center_in_image[pyramid]"] = pyramid
+        cascade, cascade_pass, _ = bench_matching(template, cases, paths, "cascade")
+        cascade["exhaustive_agreement"] = float((cascade_pass == exhaustive_pass).mean())
+        cascade["speedup"] = exhaustive["mean_ms"] / cascade["mean_ms"]
+        results["find_center_in_image[cascade]"] = cascade
+        results.update(bench_detectors(cases))
+        if holes:
+            results["full_run"] = bench_full_run(template, paths, holes, workers or os.cpu_count())
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    results["_info"] = {"images": count, "seed": seed, "machine": platform.node(), "processor": platform.machine(),
+                        "cpus": os.cpu_count(), "opencv": cv2.__version__, "time": time.time()}
+    return results
+
+def print_results(results):
+    for name, metrics in results.items():
+        if name.startswith("_") or name == "full_run":
+            continue
+        if "p50_ms" in metrics:
+            line = (f"{name:34s} p50 {metrics['p50_ms']:7.2f} ms  p95 {metrics['p95_ms']:7.2f} ms  "
+                    f"max {metrics['max_ms']:7.2f} ms  {metrics['per_second']:7.1f}/s")
+            print(line)
+            extras = {key: value for key, value in metrics.items()
+                      if key not in ("p50_ms", "p95_ms", "max_ms", "mean_ms", "per_second")}
+        else:
+            extras = metrics
+        if extras:
+            print(" " * 36 + ", ".join(f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}"
+                                       for key, value in extras.items()))
+    full_run = results.get("full_run")
+    if full_run:
+        print(f"Full run: {full_run['holes']} holes in {full_run['seconds']:.1f} s "
+              f"({full_run['holes_per_minute']:.0f} holes/minute, {full_run['workers']} workers)")
+
+def compare_to_baseline(results, baseline, time_tolerance=TIME_TOLERANCE):
+    """Return a list of regressions against the stored baseline."""
+    regressions = []
+    same_machine = baseline.get("_info", {}).get("machine") == results["_info"]["machine"]
+    if not same_machine:
+        print("Baseline was recorded on another machine; timings are not compared.")
+
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if name.startswith("_") or old is None:
+            continue
+        for key, value in metrics.items():
+            if key not in old:
+                continue
+            previous = old[key]
+            if key in ("p50_ms", "p95_ms", "seconds"):  # max is too noisy to gate on
+                failed = same_machine and value > previous * (1 + time_tolerance)
+            elif key.endswith("_px"):
+                failed = value > previous + ERROR_TOLERANCE
+            elif key.endswith("agreement"):
+                failed = value < previous - AGREEMENT_TOLERANCE
+            elif key in ("misses", "max_score_diff"):
+                failed = value > previous
+            else:
+                continue
+            if failed:
+                regressions.append(f"{name} {key}: {previous:.3f} -> {value:.3f}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vision hot paths on synthetic hole images.")
+    parser.add_argument("--images", type=int, default=60, help="Synthetic images for the per-image benchmarks.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--holes", type=int, default=FULL_RUN_HOLES,
+                        help="Holes in the full-run benchmark (0 skips it).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Workers for the full-run benchmark.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Stored baseline to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE,
+                        help="Fraction slower than the baseline that still passes.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.images, args.seed, args.holes, args.workers)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.time_tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one.")
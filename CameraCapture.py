@@ -0,0 +1,235 @@
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+
+def synthetic_hole_frame(center=(FRAME_WIDTH // 2, FRAME_HEIGHT // 2), radius=90, noise=4.0, seed=None):
+    """Draw a 640x480 BGR frame of a dark hole on a light plate, for running without a camera."""
+    rng = np.random.default_rng(seed)
+    gray = np.full((FRAME_HEIGHT, FRAME_WIDTH), 200, np.uint8)
+    cv2.circle(gray, (int(center[0]), int(center[1])), radius, 60, -1)
+    cv2.circle(gray, (int(center[0]), int(center[1])), max(radius - 30, 1), 120, 4)
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    if noise:
+        gray = np.clip(gray + rng.normal(0, noise, gray.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+class V4L2Camera:
+    """Keeps the camera open and streaming so each hole only has to grab a frame.
+
+    V4L2 queues a few frames while the stage is moving, so grab_frame() drains
+    buffered frames first: grabs that return immediately came from the queue,
+    and the first grab that has to wait for the sensor is a frame exposed after
+    the move.
+    """
+
+    def __init__(self, device=0, width=FRAME_WIDTH, height=FRAME_HEIGHT, fps=30, max_drain=8):
+        self.device = device
+        self.fresh_frame_seconds = 0.5 / fps
+        self.max_drain = max_drain
+        self.cap = cv2.VideoCapture(device, cv2.CAP_V4L2)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Could not open camera {device}")
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        print(f"Camera {device} streaming at {int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+              f"{int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}.")
+
+    def grab_frame(self):
+        """Drop buffered frames and return the next fresh frame, or None on failure."""
+        for _ in range(self.max_drain):
+            start = time.perf_counter()
+            if not self.cap.grab():
+                print("Error grabbing frame from camera.")
+                return None
+            if time.perf_counter() - start >= self.fresh_frame_seconds:
+                break
+
+        ok, frame = self.cap.retrieve()
+        return frame if ok else None
+
+    def capture(self, filename):
+        """Grab a fresh frame and save it to filename. Returns the frame."""
+        frame = self.grab_frame()
+        if frame is not None:
+            cv2.imwrite(filename, frame)
+        return frame
+
+    def close(self):
+        self.cap.release()
+
+class FakeCamera:
+    """Camera stand-in for testing without hardware.
+
+    Frames come from frame_source(index) if given, otherwise a synthetic hole is
+    drawn at the configured offset from the image centre.
+    """
+
+    def __init__(self, frame_source=None, center_offset=(0, 0), seed=0):
+        self.frame_source = frame_source
+        self.center_offset = center_offset
+        self.seed = seed
+        self.frames_taken = 0
+
+    def grab_frame(self):
+        if self.frame_source is not None:
+            frame = self.frame_source(self.frames_taken)
+        else:
+            center = (FRAME_WIDTH // 2 + self.center_offset[0], FRAME_HEIGHT // 2 + self.center_offset[1])
+            frame = synthetic_hole_frame(center, seed=self.seed + self.frames_taken)
+        self.frames_taken += 1
+        return frame
+
+    def capture(self, filename):
+        frame = self.grab_frame()
+        if frame is not None:
+            cv2.imwrite(filename, frame)
+        return frame
+
+    def close(self):
+        pass
+
+# Settle detection: the stage is still when the centre of consecutive frames stops changing
+SETTLE_ROI_FRACTION = 0.3  # Side of the centre window, as a fraction of the frame
+SETTLE_DOWNSAMPLE = 4  # Averaging 4x4 blocks keeps sensor noise well under the threshold
+SETTLE_THRESHOLD = 2.0  # Mean absolute difference (grey levels) below which two frames count as the same
+SETTLE_STABLE_FRAMES = 2  # Consecutive unchanged frame pairs needed
+SETTLE_TIMEOUT = 1.5  # Seconds before capturing anyway
+
+class SettlingCamera:
+    """Wraps a streaming camera so grab_frame() waits for the stage to stop moving.
+
+    Replaces a fixed settle delay: frames are grabbed until the centre of the
+    image (downsampled, grayscale) differs from the previous frame by less than
+    threshold for stable_frames pairs in a row, and that last frame is returned.
+    After timeout the latest frame is returned anyway. Each wait is recorded in
+    settle_times as (seconds, settled) and the last one is in last_settle.
+    """
+
+    def __init__(self, camera, threshold=SETTLE_THRESHOLD, stable_frames=SETTLE_STABLE_FRAMES,
+                 timeout=SETTLE_TIMEOUT, roi_fraction=SETTLE_ROI_FRACTION, downsample=SETTLE_DOWNSAMPLE):
+        self.camera = camera
+        self.threshold = threshold
+        self.stable_frames = stable_frames
+        self.timeout = timeout
+        self.roi_fraction = roi_fraction
+        self.downsample = downsample
+        self.settle_times = []
+        self.last_settle = None
+
+    def _signature(self, frame):
+        """Small grayscale copy of the centre of the frame, compared between frames."""
+        height, width = frame.shape[:2]
+        half_h, half_w = int(height * self.roi_fraction / 2), int(width * self.roi_fraction / 2)
+        roi = frame[height // 2 - half_h:height // 2 + half_h, width // 2 - half_w:width // 2 + half_w]
+        if roi.ndim == 3:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(roi, (max(roi.shape[1] // self.downsample, 1), max(roi.shape[0] // self.downsample, 1)),
+                           interpolation=cv2.INTER_AREA)
+        return small.astype(np.int16)
+
+    def grab_frame(self):
+        """Return the first frame after the image has stopped changing (or the latest one at timeout)."""
+        start = time.perf_counter()
+        frame = self.camera.grab_frame()
+        if frame is None:
+            return None
+        previous = self._signature(frame)
+        stable = 0
+        settled = False
+        while time.perf_counter() - start < self.timeout:
+            frame = self.camera.grab_frame()
+            if frame is None:
+                return None
+            signature = self._signature(frame)
+            difference = np.abs(signature - previous).mean()
+            previous = signature
+            stable = stable + 1 if difference < self.threshold else 0
+            if stable >= self.stable_frames:
+                settled = True
+                break
+
+        self.last_settle = (time.perf_counter() - start, settled)
+        self.settle_times.append(self.last_settle)
+        if not settled:
+            print(f"Image still changing after {self.timeout:.1f} s, capturing anyway.")
+        return frame
+
+    def capture(self, filename):
+        frame = self.grab_frame()
+        if frame is not None:
+            cv2.imwrite(filename, frame)
+        return frame
+
+    def close(self):
+        self.camera.close()
+
+def write_image_atomic(filename, frame):
+    """Encode a frame and move it into place, so readers never see a half-written image."""
+    ok, encoded = cv2.imencode(os.path.splitext(filename)[1] or ".jpg", frame)
+    if not ok:
+        raise ValueError("could not encode frame")
+    partial = filename + ".part"
+    with open(partial, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(partial, filename)
+
+class AsyncFrameWriter:
+    """Encodes and writes frames to disk on a background thread so capture never waits on JPEG encoding.
+
+    on_written(filename), if given, is called on the writer thread after each file is saved.
+    """
+
+    def __init__(self, on_written=None, max_pending=32):
+        self.on_written = on_written
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            filename, frame = item
+            try:
+                write_image_atomic(filename, frame)
+                if self.on_written:
+                    self.on_written(filename)
+            except Exception as e:
+                print(f"Error writing {filename}: {e}")
+
+    def submit(self, filename, frame):
+        """Queue a frame for writing. The frame must not be modified afterwards."""
+        self._queue.put((filename, frame))
+
+    def close(self):
+        """Write everything still queued, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+def open_camera(backend="v4l2", device=0, settle=False):
+    """Open a persistent capture backend ("v4l2" or "fake").
+
+    Returns None for "guvcview", or if the camera can't be opened, in which case
+    guvcviewCameraControl.take_picture falls back to launching guvcview. With
+    settle=True frames are only taken once the image has stopped moving (see
+    SettlingCamera).
+    """
+    camera = None
+    if backend == "fake":
+        camera = FakeCamera()
+    elif backend == "v4l2":
+        try:
+            camera = V4L2Camera(device)
+        except Exception as e:
+            print(f"Error opening camera, falling back to guvcview: {e}")
+    if camera is not None and settle:
+        camera = SettlingCamera(camera)
+    return camera
@@ -0,0 +1,151 @@
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+class FakeArduino:
+    """Stand-in for MotorCodeWithLeapYear.ino on a pseudo-terminal.
+
+    Open self.port with pyserial or ArduinoLink as if it were /dev/ttyACM0. It
+    reads 5-character commands the same way the firmware does: hole codes and T
+    corrections are answered with '1' after move_time seconds, and RR000 with
+    "Reset complete" after reset_time seconds. X pre-compensation commands get no
+    reply, since the firmware applies them with the next move. Bytes left over
+    after a T or RR command (such as a trailing newline) are discarded, as the
+    firmware does.
+
+    A W command reads the following hole code and then behaves like the
+    firmware's row sweep: '1' for every hole to the end of the row, each
+    followed by single-byte handshakes (N next, Q stop, X/T with their 4
+    characters). sweeps records each sweep as (first hole, reverse).
+
+    Moves to a hole in another row take row_change_time and T corrections
+    correction_time (both default to move_time). The stage position is
+    tracked for fake cameras: hole is the hole the stage is at and error its
+    x error in steps, which is error_model(hole) minus any X pre-compensation
+    and less each T correction since the move. busy_seconds totals the time
+    spent moving, so a run at reduced move times can be scaled back up.
+    """
+
+    def __init__(self, move_time=0.0, reset_time=0.0, row_change_time=None, correction_time=None, error_model=None):
+        self.move_time = move_time
+        self.reset_time = reset_time
+        self.row_change_time = move_time if row_change_time is None else row_change_time
+        self.correction_time = move_time if correction_time is None else correction_time
+        self.error_model = error_model  # hole code -> x error in steps after moving there
+        self.commands = []  # Every command received, in order
+        self.sweeps = []
+        self.hole = "A0170"
+        self.error = 0
+        self.pending_fix = 0
+        self.busy_seconds = 0.0
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _read_exactly(self, count):
+        data = b""
+        while len(data) < count:
+            if not self._running:
+                return None
+            readable, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if readable:
+                try:
+                    data += os.read(self.master_fd, count - len(data))
+                except OSError:
+                    return None
+        return data
+
+    def _discard_pending(self):
+        while select.select([self.master_fd], [], [], 0.01)[0]:
+            os.read(self.master_fd, 1024)
+
+    def _busy(self, seconds):
+        time.sleep(seconds)
+        self.busy_seconds += seconds
+
+    def _reply(self, line):
+        os.write(self.master_fd, (line + "\r\n").encode())
+
+    def _serve(self):
+        while self._running:
+            raw = self._read_exactly(5)
+            if raw is None:
+                return
+            command = raw.decode('utf-8', errors='ignore')
+            self.commands.append(command)
+            self.handle_command(command)
+
+    def handle_command(self, command):
+        """Answer one command the way the firmware does."""
+        if command.startswith("W"):
+            first = self._read_exactly(5)
+            if first is not None:
+                self.sweep(first.decode('utf-8', errors='ignore'), command[1] == "R")
+        elif command.startswith("RR"):
+            self._discard_pending()
+            self._busy(self.reset_time)
+            self.hole, self.error = "A0170", 0
+            self._reply("Reset complete")
+        elif command.startswith("X"):
+            self.pending_fix = _steps(command[1:])  # Applied with the next hole move, no reply
+        elif command.startswith("T"):
+            self._discard_pending()
+            self.error -= _steps(command[1:])
+            self._busy(self.correction_time)
+            self._reply('1')
+        else:
+            self.move_to(command, self.row_change_time if command[:1] != self.hole[:1] else self.move_time)
+            self._reply('1')
+
+    def move_to(self, hole, seconds):
+        """Take seconds to reach a hole, arriving with the modelled error less the pending pre-compensation."""
+        self._busy(seconds)
+        self.error = (self.error_model(hole) if self.error_model else 0) - self.pending_fix
+        self.pending_fix = 0
+        self.hole = hole
+
+    def sweep(self, first_hole, reverse):
+        """Row sweep: report ready at each hole from first_hole to the end of its row, waiting for handshakes."""
+        self.sweeps.append((first_hole, reverse))
+        number, holes = int(first_hole[1:3]), int(first_hole[3:5])
+        while 1 <= number <= holes:
+            self.move_to(f"{first_hole[0]}{number:02d}{holes:02d}", self.move_time)
+            self._reply('1')
+            while True:
+                handshake = self._read_exactly(1)
+                if handshake is None:
+                    return
+                if handshake in (b"N", b"Q"):
+                    break
+                if handshake in (b"X", b"T"):
+                    steps = (self._read_exactly(4) or b"P000").decode('utf-8', errors='ignore')
+                    self.commands.append(handshake.decode() + steps)
+                    if handshake == b"X":
+                        self.pending_fix = _steps(steps)
+                    else:
+                        self.error -= _steps(steps)
+                        self._busy(self.correction_time)
+                        self._reply('1')
+            if handshake == b"Q":
+                return
+            number += -1 if reverse else 1
+
+    def close(self):
+        self._running = False
+        self._thread.join(timeout=1)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+def _steps(field):
+    """Signed step count from the "P012" / "N012" part of an X or T command."""
+    try:
+        steps = int(field[1:4])
+    except ValueError:
+        return 0
+    return -steps if field[:1] == "N" else steps
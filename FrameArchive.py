@@ -0,0 +1,195 @@
+import os
+import cv2
+import numpy as np
+import HoleLayout
+
+ARCHIVE_MAGIC = b"ASMLFRM1"
+ARCHIVE_EXTENSION = ".frames"
+FRAME_SHAPE = (480, 640)  # Grayscale height, width
+PLATE_CAPACITY = HoleLayout.END_COUNT  # The capture before the first hole ('b') plus every hole
+HOLE_ID_LENGTH = 8
+KEEP_ARCHIVES = 3  # Run archives kept in the image folder (about 490 MB each at full capacity)
+_HEADER_BYTES = 64  # Magic, then capacity, count, height, width as int64
+
+class FrameArchive:
+    """A run's frames as one memory-mapped file of uint8 grayscale frames indexed by hole ID.
+
+    Layout: a 64-byte header (magic, capacity, frame count, height, width), a
+    table of fixed-width hole IDs, then the frames back to back. The file is
+    mapped with np.memmap, so frame(hole_id) is a view straight into the page
+    cache: no decode, no per-hole open or stat, and readers in other processes
+    share the same pages. The count is written after each frame, so a reader
+    opening the archive during a capture run only sees complete frames.
+
+    A hole captured twice (a retake) keeps its latest frame; the earlier one
+    stays in the file but is no longer indexed.
+    """
+
+    def __init__(self, path, create=False, capacity=PLATE_CAPACITY, frame_shape=FRAME_SHAPE):
+        """Create a new archive (capture side) or open an existing one read-only."""
+        self.path = path
+        self.writable = create
+        if create:
+            height, width = frame_shape
+            size = _HEADER_BYTES + capacity * (HOLE_ID_LENGTH + height * width)
+            with open(path, "wb") as f:
+                f.write(ARCHIVE_MAGIC)
+                f.truncate(size)
+            self._map = np.memmap(path, dtype=np.uint8, mode="r+")
+            self._header()[:] = (capacity, 0, height, width)
+        else:
+            self._map = np.memmap(path, dtype=np.uint8, mode="r")
+            if bytes(self._map[:len(ARCHIVE_MAGIC)]) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a frame archive")
+
+        capacity, _, height, width = (int(n) for n in self._header())
+        self.capacity = capacity
+        self.frame_shape = (height, width)
+        offset = _HEADER_BYTES
+        self._holes = self._map[offset:offset + capacity * HOLE_ID_LENGTH].reshape(capacity, HOLE_ID_LENGTH)
+        offset += capacity * HOLE_ID_LENGTH
+        self._frames = self._map[offset:offset + capacity * height * width].reshape(capacity, height, width)
+        self.slots = {}  # hole_id -> slot
+        self._indexed = 0
+        self.refresh()
+
+    def _header(self):
+        return self._map[len(ARCHIVE_MAGIC):len(ARCHIVE_MAGIC) + 4 * 8].view(np.int64)
+
+    def __len__(self):
+        return int(self._header()[1])
+
+    def refresh(self):
+        """Index frames appended (by the capture process) since the last refresh."""
+        count = len(self)
+        for slot in range(self._indexed, count):
+            self.slots[bytes(self._holes[slot]).rstrip(b"\0").decode()] = slot
+        self._indexed = count
+
+    def put(self, hole_id, frame):
+        """Append a frame (BGR or grayscale, resized to the archive's shape if needed) and return its slot."""
+        slot = len(self)
+        if slot >= self.capacity:
+            print(f"Frame archive {self.path} is full, hole {hole_id} not archived.")
+            return None
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame.shape != self.frame_shape:
+            frame = cv2.resize(frame, (self.frame_shape[1], self.frame_shape[0]), interpolation=cv2.INTER_AREA)
+
+        self._frames[slot] = frame
+        self._holes[slot] = np.frombuffer(hole_id.encode()[:HOLE_ID_LENGTH].ljust(HOLE_ID_LENGTH, b"\0"),
+                                          dtype=np.uint8)
+        self._header()[1] = slot + 1  # Publish the frame only once it is complete
+        self.slots[hole_id] = slot
+        self._indexed = slot + 1
+        return slot
+
+    def frame(self, hole_id):
+        """Zero-copy view of a hole's frame, or None if it isn't in the archive."""
+        slot = self.slots.get(hole_id)
+        if slot is None:
+            self.refresh()
+            slot = self.slots.get(hole_id)
+        return self._frames[slot] if slot is not None else None
+
+    def frame_at(self, slot):
+        return self._frames[slot]
+
+    def holes(self):
+        """Hole IDs in the archive, in hole (sorted ID) order, as the scorer walks image files."""
+        self.refresh()
+        return sorted(self.slots)
+
+    def items(self):
+        """Yield (hole_id, frame view) in hole order, streaming through the mapping."""
+        for hole_id in self.holes():
+            yield hole_id, self._frames[self.slots[hole_id]]
+
+    def flush(self):
+        if self.writable:
+            self._map.flush()
+
+    def close(self):
+        self.flush()
+        # Dropping the views and the memmap unmaps the file
+        del self._holes, self._frames, self._map
+
+def archive_path(folder, run_id=None):
+    """Where a run's archive lives in the image folder."""
+    name = f"run_{run_id}" if run_id is not None else "scan"
+    return os.path.join(folder, name + ARCHIVE_EXTENSION)
+
+def run_archives(folder):
+    """(run_id, path) of every run archive in the folder, oldest run first."""
+    archives = []
+    for filename in os.listdir(folder):
+        name, extension = os.path.splitext(filename)
+        if extension == ARCHIVE_EXTENSION and name.startswith("run_") and name[4:].isdigit():
+            archives.append((int(name[4:]), os.path.join(folder, filename)))
+    return sorted(archives)
+
+def prune_archives(folder, keep=KEEP_ARCHIVES):
+    """Delete all but the newest keep run archives in the folder. Returns the paths removed."""
+    removed = []
+    archives = run_archives(folder)
+    for _, path in archives[:max(len(archives) - keep, 0)]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError as e:
+            print(f"Error removing old frame archive {path}: {e}")
+    return removed
+
+def import_images(image_paths, path, frame_shape=None):
+    """Build an archive from existing image files (hole ID = filename without extension)."""
+    if frame_shape is None:
+        first = cv2.imread(image_paths[0], cv2.IMREAD_GRAYSCALE) if image_paths else None
+        frame_shape = first.shape if first is not None else FRAME_SHAPE
+    archive = FrameArchive(path, create=True, capacity=max(len(image_paths), 1), frame_shape=frame_shape)
+    for image_path in image_paths:
+        frame = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if frame is None:
+            print(f"Error: Unable to load image at {image_path}")
+            continue
+        archive.put(os.path.splitext(os.path.basename(image_path))[0], frame)
+    return archive
+
+def export_images(archive, folder, holes=None, extension=".jpg"):
+    """Write frames back out as image files named by hole ID, for tools that expect a folder of JPEGs."""
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    for hole_id in holes or archive.holes():
+        frame = archive.frame(hole_id)
+        if frame is None:
+            print(f"Hole {hole_id} is not in the archive.")
+            continue
+        if cv2.imwrite(os.path.join(folder, hole_id + extension), frame):
+            written += 1
+    return written
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+    parser = argparse.ArgumentParser(description="Import, export or list a memory-mapped frame archive.")
+    parser.add_argument("archive", help="Archive file (.frames).")
+    parser.add_argument("--import-folder", metavar="FOLDER", help="Build the archive from the images in a folder.")
+    parser.add_argument("--export-folder", metavar="FOLDER", help="Write the archive's frames as JPEGs.")
+    parser.add_argument("--holes", nargs="+", help="Only export these holes.")
+    args = parser.parse_args()
+
+    if args.import_folder:
+        paths = sorted(path for path in glob.glob(os.path.join(args.import_folder, "*"))
+                       if path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+        archive = import_images(paths, args.archive)
+        print(f"Archived {len(archive)} frames to {args.archive}")
+    else:
+        archive = FrameArchive(args.archive)
+        if args.export_folder:
+            count = export_images(archive, args.export_folder, args.holes)
+            print(f"Exported {count} frames to {args.export_folder}")
+        else:
+            print(f"{args.archive}: {len(archive)}/{archive.capacity} frames of "
+                  f"{archive.frame_shape[1]}x{archive.frame_shape[0]}")
+            print(" ".join(archive.holes()))
+    archive.close()
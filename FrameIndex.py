@@ -0,0 +1,94 @@
+import os
+
+INDEX_FILENAME = "frame_index.tsv"
+
+class FrameIndex:
+    """Index of captured frames by hole ID, shared between capture and alignment.
+
+    The capture step appends one "hole_id<TAB>run_count<TAB>filename" line per
+    capture. Readers keep a dict of the lines seen so far and only read lines
+    appended since their last lookup, so finding a hole's image (or the latest
+    capture) is O(1) instead of listing and stat-ing the whole folder.
+    """
+
+    def __init__(self, folder="/home/asmluser/ImageStorage"):
+        self.path = os.path.join(folder, INDEX_FILENAME)
+        self.entries = {}  # hole_id -> (run_count, filename)
+        self.latest_hole = None
+        self._offset = 0
+        self.refresh()
+
+    def _add(self, hole_id, run_count, filename):
+        self.entries[hole_id] = (run_count, filename)
+        self.latest_hole = hole_id
+
+    def record(self, hole_id, run_count, filename):
+        """Append a capture to the index."""
+        with open(self.path, "a") as f:
+            f.write(f"{hole_id}\t{run_count}\t{filename}\n")
+            self._offset = f.tell()
+        self._add(hole_id, run_count, filename)
+
+    def refresh(self):
+        """Read any lines appended by another process since the last refresh."""
+        try:
+            if os.path.getsize(self.path) < self._offset:
+                # Index was cleared for a new run
+                self.entries.clear()
+                self.latest_hole = None
+                self._offset = 0
+            with open(self.path, "r") as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # Partially written line, pick it up next time
+                    hole_id, run_count, filename = line.rstrip("\n").split("\t")
+                    self._add(hole_id, int(run_count), filename)
+                    self._offset += len(line.encode())
+        except FileNotFoundError:
+            self.entries.clear()
+            self.latest_hole = None
+            self._offset = 0
+
+    def lookup(self, hole_id):
+        """Return (run_count, filename) for a hole, or None if it hasn't been captured."""
+        if hole_id not in self.entries:
+            self.refresh()
+        return self.entries.get(hole_id)
+
+    def latest(self):
+        """Return (hole_id, run_count, filename) for the most recent capture, or None."""
+        self.refresh()
+        if self.latest_hole is None:
+            return None
+        return (self.latest_hole,) + self.entries[self.latest_hole]
+
+    def position(self):
+        """Where the index ends now; pass to captures_since() to get only later captures."""
+        self.refresh()
+        return self._offset
+
+    def captures_since(self, position):
+        """(hole_id, run_count, filename) of every capture appended after position, in capture order."""
+        captures = []
+        try:
+            if os.path.getsize(self.path) < position:
+                position = 0  # Index was cleared for a new run
+            with open(self.path, "r") as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    hole_id, run_count, filename = line.rstrip("\n").split("\t")
+                    captures.append((hole_id, int(run_count), filename))
+        except FileNotFoundError:
+            pass
+        return captures
+
+    def clear(self):
+        """Start a new run with an empty index."""
+        with open(self.path, "w"):
+            pass
+        self.entries.clear()
+        self.latest_hole = None
+        self._offset = 0
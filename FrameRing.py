@@ -0,0 +1,85 @@
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+RING_NAME = "asml_frame_ring"
+FRAME_SHAPE = (480, 640, 3)
+HOLE_ID_LENGTH = 8
+_HEADER_BYTES = 32  # slot count and frame shape (h, w, channels) as int64
+
+class FrameRing:
+    """Fixed-size ring of captured frames in shared memory.
+
+    The capture process creates the ring and put()s each frame into the next
+    slot. Other processes attach by name and get a NumPy view of a slot with
+    frame(), without copying or decoding. Every slot carries a sequence number:
+    a reader remembers the sequence it was told about and calls is_current()
+    after using the view, because the slot is reused once the ring wraps.
+    """
+
+    def __init__(self, name=RING_NAME, slots=8, frame_shape=FRAME_SHAPE, create=False):
+        """Create the ring (capture side) or attach to it by name; attaching reads slots and shape from the header."""
+        if create:
+            size = _HEADER_BYTES + slots * (8 + HOLE_ID_LENGTH + int(np.prod(frame_shape)))
+            try:
+                shared_memory.SharedMemory(name=name).unlink()  # Left over from a crashed run
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf)[:] = (slots,) + tuple(frame_shape)
+        else:
+            self.shm = _attach(name)
+        self.owner = create
+
+        layout = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf)
+        self.slots = int(layout[0])
+        self.frame_shape = tuple(int(n) for n in layout[1:])
+        offset = _HEADER_BYTES
+        self._seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += self.slots * 8
+        self._holes = np.ndarray((self.slots, HOLE_ID_LENGTH), dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+        offset += self.slots * HOLE_ID_LENGTH
+        self._frames = np.ndarray((self.slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf,
+                                  offset=offset)
+        if create:
+            self._seqs[:] = 0
+        self._next_seq = 1
+
+    def put(self, frame, hole_id=""):
+        """Copy a frame into the next slot and return (slot, seq) for readers."""
+        seq = self._next_seq
+        self._next_seq += 1
+        slot = seq % self.slots
+
+        self._seqs[slot] = -1  # Mark the slot as being written
+        self._frames[slot] = frame
+        encoded = hole_id.encode()[:HOLE_ID_LENGTH].ljust(HOLE_ID_LENGTH, b"\0")
+        self._holes[slot] = np.frombuffer(encoded, dtype=np.uint8)
+        self._seqs[slot] = seq
+        return slot, seq
+
+    def frame(self, slot):
+        """Zero-copy view of the frame in a slot."""
+        return self._frames[slot]
+
+    def hole_id(self, slot):
+        return bytes(self._holes[slot]).rstrip(b"\0").decode()
+
+    def is_current(self, slot, seq):
+        """True if the slot still holds the frame with this sequence number."""
+        return int(self._seqs[slot]) == seq
+
+    def close(self):
+        # Views must go before the buffer can be released
+        del self._seqs, self._holes, self._frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _attach(name):
+    """Attach to an existing ring without letting this process's resource tracker unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
@@ -1,23 +1,73 @@
 import tkinter as tk
-from tkinter import ttk
-import time
-import threading
+from tkinter import messagebox, ttk
+import base64
+import math
 import subprocess
 import os
-import serial
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from ArduinoLink import ArduinoLink
+from FrameIndex import FrameIndex
+from FrameRing import FrameRing
+import HoleLayout
+from ResultStore import ResultStore
+from StatusChannel import StatusPublisher, StatusSubscriber
+
+IMAGE_FOLDER = "/home/asmluser/ImageStorage"
+SCORE_THRESHOLD = 0.60  # Same default as ImageProcessing.py --threshold
+THUMBNAIL_SIZE = (160, 120)
+STATUS_FLUSH_MS = 100  # Status events are batched and applied to the widgets at most this often
 
 # Flags
 loading_active = False
 paused = False
 showing_processing = False
 runorder_process = None
+arduino_link = None
+
+# The Tk mainloop never waits on the serial port, a subprocess or the disk. Arduino commands and
+# file work run one at a time on io_worker (so the link is only used from one thread), frames
+# are decoded on frame_worker, and results come back to the mainloop through root.after.
+io_worker = ThreadPoolExecutor(max_workers=1)
+frame_worker = ThreadPoolExecutor(max_workers=1)
+
+def run_in_background(work, on_done=None, on_error=None, worker=None):
+    """Run work() off the UI thread, then call on_done(result) or on_error(exception) on the mainloop."""
+    def task():
+        try:
+            result = work()
+        except Exception as e:
+            print(f"Background task failed: {e}")
+            if on_error:
+                root.after(0, on_error, e)
+            return
+        if on_done:
+            root.after(0, on_done, result)
+    (worker or io_worker).submit(task)
+
+def get_arduino_link():
+    """Open the Arduino link on first use and keep it for later commands."""
+    global arduino_link
+    if arduino_link is None:
+        arduino_link = ArduinoLink('/dev/ttyACM0', 9600)
+    return arduino_link
+
+def release_arduino_link():
+    """Close the link so RunOrder can own the port during a scan."""
+    global arduino_link
+    if arduino_link is not None:
+        arduino_link.close()
+        arduino_link = None
 
 def set_pause_flag(value: bool):
+    # Write the file first: RunOrder trusts it over the event, which can be dropped
     try:
         with open("/home/asmluser/ImageStorage/pause_flag.txt", "w") as file:
             file.write("1" if value else "0")
     except Exception as e:
         print(f"Error setting pause flag: {e}")
+    status_publisher.publish("paused", value)
 
 def show_hole_input_screen():
     for widget in root.winfo_children():
@@ -32,55 +82,142 @@ def show_hole_input_screen():
     hole_entry = tk.Entry(root, width=10)
     hole_entry.pack(pady=5)
 
+    retake_label = tk.Label(root, text="")
+    retake_label.pack(pady=5)
+
+    def retake(hole_code):
+        """Move to the hole, capture it under its own name and merge its score (background thread).
+
+        RetakePlanner keeps the run count and FrameIndex as they are, so a
+        retake after a full run does not overwrite another hole's image.
+        """
+        release_arduino_link()  # RetakePlanner opens the port itself
+        print(f"Retaking {hole_code}...")
+        subprocess.run(["python3", "/home/asmluser/RetakePlanner.py", "--holes", hole_code], check=True)
+        return hole_code
+
+    def retake_finished(hole_code):
+        if send_button.winfo_exists():
+            send_button.config(state=tk.NORMAL)
+            flagged_button.config(state=tk.NORMAL)
+            retake_label.config(text="")
+        messagebox.showinfo("Success", f"Retake of {hole_code} complete.")
+
+    def retake_failed(error):
+        if send_button.winfo_exists():
+            send_button.config(state=tk.NORMAL)
+            flagged_button.config(state=tk.NORMAL)
+            retake_label.config(text="")
+        messagebox.showerror("Error", f"Failed to retake: {error}")
+
     def send_hole_command():
         hole_code = hole_entry.get().strip().upper()
         if len(hole_code) == 5:
-            try:
-                ser = serial.Serial('/dev/ttyACM0', 9600, timeout=2)
-                time.sleep(2)
-                ser.write((hole_code + "\\n").encode())
-                ser.flush()
-                print(f"Sent command to Arduino: {hole_code}")
-
-                # Wait for signal from Arduino
-                print("Waiting for Arduino ready signal...")
-                while True:
-                    if ser.in_waiting > 0:
-                        response = ser.readline().decode('utf-8').strip()
-                        if response == '1':
-                            print("Arduino ready for retake.")
-                            break
-                ser.close()
-
-                # Run the capture script
-                subprocess.run(["python3", "/home/asmluser/guvcviewCameraControl"], check=True)
-                tk.messagebox.showinfo("Success", f"Retake of {hole_code} complete.")
-            except Exception as e:
-                print(f"Error during retake: {e}")
-                tk.messagebox.showerror("Error", f"Failed to retake: {e}")
+            send_button.config(state=tk.DISABLED)
+            flagged_button.config(state=tk.DISABLED)
+            retake_label.config(text=f"Moving to {hole_code}...")
+            run_in_background(lambda: retake(hole_code), retake_finished, retake_failed)
         else:
-            tk.messagebox.showerror("Input Error", "Hole code must be exactly 5 characters.")
+            messagebox.showerror("Input Error", "Hole code must be exactly 5 characters.")
 
     send_button = tk.Button(root, text="Send & Retake", command=send_hole_command)
     send_button.pack(pady=10)
 
+    def retake_flagged():
+        """Retake every hole in the cleaning log in one RetakePlanner session (background thread)."""
+        release_arduino_link()  # RetakePlanner opens the port itself
+        subprocess.run(["python3", "/home/asmluser/RetakePlanner.py"], check=True)
+        return "the flagged holes"
+
+    def start_flagged_retake():
+        send_button.config(state=tk.DISABLED)
+        flagged_button.config(state=tk.DISABLED)
+        retake_label.config(text="Retaking flagged holes...")
+        run_in_background(retake_flagged, retake_finished, retake_failed)
+
+    flagged_button = tk.Button(root, text="Retake Flagged Holes", command=start_flagged_retake)
+    flagged_button.pack(pady=5)
+
     back_button = tk.Button(root, text="Back", command=show_main_screen)
     back_button.pack(pady=5)
 
 
+class PlateMap:
+    """Canvas with one cell per hole, laid out as the plate and coloured by match score.
+
+    Rows are concentric rings (row A innermost) with each hole at its angle from
+    the row's centre line. The cells are created once; set_score() only
+    recolours a cell whose colour bucket changed, so a busy scan costs at most
+    one canvas item update per new score.
+    """
+
+    def __init__(self, parent, size=330, cell=4):
+        self.canvas = tk.Canvas(parent, width=size, height=size, bg="white", highlightthickness=0)
+        self.cells = {}
+        self.colors = {}
+        self.current = None
+        center = size / 2
+        inner = size * 0.17  # Leaves room for row A's 70 cells
+        ring_gap = (center - cell - inner) / (len(HoleLayout.ROW_SIZES) - 1)
+        for hole in HoleLayout.HOLE_IDS[1:]:
+            radius = inner + HoleLayout.ROW_INDEX[HoleLayout.row_of(hole)] * ring_gap
+            angle = math.radians(HoleLayout.angle_degrees(hole))
+            x, y = center + radius * math.sin(angle), center - radius * math.cos(angle)
+            self.cells[hole] = self.canvas.create_rectangle(x - cell / 2, y - cell / 2, x + cell / 2, y + cell / 2,
+                                                            fill=score_color(None), outline="")
+            self.colors[hole] = score_color(None)
+
+    def set_score(self, hole, score):
+        color = score_color(score)
+        if hole in self.cells and self.colors[hole] != color:
+            self.colors[hole] = color
+            self.canvas.itemconfig(self.cells[hole], fill=color)
+
+    def set_current(self, hole):
+        """Outline the hole the stage is at."""
+        if self.current in self.cells:
+            self.canvas.itemconfig(self.cells[self.current], outline="")
+        if hole in self.cells:
+            self.canvas.itemconfig(self.cells[hole], outline="black")
+            self.canvas.tag_raise(self.cells[hole])
+        self.current = hole
+
+    def clear(self):
+        for hole in self.cells:
+            self.set_score(hole, None)
+        self.set_current(None)
+
+def score_color(score, threshold=SCORE_THRESHOLD):
+    """Cell colour: grey before scoring, four shades of red below the threshold and of green above it."""
+    if score is None:
+        return "#d9d9d9"
+    if score < threshold:
+        level = int(max(score, 0) / threshold * 4)
+        return ("#7f0000", "#b30000", "#e34a33", "#fc8d59")[min(level, 3)]
+    level = int((score - threshold) / (1 - threshold) * 4)
+    return ("#a1d99b", "#74c476", "#31a354", "#006d2c")[min(level, 3)]
+
+# Scores of the current run by hole, kept across screen changes so the map can be rebuilt
+hole_scores = {}
+plate_map = None
+thumbnail_label = None
+thumbnail_image = None  # Tk does not keep its own reference to a PhotoImage
+
 def show_main_screen():
     for widget in root.winfo_children():
         widget.destroy()
     root.title("Automatic Tin Detection")
     global progress_label, progress_bar
     global start_button, stop_button, reset_button
-    global showing_processing
+    global showing_processing, plate_map, thumbnail_label
     showing_processing = False
-    progress_label = tk.Label(root, text="Image Taking: 0%")
+    controls = tk.Frame(root)
+    controls.pack(side=tk.LEFT, fill=tk.Y, padx=10)
+    progress_label = tk.Label(controls, text="Image Taking: 0%")
     progress_label.pack(pady=(10, 0))
-    progress_bar = ttk.Progressbar(root, orient="horizontal", length=300, mode='determinate')
+    progress_bar = ttk.Progressbar(controls, orient="horizontal", length=300, mode='determinate')
     progress_bar.pack(pady=10)
-    button_frame = tk.Frame(root)
+    button_frame = tk.Frame(controls)
     button_frame.pack(pady=10)
     start_button = tk.Button(button_frame, text="Start", command=start_loading)
     start_button.grid(row=0, column=0, padx=5)
@@ -88,25 +225,58 @@ def show_main_screen():
     stop_button.grid(row=0, column=1, padx=5)
     reset_button = tk.Button(button_frame, text="Reset", command=reset_loading, state=tk.DISABLED)
     reset_button.grid(row=0, column=2, padx=5)
-    goto_button = tk.Button(root, text="Go to Hole", command=show_hole_input_screen)
+    goto_button = tk.Button(controls, text="Go to Hole", command=show_hole_input_screen)
     goto_button.pack(pady=5)
+    thumbnail_label = tk.Label(controls, text="No frame yet", compound=tk.TOP)
+    thumbnail_label.pack(pady=10)
+
+    plate_map = PlateMap(root)
+    plate_map.canvas.pack(side=tk.RIGHT, padx=10, pady=10)
+    for hole, score in hole_scores.items():
+        plate_map.set_score(hole, score)
+    refresh_progress()
+
+def main_screen_showing():
+    return plate_map is not None and plate_map.canvas.winfo_exists()
 
 def read_run_count():
-    try:
-        with open("/home/asmluser/ImageStorage/run_count.txt", "r") as file:
-            return int(file.read().strip())
-    except:
-        return 0
+    return status_subscriber.get("run_count", 0)
 
 def read_image_processing_counter():
+    return status_subscriber.get("image_counter", 0)
+
+def load_saved_state():
+    """Counters and the latest run's scores from disk (background thread), for a GUI opened during or after a run."""
+    counters = {}
+    for topic, filename in (("run_count", "run_count.txt"), ("image_counter", "image_counter.txt")):
+        try:
+            with open(os.path.join(IMAGE_FOLDER, filename), "r") as file:
+                counters[topic] = int(file.read().strip())
+        except Exception:
+            pass
+    scores = {}
     try:
-        with open("/home/asmluser/ImageStorage/image_counter.txt", "r") as file:
-            return int(file.read().strip())
-    except:
-        return 0
+        store = ResultStore(os.path.join(IMAGE_FOLDER, "results.sqlite"))
+        run_id = store.latest_run()
+        if run_id is not None:
+            scores = {row[0]: row[1] for row in store.run_results(run_id)}
+        store.close()
+    except Exception as e:
+        print(f"Error loading results: {e}")
+    return counters, scores
+
+def apply_saved_state(state):
+    counters, scores = state
+    for topic, value in counters.items():
+        status_subscriber.latest.setdefault(topic, value)  # Live events that arrived meanwhile win
+    for hole, score in scores.items():
+        hole_scores.setdefault(hole, score)
+        if main_screen_showing():
+            plate_map.set_score(hole, hole_scores[hole])
+    refresh_progress()
 
 def update_progress_bar():
-    max_count = 1587
+    max_count = HoleLayout.TOTAL_HOLES
     global showing_processing
     if not showing_processing:
         run_count = read_run_count()
@@ -127,26 +297,126 @@ def update_progress_bar():
             stop_button.config(state=tk.DISABLED)
             reset_button.config(state=tk.NORMAL)
 
-def update_progress_periodically():
-    while loading_active:
-        if not paused:
-            update_progress_bar()
-        time.sleep(1)
-        root.update_idletasks()
+# Status events arrive on the subscriber's thread. They are collected here and applied in one
+# batch on the mainloop, so a burst of scores from follow mode is a single redraw.
+pending_lock = threading.Lock()
+pending_scores = {}
+pending_events = {}
+flush_scheduled = False
+
+def on_status_event(topic, value):
+    """Status channel callback (receiver thread): queue the event and schedule a flush on the Tk mainloop."""
+    global flush_scheduled
+    with pending_lock:
+        if topic == "hole_result":
+            pending_scores[value["hole"]] = value["score"]
+        elif topic in ("run_count", "image_counter", "frame"):
+            pending_events[topic] = value
+        else:
+            return
+        if flush_scheduled:
+            return
+        flush_scheduled = True
+    root.after(STATUS_FLUSH_MS, flush_status_events)
+
+def flush_status_events():
+    global flush_scheduled
+    with pending_lock:
+        scores, events = dict(pending_scores), dict(pending_events)
+        pending_scores.clear()
+        pending_events.clear()
+        flush_scheduled = False
+
+    hole_scores.update(scores)
+    if main_screen_showing():
+        for hole, score in scores.items():
+            plate_map.set_score(hole, score)
+        if "frame" in events:
+            plate_map.set_current(events["frame"]["hole"])
+    if "frame" in events:
+        request_thumbnail(events["frame"])
+    if "run_count" in events or "image_counter" in events:
+        refresh_progress()
+
+def refresh_progress():
+    if loading_active and not paused and main_screen_showing():
+        update_progress_bar()
+
+latest_frame_event = None
+thumbnail_busy = False
+
+def request_thumbnail(event):
+    """Decode a frame for the thumbnail on frame_worker. Frames arriving meanwhile replace it; only the newest is shown."""
+    global latest_frame_event, thumbnail_busy
+    latest_frame_event = event
+    if not thumbnail_busy:
+        thumbnail_busy = True
+        run_in_background(lambda: make_thumbnail(event), show_thumbnail, thumbnail_failed, frame_worker)
+
+def make_thumbnail(event):
+    """(event, base64 PNG of the downscaled frame or None), from the shared-memory frame ring or else the image file."""
+    small = None
+    if event.get("slot") is not None:
+        try:
+            ring = FrameRing()  # Attached per frame: RunOrder creates a new ring every run
+            view = ring.frame(event["slot"])
+            small = cv2.resize(view, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+            if not ring.is_current(event["slot"], event["seq"]):
+                small = None  # Overwritten while resizing
+            del view
+            ring.close()
+        except Exception as e:
+            print(f"Error reading frame ring: {e}")
+    if small is None and event.get("filename"):
+        image = cv2.imread(event["filename"])  # May not be written yet
+        if image is not None:
+            small = cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    if small is None:
+        return event, None
+    ok, png = cv2.imencode(".png", small)
+    return event, base64.b64encode(png.tobytes()).decode() if ok else None
+
+def show_thumbnail(result):
+    global thumbnail_busy, thumbnail_image
+    thumbnail_busy = False
+    event, data = result
+    if data is not None and main_screen_showing():
+        thumbnail_image = tk.PhotoImage(data=data)
+        thumbnail_label.config(image=thumbnail_image, text=event["hole"])
+    if latest_frame_event is not event:
+        request_thumbnail(latest_frame_event)
+
+def thumbnail_failed(error):
+    global thumbnail_busy
+    thumbnail_busy = False  # The next frame tries again
+
+def clear_results():
+    hole_scores.clear()
+    if main_screen_showing():
+        plate_map.clear()
+
+def launch_runorder():
+    """Hand the serial port over to RunOrder and start it (background thread)."""
+    release_arduino_link()
+    return subprocess.Popen(["python3", "/home/asmluser/RunOrder"])
+
+def runorder_started(process):
+    global runorder_process
+    runorder_process = process
+
+def runorder_failed(error):
+    print(f"Failed to launch RunOrder: {error}")
 
 def start_loading():
-    global loading_active, paused, runorder_process
+    global loading_active, paused
     loading_active = True
     paused = False
     start_button.config(state=tk.DISABLED)
     stop_button.config(state=tk.NORMAL, text="Stop")
     reset_button.config(state=tk.DISABLED)
     set_pause_flag(False)
-    try:
-        runorder_process = subprocess.Popen(["python3", "/home/asmluser/RunOrder"])
-    except Exception as e:
-        print(f"Failed to launch RunOrder: {e}")
-    threading.Thread(target=update_progress_periodically, daemon=True).start()
+    clear_results()
+    run_in_background(launch_runorder, runorder_started, runorder_failed)
 
 def stop_continue_loading():
     global paused
@@ -161,30 +431,16 @@ def stop_continue_loading():
         reset_button.config(state=tk.NORMAL)
         set_pause_flag(True)
 
-def reset_loading():
-    global loading_active, paused, showing_processing, runorder_process
-    loading_active = False
-    paused = False
-    showing_processing = False
-    set_pause_flag(False)
-    if runorder_process:
-        runorder_process.terminate()
-        runorder_process = None
+def reset_stage_and_files():
+    """Send the stage home and clear the captured images and counters (background thread)."""
     try:
-        ser = serial.Serial('/dev/ttyACM0', 9600, timeout=1)
-        time.sleep(2)
-        ser.write(b'RR000')
-        ser.flush()
-        time.sleep(2)
-        
-                
-        data = ser.readline().decode('utf-8').strip() #Read data in
+        link = get_arduino_link()
+        data = link.request("RR000", timeout=60)
         print(f"Data recieved: {data}")
-        ser.close()
     except Exception as e:
         print(f"Error sending RESET to Arduino: {e}")
     try:
-        image_folder = "/home/asmluser/ImageStorage"
+        image_folder = IMAGE_FOLDER
         for filename in os.listdir(image_folder):
             if filename.endswith(".jpg") or filename.endswith(".png"):
                 os.remove(os.path.join(image_folder, filename))
@@ -192,14 +448,33 @@ def reset_loading():
             f.write("0")
         with open(os.path.join(image_folder, "image_counter.txt"), "w") as f:
             f.write("0")
+        FrameIndex(image_folder).clear()
     except Exception as e:
         print(f"Error during reset: {e}")
-    
+
+def reset_finished(_):
+    status_subscriber.latest.clear()
+    clear_results()
+    if main_screen_showing():
+        progress_bar['value'] = 0
+        progress_label.config(text="Image Taking: 0%")
+
+def reset_loading():
+    global loading_active, paused, showing_processing, runorder_process
+    loading_active = False
+    paused = False
+    showing_processing = False
+    set_pause_flag(False)
+    if runorder_process:
+        runorder_process.terminate()
+        runorder_process = None
+    progress_label.config(text="Resetting...")
+    run_in_background(reset_stage_and_files, reset_finished, reset_finished)
 
 def on_gui_close():
     global runorder_process
     try:
-        with open("/home/asmluser/ImageStorage/image_counter.txt", "w") as file:
+        with open(os.path.join(IMAGE_FOLDER, "image_counter.txt"), "w") as file:
             file.write("0")
     except:
         pass
@@ -207,11 +482,17 @@ def on_gui_close():
     if runorder_process:
         runorder_process.terminate()
         runorder_process = None
+    io_worker.shutdown(wait=False)
+    frame_worker.shutdown(wait=False)
     root.destroy()
 
+status_publisher = StatusPublisher()
+status_subscriber = StatusSubscriber("gui", callback=on_status_event)
+
 root = tk.Tk()
 root.title("Automatic Tin Detection")
-root.geometry("350x400")
+root.geometry("720x420")
 show_main_screen()
+run_in_background(load_saved_state, apply_saved_state)
 root.protocol("WM_DELETE_WINDOW", on_gui_close)
 root.mainloop()
@@ -0,0 +1,91 @@
+STEPS_PER_REV_STAGE = 200 * 180  # Same as stepPerRevStage in MotorCodeWithLeapYear.ino
+
+# Holes in each row of the plate, in scan order
+ROW_SIZES = [
+    ('A', 70), ('B', 70), ('C', 73), ('D', 75), ('E', 77), ('F', 78), ('G', 80), ('H', 81), ('I', 82),
+    ('J', 84), ('K', 85), ('L', 87), ('M', 88), ('N', 89), ('O', 91), ('P', 92), ('Q', 94), ('R', 95), ('S', 96),
+]
+
+TOTAL_HOLES = sum(size for _, size in ROW_SIZES)  # 1587
+END_COUNT = TOTAL_HOLES + 1  # Run count once every hole has been captured (the first capture is 'b')
+BEFORE_FIRST_HOLE = 'b'  # Hole ID of the capture taken before the stage moves to the first hole
+
+def _build():
+    """Precompute every lookup once: run count -> hole ID for both scan orders, and hole ID -> row data."""
+    forward = [BEFORE_FIRST_HOLE]
+    sweep = [BEFORE_FIRST_HOLE]
+    holes = {}
+    rows = {}
+    for row_index, (letter, size) in enumerate(ROW_SIZES):
+        row = [f"{letter}{number:02d}{size}" for number in range(1, size + 1)]
+        rows[letter] = row
+        forward.extend(row)
+        # Row sweeps alternate direction so the stage never has to rewind to the row zero point
+        sweep.extend(row if row_index % 2 == 0 else row[::-1])
+        for number, hole_id in enumerate(row, start=1):
+            holes[hole_id] = (letter, number, size)
+    return tuple(forward), tuple(sweep), holes, rows
+
+HOLE_IDS, SWEEP_ORDER, _HOLES, ROW_HOLES = _build()
+HOLE_COUNTS = {hole_id: count for count, hole_id in enumerate(HOLE_IDS)}
+SWEEP_COUNTS = {hole_id: count for count, hole_id in enumerate(SWEEP_ORDER)}
+ROW_INDEX = {letter: index for index, (letter, _) in enumerate(ROW_SIZES)}
+
+def hole_id(count, sweep=False):
+    """Hole ID (the code sent to the Arduino, e.g. A0170) captured at this run count.
+
+    Count 0 and anything past the last hole give 'b'. sweep=True uses the row-sweep
+    order, where every other row is scanned in reverse.
+    """
+    order = SWEEP_ORDER if sweep else HOLE_IDS
+    return order[count] if 0 <= count < len(order) else BEFORE_FIRST_HOLE
+
+def hole_count(hole, sweep=False):
+    """Run count at which a hole is captured, or None for an unknown hole ID."""
+    return (SWEEP_COUNTS if sweep else HOLE_COUNTS).get(hole)
+
+def is_hole(hole):
+    return hole in _HOLES
+
+def row_of(hole):
+    return _HOLES[hole][0]
+
+def number_in_row(hole):
+    """Position in the row, starting from 1 at the centre line."""
+    return _HOLES[hole][1]
+
+def holes_in_row(hole):
+    return _HOLES[hole][2]
+
+def angle_degrees(hole):
+    """Angle of the hole from the row's centre line."""
+    letter, number, size = _HOLES[hole]
+    return (number - 1) * 360.0 / size
+
+def stage_steps(hole):
+    """Stage position of the hole in steps from the row zero point, as the firmware moves to it."""
+    letter, number, size = _HOLES[hole]
+    return -(number - 1) * (STEPS_PER_REV_STAGE // size)
+
+def row_axis_steps(letter):
+    """Row axis position of a row in steps from row A, as the firmware moves to it (rowAxisSteps)."""
+    index = ROW_INDEX[letter]
+    return 0 if index == 0 else 1500 + 2000 * (index - 1)
+
+def sweep_reversed(hole):
+    """True if the hole's row is scanned from its last hole back to the first in a row sweep."""
+    return ROW_INDEX[row_of(hole)] % 2 == 1
+
+def remaining_in_row(count, sweep=False):
+    """Hole IDs from the one at count to the end of its row, in scan order."""
+    order = SWEEP_ORDER if sweep else HOLE_IDS
+    first = hole_id(count, sweep)
+    if first not in _HOLES:
+        return []
+    letter = row_of(first)
+    holes = []
+    for hole in order[count:]:
+        if row_of(hole) != letter:
+            break
+        holes.append(hole)
+    return holes
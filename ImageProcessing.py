@@ -2,6 +2,24 @@ import cv2
 import numpy as np
 import os
 import csv
+import argparse
+import multiprocessing
+import time
+import hashlib
+import select
+import struct
+import ctypes
+import ctypes.util
+import queue
+from StatusChannel import StatusPublisher, StatusSubscriber
+from FrameRing import FrameRing
+from FrameArchive import FrameArchive
+from FrameIndex import FrameIndex
+import HoleLayout
+from ResultStore import ResultStore
+from ScoreCache import ScoreCache
+import Tracing
+from Tracing import span
 
 def crop_center_template(image_path, center_x, center_y, width, height, x_offset=0, y_offset=0):
     """Crop a specific region around the center from the image."""
@@ -30,22 +48,45 @@ def crop_center_template(image_path, center_x, center_y, width, height, x_offset
 
     return template
 
-def find_center_in_image(template, captured_image_path, needs_cleaning_log, threshold=0.6, method=cv2.TM_CCOEFF_NORMED):
-    """Match the template in the captured image using multi-scale template matching."""
-    captured_img = cv2.imread(captured_image_path, cv2.IMREAD_GRAYSCALE)
-    if captured_img is None:
-        print(f"Error: Unable to load image at {captured_image_path}")
-        return
+SCALES = np.linspace(0.8, 1.2, 20)  # Scaling range for the exhaustive search
+
+# Pyramid search settings, also used when building the template bank
+COARSE_FACTOR = 0.5
+COARSE_SCALE_COUNT = 5
+
+# The pyramid search is checked against the exhaustive search with
+# compare_search_modes(); its best score should stay within this much of
+# the exhaustive score (0.02 is 2 percentage points on the cleaning report).
+PYRAMID_SCORE_TOLERANCE = 0.02
+# A refined pyramid score below this means there is no clear hole for the coarse
+# pass to lock onto (a plugged hole): the best match can be anywhere, so the
+# image gets the full search. Kept above the 0.6 cleaning threshold so scores
+# near the pass/fail line are always exact.
+PYRAMID_FALLBACK_SCORE = 0.7
+
+# Cascade search settings. Scales are tried nominal first, then these few probes
+# spread over the range; a hole already above the threshold stops there, a hole
+# this far below it after the probes is failed, and the rest get every scale.
+CASCADE_PROBE_COUNT = 5
+CASCADE_FAIL_MARGIN = 0.15
+
+def match_template_multiscale(template, captured_img, method=cv2.TM_CCOEFF_NORMED, scales=SCALES, bank_entry=None):
+    """Run the multi-scale template search and return (best_val, best_loc, best_scale).
 
+    If a template bank entry is given its pre-scaled templates are used instead of
+    resizing the template for every scale.
+    """
     best_match_val = -1
     best_match_loc = None
     best_scale = 1.0
 
-    scales = np.linspace(0.8, 1.2, 20)  # Scaling range
+    if bank_entry is not None:
+        scaled_templates = zip(bank_entry["scales"], bank_entry["fine"])
+    else:
+        scaled_templates = ((scale, cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR))
+                            for scale in scales)
 
-    for scale in scales:
-        resized_template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
-        
+    for scale, resized_template in scaled_templates:
         if resized_template.shape[0] > captured_img.shape[0] or resized_template.shape[1] > captured_img.shape[1]:
             continue
 
@@ -57,74 +98,970 @@ def find_center_in_image(template, captured_image_path, needs_cleaning_log, thre
             best_match_loc = max_loc
             best_scale = scale
 
+    return best_match_val, best_match_loc, best_scale
+
+def match_template_pyramid(template, captured_img, method=cv2.TM_CCOEFF_NORMED, top_k=2, refine_margin=6,
+                           bank_entry=None):
+    """Coarse-to-fine multi-scale search.
+
+    A coarse pass matches a downsampled template against a downsampled image over
+    a few scales. The top_k coarse candidates are then refined at full resolution
+    with the exhaustive scales nearest the candidate scale, searching only a
+    small window around the candidate location. If the best refined score is
+    below PYRAMID_FALLBACK_SCORE the exhaustive search is run instead.
+    """
+    small_img = cv2.resize(captured_img, None, fx=COARSE_FACTOR, fy=COARSE_FACTOR, interpolation=cv2.INTER_AREA)
+    coarse_scales = np.linspace(SCALES[0], SCALES[-1], COARSE_SCALE_COUNT)
+    coarse_step = coarse_scales[1] - coarse_scales[0] if COARSE_SCALE_COUNT > 1 else 0
+
+    candidates = []
+    for i, scale in enumerate(coarse_scales):
+        if bank_entry is not None:
+            small_template = bank_entry["coarse"][i]
+        else:
+            small_template = cv2.resize(template, None, fx=scale * COARSE_FACTOR, fy=scale * COARSE_FACTOR,
+                                        interpolation=cv2.INTER_AREA)
+        if (small_template.shape[0] < 4 or small_template.shape[1] < 4 or
+                small_template.shape[0] > small_img.shape[0] or small_template.shape[1] > small_img.shape[1]):
+            continue
+        result = cv2.matchTemplate(small_img, small_template, method)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        candidates.append((max_val, max_loc, scale))
+
+    if not candidates:
+        return match_template_multiscale(template, captured_img, method, bank_entry=bank_entry)
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    best_match_val = -1
+    best_match_loc = None
+    best_scale = 1.0
+
+    for _, coarse_loc, coarse_scale in candidates[:top_k]:
+        full_x = int(round(coarse_loc[0] / COARSE_FACTOR))
+        full_y = int(round(coarse_loc[1] / COARSE_FACTOR))
+
+        for i, scale in enumerate(SCALES):
+            if abs(scale - coarse_scale) > coarse_step / 2 + 1e-9:
+                continue
+
+            if bank_entry is not None:
+                resized_template = bank_entry["fine"][i]
+            else:
+                resized_template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+            th, tw = resized_template.shape[:2]
+
+            x0 = max(full_x - refine_margin, 0)
+            y0 = max(full_y - refine_margin, 0)
+            x1 = min(full_x + tw + refine_margin, captured_img.shape[1])
+            y1 = min(full_y + th + refine_margin, captured_img.shape[0])
+            if x1 - x0 < tw or y1 - y0 < th:
+                continue
+
+            result = cv2.matchTemplate(captured_img[y0:y1, x0:x1], resized_template, method)
+            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+
+            if max_val > best_match_val:
+                best_match_val = max_val
+                best_match_loc = (max_loc[0] + x0, max_loc[1] + y0)
+                best_scale = scale
+
+    if best_match_val < PYRAMID_FALLBACK_SCORE:
+        return match_template_multiscale(template, captured_img, method, bank_entry=bank_entry)
+    return best_match_val, best_match_loc, best_scale
+
+def match_template_cascade(template, captured_img, method=cv2.TM_CCOEFF_NORMED, threshold=0.6, bank_entry=None):
+    """Multi-scale search that stops as soon as the pass/fail decision is clear.
+
+    The nominal scale goes first, so a clean hole usually costs one matchTemplate
+    instead of len(SCALES). Any scale's score is a lower bound on the exhaustive
+    best, so stopping at the first score >= threshold never turns a pass into a
+    fail; the returned score and location are then the first passing ones, not the best.
+    If a handful of probe scales all stay CASCADE_FAIL_MARGIN below the threshold
+    the hole is failed; only holes between the two get the remaining scales.
+    """
+    if bank_entry is not None:
+        scales, templates = bank_entry["scales"], bank_entry["fine"]
+    else:
+        scales, templates = SCALES, None
+
+    def try_scale(i):
+        if templates is not None:
+            resized_template = templates[i]
+        else:
+            resized_template = cv2.resize(template, None, fx=scales[i], fy=scales[i], interpolation=cv2.INTER_LINEAR)
+        if resized_template.shape[0] > captured_img.shape[0] or resized_template.shape[1] > captured_img.shape[1]:
+            return -1, None
+        result = cv2.matchTemplate(captured_img, resized_template, method)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    nominal = int(np.argmin(np.abs(np.asarray(scales) - 1.0)))
+    probes = [int(i) for i in np.linspace(0, len(scales) - 1, CASCADE_PROBE_COUNT).round() if i != nominal]
+    best_match_val, best_match_loc, best_index = -1, None, nominal
+    tried = set()
+
+    def search(indices):
+        nonlocal best_match_val, best_match_loc, best_index
+        for i in indices:
+            tried.add(i)
+            max_val, max_loc = try_scale(i)
+            if max_val > best_match_val:
+                best_match_val, best_match_loc, best_index = max_val, max_loc, i
+            if best_match_val >= threshold:
+                return True
+        return False
+
+    if not search([nominal] + probes) and best_match_val >= threshold - CASCADE_FAIL_MARGIN:
+        # Ambiguous: the rest of the scales, nearest the best probe first
+        search(sorted((i for i in range(len(scales)) if i not in tried), key=lambda i: abs(i - best_index)))
+
+    return best_match_val, best_match_loc, scales[best_index]
+
+def roi_around(center_x, center_y, half_width, half_height):
+    """Build an (x, y, width, height) search window around an expected hole position."""
+    return (center_x - half_width, center_y - half_height, 2 * half_width, 2 * half_height)
+
+def match_template(template, captured_img, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None, bank_entry=None,
+                   cascade_threshold=0.6):
+    """Dispatch to the exhaustive, pyramid or cascade search, optionally limited to an (x, y, w, h) ROI.
+
+    cascade_threshold is the pass/fail threshold the cascade search decides
+    against. Returned locations are always in full-image coordinates.
+    """
+    x0, y0 = 0, 0
+    if roi is not None:
+        x, y, w, h = roi
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1 = min(int(x + w), captured_img.shape[1])
+        y1 = min(int(y + h), captured_img.shape[0])
+        if x1 - x0 < template.shape[1] * SCALES[-1] or y1 - y0 < template.shape[0] * SCALES[-1]:
+            print("Search window smaller than the template, using the full image.")
+            x0, y0 = 0, 0
+        else:
+            captured_img = captured_img[y0:y1, x0:x1]
+
+    if search == "pyramid":
+        best_match_val, best_match_loc, best_scale = match_template_pyramid(template, captured_img, method,
+                                                                            bank_entry=bank_entry)
+    elif search == "cascade":
+        best_match_val, best_match_loc, best_scale = match_template_cascade(template, captured_img, method,
+                                                                            cascade_threshold, bank_entry)
+    else:
+        best_match_val, best_match_loc, best_scale = match_template_multiscale(template, captured_img, method,
+                                                                               bank_entry=bank_entry)
+
+    if best_match_loc is not None:
+        best_match_loc = (best_match_loc[0] + x0, best_match_loc[1] + y0)
+    return best_match_val, best_match_loc, best_scale
+
+def score_image(template, captured_image_path, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None, bank=None):
+    """Load a captured image and return its best match score, or None if it can't be read.
+
+    With a template bank the hole's row template (and its pre-scaled copies) is
+    used in place of the template argument.
+    """
+    match = match_image(template, captured_image_path, method, search, roi, bank)
+    return match[0] if match is not None else None
+
+def match_image(template, captured_image_path, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None, bank=None,
+                cascade_threshold=0.6):
+    """Like score_image, but return the whole match (score, location, scale), or None if the image can't be read."""
+    with span("imread", hole_number_from_path(captured_image_path)):
+        captured_img = cv2.imread(captured_image_path, cv2.IMREAD_GRAYSCALE)
+    if captured_img is None:
+        print(f"Error: Unable to load image at {captured_image_path}")
+        return None
+
+    return match_frame(template, captured_img, hole_number_from_path(captured_image_path), method, search, roi, bank,
+                       cascade_threshold)
+
+def score_frame(template, captured_img, hole_number, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None,
+                bank=None):
+    """Return the best match score for an in-memory grayscale frame."""
+    return match_frame(template, captured_img, hole_number, method, search, roi, bank)[0]
+
+def match_frame(template, captured_img, hole_number, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None,
+                bank=None, cascade_threshold=0.6):
+    """Return (score, location, scale) of the best match in an in-memory grayscale frame."""
+    bank_entry = None
+    if bank is not None:
+        bank_entry = bank_entry_for_hole(bank, hole_number)
+        template = bank_entry["template"]
+
+    with span("match_template", hole_number):
+        return match_template(template, captured_img, method, search, roi, bank_entry, cascade_threshold)
+
+def cache_key(cache, template, captured_image_path, method=cv2.TM_CCOEFF_NORMED, search="exhaustive", roi=None,
+              bank=None, cascade_threshold=0.6):
+    """ScoreCache key for an image file: its content hash and a hash of the template and search settings."""
+    image_key = cache.image_key(captured_image_path)
+    if image_key is None:
+        return None
+    if bank is not None:
+        template = bank_entry_for_hole(bank, hole_number_from_path(captured_image_path))["template"]
+    settings = (method, search, tuple(roi) if roi is not None else None, tuple(SCALES.tolist()), COARSE_FACTOR,
+                COARSE_SCALE_COUNT)
+    if search == "cascade":
+        # Cascade scores depend on where it stopped, so only other runs at the same threshold can reuse them
+        settings += (cascade_threshold, CASCADE_PROBE_COUNT, CASCADE_FAIL_MARGIN)
+    return image_key, cache.params_key(template, settings)
+
+def match_image_cached(template, captured_image_path, cache=None, **search_options):
+    """match_image, answered from the ScoreCache when this image was already matched with these settings."""
+    if cache is None:
+        return match_image(template, captured_image_path, **search_options)
+
+    key = cache_key(cache, template, captured_image_path, **search_options)
+    match = cache.get(key)
+    if match is None:
+        match = match_image(template, captured_image_path, **search_options)
+        cache.put(key, match)
+    return match
+
+def record_match(results, hole_number, match):
+    """Write a hole's match to the result store (a ResultStore.RunResults), if there is one."""
+    if results is not None and match is not None:
+        best_match_val, best_match_loc, best_scale = match
+        results.record_score(hole_number, best_match_val, best_scale, best_match_loc)
+
+def compare_search_modes(template, image_paths, roi=None, tolerance=PYRAMID_SCORE_TOLERANCE, bank=None, threshold=0.6):
+    """Score every image with each search mode and report timing against the exhaustive search.
+
+    The pyramid search is checked by its worst score difference; the cascade
+    search, whose scores stop early by design, by how many pass/fail decisions
+    at threshold agree with the exhaustive search.
+    """
+    exhaustive_time = pyramid_time = cascade_time = 0.0
+    worst_diff = 0.0
+    worst_hole = None
+    disagreements = []
+
+    for captured_image_path in image_paths:
+        captured_img = cv2.imread(captured_image_path, cv2.IMREAD_GRAYSCALE)
+        if captured_img is None:
+            continue
+
+        bank_entry = None
+        if bank is not None:
+            bank_entry = bank_entry_for_hole(bank, hole_number_from_path(captured_image_path))
+            template = bank_entry["template"]
+
+        start = time.perf_counter()
+        exhaustive_val, _, _ = match_template(template, captured_img, search="exhaustive", roi=roi,
+                                              bank_entry=bank_entry)
+        exhaustive_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        pyramid_val, _, _ = match_template(template, captured_img, search="pyramid", roi=roi,
+                                           bank_entry=bank_entry)
+        pyramid_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cascade_val, _, _ = match_template(template, captured_img, search="cascade", roi=roi, bank_entry=bank_entry,
+                                           cascade_threshold=threshold)
+        cascade_time += time.perf_counter() - start
+        if (cascade_val >= threshold) != (exhaustive_val >= threshold):
+            disagreements.append(hole_number_from_path(captured_image_path))
+
+        diff = abs(exhaustive_val - pyramid_val)
+        if diff > worst_diff:
+            worst_diff = diff
+            worst_hole = hole_number_from_path(captured_image_path)
+
+    count = max(len(image_paths), 1)
+    print(f"Exhaustive: {exhaustive_time / count * 1000:.1f} ms/image, "
+          f"Pyramid: {pyramid_time / count * 1000:.1f} ms/image, "
+          f"Cascade: {cascade_time / count * 1000:.1f} ms/image "
+          f"({exhaustive_time / max(cascade_time, 1e-9):.1f}x faster than exhaustive)")
+    print(f"Largest score difference: {worst_diff:.4f} (hole {worst_hole}), tolerance {tolerance:.4f}")
+    print(f"Cascade pass/fail agreement at {threshold:.2f}: {count - len(disagreements)}/{count}"
+          + (f", differs on {', '.join(disagreements)}" if disagreements else ""))
+    return worst_diff <= tolerance
+
+def hole_number_from_path(captured_image_path):
+    """Hole number is the image filename without its extension."""
+    return os.path.splitext(os.path.basename(captured_image_path))[0]
+
+def log_if_needs_cleaning(hole_number, best_match_val, needs_cleaning_log, threshold=0.6):
+    """Append the hole to the cleaning log if its score is below the threshold and return the new entry."""
     match_percentage = best_match_val * 100
-    hole_number = os.path.splitext(os.path.basename(captured_image_path))[0]
     is_match = best_match_val >= threshold
 
     if not is_match:
         print(f"Adding to log: Hole {hole_number}, Match: {match_percentage:.2f}%")
-        needs_cleaning_log.append([hole_number, f"{match_percentage:.2f}%"])
+        entry = [hole_number, f"{match_percentage:.2f}%"]
+        needs_cleaning_log.append(entry)
+        return entry
+    return None
+
+def find_center_in_image(template, captured_image_path, needs_cleaning_log, threshold=0.6, method=cv2.TM_CCOEFF_NORMED,
+                         search="exhaustive", roi=None, bank=None, results=None, cache=None):
+    """Match the template in the captured image using multi-scale template matching.
+
+    With results (a ResultStore.RunResults) the match is stored as soon as it is
+    made; with a ScoreCache an image matched before is not matched again.
+    """
+    hole_number = hole_number_from_path(captured_image_path)
+    with span("find_center_in_image", hole_number):
+        match = match_image_cached(template, captured_image_path, cache, method=method, search=search, roi=roi,
+                                   bank=bank, cascade_threshold=threshold)
+    if match is None:
+        return None
+
+    record_match(results, hole_number, match)
+    log_if_needs_cleaning(hole_number, match[0], needs_cleaning_log, threshold)
+    return match[0]
+
+def list_captured_images(captured_image_folder):
+    """Return the captured image paths in hole (sorted filename) order."""
+    if not os.path.exists(captured_image_folder):
+        return []
+    return [os.path.join(captured_image_folder, filename)
+            for filename in sorted(os.listdir(captured_image_folder))
+            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.JPG'))]
+
+def publish_progress(status, image_counter, total_images, hole_number=None, best_match_val=None):
+    """Publish the processing counter, progress and (if given) the hole's score on the status channel."""
+    status.publish("image_counter", image_counter)
+    status.publish("progress", (image_counter / total_images) * 100)
+    if hole_number is not None and best_match_val is not None:
+        status.publish("hole_result", {"hole": hole_number, "score": best_match_val})
+
+def write_cleaning_log(needs_cleaning_log, csv_path):
+    """Write the holes needing cleaning to the CSV report."""
+    if needs_cleaning_log:
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Hole Number', 'Percent difference from Baseline Image'])
+            for entry in needs_cleaning_log:
+                writer.writerow(entry)
+        print("Cleaning log saved.")
+    else:
+        print("No holes need cleaning.")
+
+def append_cleaning_log_entry(entry, csv_path):
+    """Append one row to the cleaning report, writing the header first if the file is new."""
+    is_new = not os.path.exists(csv_path)
+    with open(csv_path, 'a', newline='') as file:
+        writer = csv.writer(file)
+        if is_new:
+            writer.writerow(['Hole Number', 'Percent difference from Baseline Image'])
+        writer.writerow(entry)
+
+# === TEMPLATE BANK ===
+
+def build_bank_entry(template):
+    """Pre-scale a cropped template for both search modes."""
+    fine = [cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR) for scale in SCALES]
+    coarse = [cv2.resize(template, None, fx=scale * COARSE_FACTOR, fy=scale * COARSE_FACTOR,
+                         interpolation=cv2.INTER_AREA)
+              for scale in np.linspace(SCALES[0], SCALES[-1], COARSE_SCALE_COUNT)]
+    return {"template": template, "scales": SCALES, "fine": fine, "coarse": coarse}
+
+def template_bank_key(baseline_images, crop_params):
+    """Hash the baseline image bytes, crop/offset parameters and scale settings."""
+    digest = hashlib.sha256()
+    for row in sorted(baseline_images):
+        digest.update(row.encode())
+        with open(baseline_images[row], "rb") as f:
+            digest.update(f.read())
+    digest.update(repr(tuple(crop_params)).encode())
+    digest.update(SCALES.tobytes())
+    digest.update(repr((COARSE_FACTOR, COARSE_SCALE_COUNT)).encode())
+    return digest.hexdigest()[:16]
+
+def save_template_bank(bank, bank_path):
+    """Save every row's templates to a single .npz file."""
+    arrays = {"rows": np.array(sorted(bank))}
+    for row, entry in bank.items():
+        arrays[f"{row}/template"] = entry["template"]
+        for i, resized_template in enumerate(entry["fine"]):
+            arrays[f"{row}/fine_{i}"] = resized_template
+        for i, small_template in enumerate(entry["coarse"]):
+            arrays[f"{row}/coarse_{i}"] = small_template
+    np.savez(bank_path, **arrays)
+
+def load_template_bank(bank_path):
+    """Load a bank written by save_template_bank."""
+    bank = {}
+    with np.load(bank_path) as data:
+        for row in data["rows"]:
+            row = str(row)
+            bank[row] = {
+                "template": data[f"{row}/template"],
+                "scales": SCALES,
+                "fine": [data[f"{row}/fine_{i}"] for i in range(len(SCALES))],
+                "coarse": [data[f"{row}/coarse_{i}"] for i in range(COARSE_SCALE_COUNT)],
+            }
+    return bank
+
+def load_or_build_template_bank(baseline_images, crop_params, bank_dir):
+    """Load the template bank for these baselines and crop settings, building and saving it if needed.
+
+    baseline_images maps a row letter to its baseline image; the "default" entry is
+    used for any row without its own baseline. crop_params is
+    (center_x, center_y, width, height, x_offset, y_offset).
+    """
+    try:
+        key = template_bank_key(baseline_images, crop_params)
+    except OSError as e:
+        print(f"Error reading baseline image: {e}")
+        return None
+
+    bank_path = os.path.join(bank_dir, f"template_bank_{key}.npz")
+    if os.path.exists(bank_path):
+        try:
+            bank = load_template_bank(bank_path)
+            print(f"Loaded template bank {bank_path}")
+            return bank
+        except Exception as e:
+            print(f"Error loading template bank, rebuilding: {e}")
+
+    bank = {}
+    for row, image_path in baseline_images.items():
+        template = crop_center_template(image_path, *crop_params)
+        if template is None:
+            return None
+        bank[row] = build_bank_entry(template)
+
+    try:
+        os.makedirs(bank_dir, exist_ok=True)
+        save_template_bank(bank, bank_path)
+        print(f"Saved template bank {bank_path}")
+    except Exception as e:
+        print(f"Error saving template bank: {e}")
+    return bank
+
+def bank_entry_for_hole(bank, hole_number):
+    """Pick the template for the hole's row letter, falling back to the default baseline."""
+    return bank.get(hole_number[:1].upper(), bank["default"])
+
+# === BATCH ENGINE ===
+
+# Template and search options (including the template bank) held by each
+# pool worker, set once by _init_worker instead of being pickled with every task.
+_worker_template = None
+_worker_search_options = {}
+
+def _init_worker(template, search_options=None):
+    global _worker_template, _worker_search_options
+    _worker_template = template
+    _worker_search_options = search_options or {}
+    cv2.setNumThreads(1)  # One OpenCV thread per worker so the pool doesn't oversubscribe the cores
+
+def _score_task(task):
+    index, captured_image_path = task
+    match = match_image(_worker_template, captured_image_path, **_worker_search_options)
+    Tracing.flush()  # The pool is terminated, so workers never get to flush at exit
+    return index, captured_image_path, match
+
+def process_images_parallel(template, image_paths, needs_cleaning_log, threshold=0.6, workers=None,
+                            on_progress=None, search_options=None, results=None, cache=None):
+    """Score images across a process pool and append failures to the log in hole order.
+
+    on_progress(completed_count, hole_number, best_match_val) is called in the parent
+    as each image finishes, so counters can advance while the rest of the pool is
+    still working. With results (a ResultStore.RunResults) each match is stored
+    by the parent as it arrives. With a ScoreCache the parent answers images it
+    has matched before and only sends the rest to the pool.
+    """
+    scores = [None] * len(image_paths)
+    completed = 0
+
+    def finish(index, captured_image_path, match):
+        nonlocal completed
+        best_match_val = match[0] if match is not None else None
+        scores[index] = best_match_val
+        record_match(results, hole_number_from_path(captured_image_path), match)
+        completed += 1
+        print(f"Processed image {completed}: {os.path.basename(captured_image_path)}")
+        if on_progress:
+            on_progress(completed, hole_number_from_path(captured_image_path), best_match_val)
+
+    pending = list(enumerate(image_paths))
+    keys = {}
+    if cache is not None:
+        pending = []
+        for index, captured_image_path in enumerate(image_paths):
+            key = cache_key(cache, template, captured_image_path, **(search_options or {}))
+            match = cache.get(key)
+            if match is None:
+                keys[index] = key
+                pending.append((index, captured_image_path))
+            else:
+                finish(index, captured_image_path, match)
+
+    if pending:
+        with multiprocessing.Pool(processes=workers, initializer=_init_worker,
+                                  initargs=(template, search_options)) as pool:
+            for index, captured_image_path, match in pool.imap_unordered(_score_task, pending, chunksize=4):
+                if cache is not None:
+                    cache.put(keys[index], match)
+                finish(index, captured_image_path, match)
+
+    for captured_image_path, best_match_val in zip(image_paths, scores):
+        if best_match_val is not None:
+            log_if_needs_cleaning(hole_number_from_path(captured_image_path), best_match_val,
+                                  needs_cleaning_log, threshold)
+
+    return scores
+
+def process_images(template, image_paths, needs_cleaning_log, threshold=0.6, on_progress=None, search_options=None,
+                   results=None, cache=None):
+    """Score images one at a time in this process (--workers 1), in hole order. Returns the scores.
+
+    find_center_in_image uses threshold as the cascade threshold, so any
+    cascade_threshold in search_options (set for the pool workers) is left out.
+    """
+    search_options = {name: value for name, value in (search_options or {}).items() if name != "cascade_threshold"}
+    scores = []
+    for image_counter, captured_image_path in enumerate(image_paths, 1):
+        print(f"Processing image {image_counter}: {os.path.basename(captured_image_path)}")
+        best_match_val = find_center_in_image(template, captured_image_path, needs_cleaning_log, threshold=threshold,
+                                              results=results, cache=cache, **search_options)
+        scores.append(best_match_val)
+        if on_progress:
+            on_progress(image_counter, hole_number_from_path(captured_image_path), best_match_val)
+    return scores
+
+# === FRAME ARCHIVE ===
+
+_worker_archive = None
+
+def _init_archive_worker(template, search_options, archive_file):
+    """Pool initializer that also maps the archive, so tasks only carry hole IDs."""
+    global _worker_archive
+    _init_worker(template, search_options)
+    _worker_archive = FrameArchive(archive_file)
+
+def _score_archived_task(hole_number):
+    match = match_frame(_worker_template, _worker_archive.frame(hole_number), hole_number, **_worker_search_options)
+    Tracing.flush()
+    return hole_number, match
+
+def process_archive(template, archive_file, needs_cleaning_log, threshold=0.6, workers=1, on_progress=None,
+                    search_options=None, results=None):
+    """Score every frame in a FrameArchive, streaming over the memory-mapped frames in hole order.
+
+    Frames are matched straight from the mapping, with no file listing or JPEG
+    decode. With more than one worker each pool process maps the archive itself
+    and is sent hole IDs, never pixels. Returns {hole: score}.
+    """
+    search_options = search_options or {}
+    archive = FrameArchive(archive_file)
+    holes = archive.holes()
+    scores = {}
+
+    def finish(hole_number, match):
+        scores[hole_number] = match[0]
+        record_match(results, hole_number, match)
+        print(f"Processed image {len(scores)}: {hole_number}")
+        if on_progress:
+            on_progress(len(scores), hole_number, match[0])
+
+    if workers > 1:
+        with multiprocessing.Pool(processes=workers, initializer=_init_archive_worker,
+                                  initargs=(template, search_options, archive_file)) as pool:
+            for hole_number, match in pool.imap_unordered(_score_archived_task, holes, chunksize=8):
+                finish(hole_number, match)
+    else:
+        for hole_number, frame in archive.items():
+            finish(hole_number, match_frame(template, frame, hole_number, **search_options))
+    archive.close()
+
+    for hole_number in holes:
+        log_if_needs_cleaning(hole_number, scores[hole_number], needs_cleaning_log, threshold)
+    return scores
+
+# === FOLLOW MODE ===
+
+# inotify(7) constants, used through ctypes so follow mode needs no extra packages
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+def _inotify_open(folder):
+    """Return an inotify fd watching the folder for finished writes, or None if inotify is unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+def _read_inotify_names(fd):
+    """Drain pending inotify events and return the file names they refer to."""
+    names = []
+    while True:
+        try:
+            buffer = os.read(fd, 4096)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(buffer):
+            _, _, _, name_length = _INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += _INOTIFY_EVENT.size
+            name = buffer[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                names.append(os.fsdecode(name))
+
+def _is_image_file(filename):
+    return filename.lower().endswith(('.png', '.jpg', '.jpeg', '.JPG'))
+
+def watch_for_images(folder, should_stop, poll_interval=0.2, include_existing=False, on_ready=None):
+    """Yield image paths as captures finish writing them, until should_stop() returns True.
+
+    Uses inotify when available; otherwise polls the folder and yields a file once
+    its modification time has changed and settled. Images already in the folder
+    are skipped unless include_existing is set. on_ready() is called once the
+    watch is in place.
+    """
+    if include_existing:
+        for captured_image_path in list_captured_images(folder):
+            yield captured_image_path
+
+    fd = _inotify_open(folder)
+    if fd is not None:
+        if on_ready:
+            on_ready()
+        try:
+            while True:
+                stopping = should_stop()
+                select.select([fd], [], [], poll_interval)
+                for filename in _read_inotify_names(fd):
+                    if _is_image_file(filename):
+                        yield os.path.join(folder, filename)
+                if stopping:
+                    return
+        finally:
+            os.close(fd)
+
+    print("inotify unavailable, polling for new images.")
+    seen = {}
+    for entry in os.scandir(folder):
+        if _is_image_file(entry.name):
+            seen[entry.name] = entry.stat().st_mtime_ns
+    if on_ready:
+        on_ready()
+
+    while True:
+        stopping = should_stop()
+        time.sleep(poll_interval)
+        now_ns = time.time_ns()
+        for entry in os.scandir(folder):
+            if not _is_image_file(entry.name):
+                continue
+            mtime_ns = entry.stat().st_mtime_ns
+            if seen.get(entry.name) != mtime_ns and now_ns - mtime_ns > poll_interval * 1e9:
+                seen[entry.name] = mtime_ns
+                yield entry.path
+        if stopping:
+            return
+
+def follow_folder(template, captured_image_folder, needs_cleaning_log, should_stop, cleaning_log_file,
+                  threshold=0.6, on_progress=None, search_options=None, include_existing=False, on_ready=None,
+                  results=None, cache=None):
+    """Score images as they are captured and append failures to the cleaning report straight away."""
+    search_options = search_options or {}
+    image_counter = 0
+
+    for captured_image_path in watch_for_images(captured_image_folder, should_stop,
+                                                include_existing=include_existing, on_ready=on_ready):
+        image_counter += 1
+        print(f"Processing image {image_counter}: {os.path.basename(captured_image_path)}")
+
+        match = match_image_cached(template, captured_image_path, cache, **search_options)
+        best_match_val = match[0] if match is not None else None
+        record_match(results, hole_number_from_path(captured_image_path), match)
+        if best_match_val is not None:
+            entry = log_if_needs_cleaning(hole_number_from_path(captured_image_path), best_match_val,
+                                          needs_cleaning_log, threshold)
+            if entry:
+                append_cleaning_log_entry(entry, cleaning_log_file)
+
+        if on_progress:
+            on_progress(image_counter, hole_number_from_path(captured_image_path), best_match_val)
+
+    return image_counter
+
+def follow_ring(template, ring, frame_events, needs_cleaning_log, should_stop, cleaning_log_file,
+                threshold=0.6, on_progress=None, search_options=None, results=None, index=None, index_start=0):
+    """Score frames straight from the capture process's shared-memory FrameRing.
+
+    frame_events is a queue of the "frame" status events published by ScanService.
+    Each frame is converted to grayscale directly from the shared slot, with no
+    JPEG decode. If the ring has wrapped past a frame before it was read, the
+    image file written by the background writer is scored instead.
+
+    Frame events can be dropped when a queue is full, so with index (a
+    FrameIndex) any capture appended after index_start (its position() before
+    capture started) without an event is scored from its image file before
+    returning.
+    """
+    search_options = search_options or {}
+    image_counter = 0
+    started = time.time()
+    scored = set()
+
+    def finish(hole_number, filename, match):
+        nonlocal image_counter
+        best_match_val = match[0] if match is not None else None
+        record_match(results, hole_number, match)
+        scored.add(hole_number)
+
+        image_counter += 1
+        print(f"Processed image {image_counter}: {os.path.basename(filename)}")
+        if best_match_val is not None:
+            entry = log_if_needs_cleaning(hole_number, best_match_val, needs_cleaning_log, threshold)
+            if entry:
+                append_cleaning_log_entry(entry, cleaning_log_file)
+
+        if on_progress:
+            on_progress(image_counter, hole_number, best_match_val)
+
+    while True:
+        try:
+            event = frame_events.get(timeout=0.2)
+        except queue.Empty:
+            if should_stop():
+                break
+            continue
+
+        hole_number = event.get("hole") or hole_number_from_path(event["filename"])
+        match = None
+        slot, seq = event["slot"], event["seq"]
+        if slot is not None and ring.is_current(slot, seq):
+            captured_img = cv2.cvtColor(ring.frame(slot), cv2.COLOR_BGR2GRAY)
+            if ring.is_current(slot, seq):
+                match = match_frame(template, captured_img, hole_number, **search_options)
+
+        if match is None:
+            captured_image_path = wait_for_file(event["filename"], not_before=event.get("started"))
+            if captured_image_path is not None:
+                match = match_image(template, captured_image_path, **search_options)
+        finish(hole_number, event["filename"], match)
+
+    if index is not None:
+        for hole_number, _, filename in index.captures_since(index_start):
+            if hole_number in scored:
+                continue
+            print(f"No frame event for {hole_number}, scoring its image file.")
+            captured_image_path = wait_for_file(filename, not_before=started)
+            match = match_image(template, captured_image_path, **search_options) if captured_image_path else None
+            finish(hole_number, filename, match)
+    return image_counter
+
+def wait_for_file(path, timeout=5.0, not_before=None):
+    """Wait for the background writer to save a frame. Returns the path, or None on timeout.
+
+    not_before is the capture's start time: an older file at the path is a
+    previous run's image of the same hole, so it is waited past, not scored.
+    Half a second of slack covers file timestamps lagging the wall clock.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            modified = os.path.getmtime(path)
+            if not_before is None or modified >= not_before - 0.5:
+                return path
+        except OSError:
+            pass  # Not written yet
+        if time.monotonic() >= deadline:
+            print(f"Timed out waiting for {os.path.basename(path)} to be written.")
+            return None
+        time.sleep(0.05)
+
+def capture_finished(run_count_file, end_count, parent_pid=None, status=None):
+    """True once the capture loop has reached end_count, or the launching process has exited.
+
+    Uses the run count from the status channel once one has been received, and
+    run_count.txt until then.
+    """
+    if parent_pid is not None and os.getppid() != parent_pid:
+        print("Parent process exited, stopping follow mode.")
+        return True
+    if status is not None and status.get("run_count") is not None:
+        return status.get("run_count") >= end_count
+    try:
+        with open(run_count_file, "r") as file:
+            return int(file.read().strip()) >= end_count
+    except Exception:
+        return False
 
 # === MAIN PROCESSING ===
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score captured hole images against the baseline template.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (1 runs in a single process).")
+    parser.add_argument("--search", choices=["exhaustive", "pyramid", "cascade"], default="exhaustive",
+                        help="Full-frame search over every scale, coarse-to-fine pyramid search, or a cascade "
+                             "that stops once the hole clearly passes or fails the threshold.")
+    parser.add_argument("--roi", type=int, nargs=4, metavar=("X", "Y", "W", "H"),
+                        help="Only search this window around the expected hole position.")
+    parser.add_argument("--compare-search", action="store_true",
+                        help="Time the search modes and check the pyramid scores against the exhaustive ones "
+                             "(exits with status 1 if any differs by more than the tolerance).")
+    parser.add_argument("--follow", action="store_true",
+                        help="Score images as they are captured until the capture run finishes.")
+    parser.add_argument("--source", choices=["files", "ring"], default="files",
+                        help="In follow mode, watch the image folder or read frames from the capture process's shared memory.")
+    parser.add_argument("--include-existing", action="store_true",
+                        help="In follow mode, also score images already in the folder (e.g. after a restart).")
+    parser.add_argument("--status-files", action="store_true",
+                        help="Also mirror progress to image_counter.txt and progress.txt for older tools.")
+    parser.add_argument("--run-id", type=int,
+                        help="Result store run to record into (RunOrder passes its run); a new run by default.")
+    parser.add_argument("--threshold", type=float, default=0.60, help="Score below which a hole needs cleaning.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the latest unfinished run (or --run-id), skipping holes it already scored.")
+    parser.add_argument("--no-cache", action="store_true", help="Match every image even if it was matched before.")
+    parser.add_argument("--archive", metavar="FRAMES",
+                        help="Score the frames in a memory-mapped frame archive (FrameArchive.py) instead of image files.")
+    args = parser.parse_args()
+    search_options = {"search": args.search, "roi": args.roi, "cascade_threshold": args.threshold}
+
     needs_cleaning_log = []
-    image_counter = 0
-    total_images = 1587
+    total_images = HoleLayout.TOTAL_HOLES
+    search_modes_agree = True  # --compare-search exits with 1 if the pyramid scores are outside the tolerance
 
     # File paths
     # source_image_path = "/home/asmluser/Baseline Image/Baseline_Clean_Image.png"
     source_image_path = "/home/asmluser/Baseline Image/A-13.jpg"
+    template_bank_dir = "/home/asmluser/Baseline Image/template_bank"
+
+    # Baseline image per row letter; rows without their own entry use "default"
+    # e.g. "B": "/home/asmluser/Baseline Image/B-13.jpg"
+    baseline_images = {"default": source_image_path}
     captured_image_folder = "/home/asmluser/ImageStorage"
     image_counter_file = "/home/asmluser/ImageStorage/image_counter.txt"
+    progress_file = "/home/asmluser/ImageStorage/progress.txt"
+    cleaning_log_file = "/home/asmluser/ImageStorage/holes_needing_cleaning.csv"
+    run_count_file = "/home/asmluser/ImageStorage/run_count.txt"
 
     # Template crop parameters
     center_x, center_y = 150, 150
     template_width, template_height = 50, 50
     x_offset, y_offset = -15, -45
 
+    # Progress goes out on the status channel; the txt files are only an optional mirror
+    mirror_files = {"image_counter": image_counter_file, "progress": progress_file} if args.status_files else None
+    status = StatusPublisher(mirror_files=mirror_files)
+    on_progress = lambda done, hole_number, best_match_val: publish_progress(
+        status, done, total_images, hole_number, best_match_val)
+
     # Clear the counter file at the start
     with open(image_counter_file, "w") as f:
         f.write("0")
+    status.publish("image_counter", 0)
+
+    # Every match goes into the result store as it is made
+    results = store = None
+    if not args.compare_search:
+        try:
+            store = ResultStore()
+            run_id = args.run_id or (store.latest_unfinished_run() if args.resume else None)
+            if run_id is None:
+                args.resume = False
+                run_id = store.start_run("ImageProcessing.py")
+            results = store.for_run(run_id)
+        except Exception as e:
+            print(f"Error opening the result store, results will only go to the CSV: {e}")
 
-    # Crop the template
-    template = crop_center_template(source_image_path, center_x, center_y, template_width, template_height, x_offset, y_offset)
+    # Images matched before with the same template and settings are not matched again
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = ScoreCache()
+        except Exception as e:
+            print(f"Error opening the score cache, every image will be matched: {e}")
+
+    # Load (or crop and build) the template bank
+    crop_params = (center_x, center_y, template_width, template_height, x_offset, y_offset)
+    bank = load_or_build_template_bank(baseline_images, crop_params, template_bank_dir)
+    template = bank["default"]["template"] if bank else None
+    search_options["bank"] = bank
     if template is None:
         print("Failed to crop the template. Exiting.")
     else:
-        if os.path.exists(captured_image_folder):
-            for filename in sorted(os.listdir(captured_image_folder)):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.JPG')):
-                    captured_image_path = os.path.join(captured_image_folder, filename)
-
-                    image_counter += 1
-                    print(f"Processing image {image_counter}: {filename}")
-
-                    # Write image_counter for GUI
-                    try:
-                        with open(image_counter_file, "w") as file:
-                            file.write(str(image_counter))
-                    except Exception as e:
-                        print(f"Error writing image_counter.txt: {e}")
-
-                    # Run template match
-                    find_center_in_image(template, captured_image_path, needs_cleaning_log, threshold=0.60)
-
-                    # Optionally update a separate progress file
-                    progress_percentage = (image_counter / total_images) * 100
-                    try:
-                        with open('/home/asmluser/ImageStorage/progress.txt', 'w') as progress_file:
-                            progress_file.write(f"{progress_percentage:.2f}")
-                    except:
-                        pass
-
-    # Write results if needed
-    if needs_cleaning_log:
-        with open('/home/asmluser/ImageStorage/holes_needing_cleaning.csv', 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Hole Number', 'Percent difference from Baseline Image'])
-            for entry in needs_cleaning_log:
-                writer.writerow(entry)
-        print("Cleaning log saved.")
-    else:
-        print("No holes need cleaning.")
+        image_paths = list_captured_images(captured_image_folder)
+        if args.resume and results is not None:
+            done = store.scored_holes(results.run_id)
+            image_paths = [path for path in image_paths if hole_number_from_path(path) not in done]
+            print(f"Resuming run {results.run_id}: {len(done)} holes already scored, {len(image_paths)} to go.")
+
+        if args.archive:
+            process_archive(template, args.archive, needs_cleaning_log, threshold=args.threshold,
+                            workers=args.workers, on_progress=on_progress, search_options=search_options,
+                            results=results)
+        elif args.compare_search:
+            search_modes_agree = compare_search_modes(template, image_paths, roi=args.roi, bank=bank,
+                                                      threshold=args.threshold)
+        elif args.follow:
+            parent_pid = os.getppid()
+            frame_events = queue.Queue()
+            run_status = StatusSubscriber("image-processing",
+                                          callback=lambda topic, value: topic == "frame" and frame_events.put(value))
+            if os.path.exists(cleaning_log_file):
+                os.remove(cleaning_log_file)
+            # Stop on the same end condition as RunOrder.check_end_condition
+            should_stop = lambda: capture_finished(run_count_file, total_images + 1, parent_pid, run_status)
+
+            ring = None
+            if args.source == "ring":
+                try:
+                    ring = FrameRing()
+                except FileNotFoundError:
+                    print("Frame ring not found, watching the image folder instead.")
+
+            if ring is not None:
+                index = FrameIndex(captured_image_folder)
+                index_start = index.position()  # Before follow_ready: earlier lines are previous runs' captures
+                status.publish("follow_ready", True)
+                follow_ring(template, ring, frame_events, needs_cleaning_log, should_stop, cleaning_log_file,
+                            threshold=args.threshold, on_progress=on_progress, search_options=search_options,
+                            results=results, index=index, index_start=index_start)
+                ring.close()
+            else:
+                follow_folder(template, captured_image_folder, needs_cleaning_log, should_stop,
+                              cleaning_log_file=cleaning_log_file, threshold=args.threshold, on_progress=on_progress,
+                              search_options=search_options, include_existing=args.include_existing,
+                              on_ready=lambda: status.publish("follow_ready", True), results=results,
+                              cache=cache)
+            run_status.close()
+        elif args.workers > 1:
+            process_images_parallel(template, image_paths, needs_cleaning_log, threshold=args.threshold, workers=args.workers,
+                                    on_progress=on_progress, search_options=search_options, results=results,
+                                    cache=cache)
+        else:
+            process_images(template, image_paths, needs_cleaning_log, threshold=args.threshold, on_progress=on_progress,
+                           search_options=search_options, results=results, cache=cache)
+
+    # Write results if needed (follow mode has already appended them as it went)
+    if args.follow:
+        print("Cleaning log saved." if needs_cleaning_log else "No holes need cleaning.")
+    elif store is not None and results is not None:
+        # The CSV is an export of the store, so it can be regenerated after a crash (ResultStore.py --export-csv)
+        failures = store.export_cleaning_csv(results.run_id, cleaning_log_file, threshold=args.threshold)
+        print(f"Cleaning log saved ({failures} holes)." if failures else "No holes need cleaning.")
+    elif not args.compare_search:
+        write_cleaning_log(needs_cleaning_log, cleaning_log_file)
+
+    if cache is not None:
+        cache.report()
+        cache.close()
+    if store is not None:
+        if args.run_id is None and results is not None:
+            store.finish_run(results.run_id)  # Runs started by RunOrder are finished by RunOrder
+        store.close()
+
+    if not search_modes_agree:
+        raise SystemExit(1)
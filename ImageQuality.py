@@ -1,17 +1,17 @@
 import cv2
 import numpy as np
 import os
-import serial
 import time
+from ArduinoLink import ArduinoLink
+from FrameIndex import FrameIndex
+from Tracing import span, traced
 
 # Initialize the serial connection to the Arduino
 def init_serial_connection(port, baud_rate=9600):
  #   """Initialize serial connection to Arduino."""
     try:
-        ser = serial.Serial(port, baud_rate, timeout=1)  # Adjust the timeout as needed
-        print(f"Connected to Arduino on {port} at {baud_rate} baud.")
-        time.sleep(2)  # Give Arduino time to reset
-        return ser
+        with span("serial_open"):
+            return ArduinoLink(port, baud_rate)  # Waits once for the Arduino to reset
     except Exception as e:
         print(f"Error connecting to Arduino: {e}")
         return None
@@ -38,14 +38,35 @@ def send_x_distance_to_arduino(ser, x_distance):
         except Exception as e:
             print(f"Error sending data to Arduino: {e}")
 
-def detect_circle(image, min_radius=50, max_radius=200):
-    """Detect the center of the circle in an image using Canny and HoughCircles."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+# Residual (in correction steps) small enough that the T correction round trip is skipped
+CORRECTION_TOLERANCE = 2
+
+def needs_correction(x_distance, tolerance=None):
+    """True if a measured residual should be sent as a T correction (always, when tolerance is None)."""
+    return x_distance is not None and (tolerance is None or abs(x_distance) > tolerance)
+
+@traced("correction_ack")
+def wait_for_correction_ack(ser, timeout=10):
+    """Wait for the Arduino's '1' after a T correction so it isn't mistaken for the next move's ready signal."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = ser.readline().decode('utf-8', errors='ignore').strip()
+        if data == '1':
+            return True
+    print("Timed out waiting for correction acknowledgement.")
+    return False
+
+def detect_circle(image, min_radius=50, max_radius=200, annotate=True):
+    """Detect the center of the circle in an image using Canny and HoughCircles.
+
+    annotate draws the detected center onto the image; turn it off when the frame
+    is shared with other consumers.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Step 1: Canny edge detection
     edges = cv2.Canny(gray, 50, 150)
     edges_inv = cv2.bitwise_not(edges)  # Invert edges to detect white on black
-    cv2.waitKey(0)
 
     # Step 2: Use HoughCircles to detect circles
     circles = cv2.HoughCircles(edges_inv, cv2.HOUGH_GRADIENT, dp=1.2, minDist=50, 
@@ -55,19 +76,221 @@ def detect_circle(image, min_radius=50, max_radius=200):
         circles = np.uint16(np.around(circles))
         for i in circles[0, :]:
             # Draw the center of the circle (ignoring radius)
-            cv2.circle(image, (i[0], i[1]), 2, (0, 0, 255), 3)  # Red center
+            if annotate:
+                cv2.circle(image, (i[0], i[1]), 2, (0, 0, 255), 3)  # Red center
             return (i[0], i[1])  # Return center
 
     return None
 
+def detect_circle_fast(image, min_radius=50, max_radius=200, roi_fraction=0.75, downsample=0.5, annotate=True,
+                       guess=None, with_radius=False):
+    """Find the hole center in a central ROI with a coarse blob search and a sub-pixel circle fit.
+
+    Works on grayscale (a BGR frame is converted only inside the ROI). The dark
+    hole is segmented with Otsu's threshold on a downsampled ROI and located by
+    its image moments; its outline is then refined at full resolution in a small
+    window with a least-squares (Kasa) circle fit. Returns (x, y) as floats in
+    full-image coordinates, or None if no hole-sized blob is found.
+
+    guess=(x, y, radius, margin) skips the coarse search and fits the outline in
+    a window around the guess (see HoleTracker). with_radius=True returns
+    (x, y, radius).
+    """
+    height, width = image.shape[:2]
+    if guess is not None:
+        coarse_x, coarse_y, coarse_r, extra = guess
+        margin = int(coarse_r + extra) + 8
+        x0, y0 = max(int(coarse_x) - margin, 0), max(int(coarse_y) - margin, 0)
+        roi_w, roi_h = min(int(coarse_x) + margin, width) - x0, min(int(coarse_y) + margin, height) - y0
+        if roi_w < 8 or roi_h < 8:
+            return None
+        roi = image[y0:y0 + roi_h, x0:x0 + roi_w]
+        gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        coarse_x, coarse_y, level = coarse_x - x0, coarse_y - y0, None
+    else:
+        roi_w, roi_h = int(width * roi_fraction), int(height * roi_fraction)
+        x0, y0 = (width - roi_w) // 2, (height - roi_h) // 2
+        roi = image[y0:y0 + roi_h, x0:x0 + roi_w]
+        gray = roi if roi.ndim == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+
+        # Coarse: largest dark blob of a plausible size in the downsampled ROI
+        small = cv2.resize(gray, None, fx=downsample, fy=downsample, interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        level, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+
+        min_area = np.pi * (min_radius * downsample) ** 2 * 0.5
+        max_area = np.pi * (max_radius * downsample) ** 2 * 1.5
+        blobs = [c for c in contours if min_area <= cv2.contourArea(c) <= max_area]
+        if not blobs:
+            return None
+        blob = max(blobs, key=cv2.contourArea)
+        moments = cv2.moments(blob)
+        coarse_x = moments["m10"] / moments["m00"] / downsample
+        coarse_y = moments["m01"] / moments["m00"] / downsample
+        coarse_r = np.sqrt(moments["m00"] / np.pi) / downsample
+        margin = int(coarse_r * 1.3) + 4
+
+    # Fine: fit a circle to the blob outline at full resolution
+    wx0, wy0 = max(int(coarse_x) - margin, 0), max(int(coarse_y) - margin, 0)
+    wx1, wy1 = min(int(coarse_x) + margin, roi_w), min(int(coarse_y) + margin, roi_h)
+    window = cv2.GaussianBlur(gray[wy0:wy1, wx0:wx1], (5, 5), 0)
+    if level is None:
+        _, window_mask = cv2.threshold(window, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    else:
+        _, window_mask = cv2.threshold(window, level, 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(window_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+
+    center_x, center_y, radius = coarse_x, coarse_y, coarse_r
+    if contours:
+        points = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float64)
+        # Drop outline points on the window edge (hole cut off by the ROI)
+        on_edge = ((points[:, 0] <= 0) | (points[:, 1] <= 0) |
+                   (points[:, 0] >= window.shape[1] - 1) | (points[:, 1] >= window.shape[0] - 1))
+        points = points[~on_edge]
+        if guess is not None and len(points) < 10:
+            return None  # Nothing hole-like around the guess
+        if len(points) >= 10:
+            # x^2 + y^2 = 2ax + 2by + c  ->  center (a, b)
+            a_matrix = np.column_stack((2 * points[:, 0], 2 * points[:, 1], np.ones(len(points))))
+            b_vector = (points ** 2).sum(axis=1)
+            (a, b, c), *_ = np.linalg.lstsq(a_matrix, b_vector, rcond=None)
+            center_x, center_y = a + wx0, b + wy0
+            radius = np.sqrt(max(c + a * a + b * b, 0))
+
+    center = (center_x + x0, center_y + y0)
+    if annotate:
+        cv2.circle(image, (int(round(center[0])), int(round(center[1]))), 2, (0, 0, 255), 3)  # Red center
+    return center + (radius,) if with_radius else center
+
+# Circle detector used for alignment: "fast" (ROI + sub-pixel fit, falling back
+# to Hough if it finds nothing) or "hough" (the original full-frame detector)
+DETECTOR = "fast"
+
+def find_circle_center(image, detector=None, annotate=True):
+    """Run the selected circle detector (DETECTOR by default)."""
+    if (detector or DETECTOR) == "fast":
+        center = detect_circle_fast(image, annotate=annotate)
+        if center is not None:
+            return center
+    return detect_circle(image, annotate=annotate)
+
+class HoleTracker:
+    """Predicts where the next hole will appear from the holes already found in its row.
+
+    Consecutive holes in a row are photographed after near-identical moves, so the
+    hole lands in almost the same place each time. For every row letter the
+    tracker keeps an exponentially weighted running mean of the detected center
+    and radius, and of the squared distance between prediction and detection.
+    predict() turns that into a search window and radius range for
+    detect_circle_fast; a miss (nothing found, or found outside the gate) falls
+    back to the full-frame search.
+    """
+
+    def __init__(self, alpha=0.3, min_observations=2, min_gate=12.0):
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.min_gate = min_gate
+        self.rows = {}  # row letter -> {"center": (x, y), "radius": r, "residual_var": v, "count": n}
+        self.hits = 0
+        self.misses = 0
+
+    def predict(self, row):
+        """Return (center_x, center_y, radius, gate) for the row, or None without enough history."""
+        state = self.rows.get(row)
+        if state is None or state["count"] < self.min_observations or state["radius"] is None:
+            return None
+        gate = max(self.min_gate, 3 * np.sqrt(state["residual_var"]))
+        return state["center"][0], state["center"][1], state["radius"], gate
+
+    def update(self, row, center, radius=None):
+        """Fold a detected center (and radius, if known) into the row's running mean."""
+        state = self.rows.get(row)
+        if state is None:
+            self.rows[row] = {"center": (float(center[0]), float(center[1])), "radius": radius,
+                              "residual_var": self.min_gate ** 2, "count": 1}
+            return
+
+        a = self.alpha
+        residual_sq = (center[0] - state["center"][0]) ** 2 + (center[1] - state["center"][1]) ** 2
+        state["residual_var"] = (1 - a) * state["residual_var"] + a * residual_sq
+        state["center"] = ((1 - a) * state["center"][0] + a * float(center[0]),
+                           (1 - a) * state["center"][1] + a * float(center[1]))
+        if radius is not None:
+            state["radius"] = radius if state["radius"] is None else (1 - a) * state["radius"] + a * radius
+        state["count"] += 1
+
+def find_hole_center(image, hole_id=None, tracker=None, detector=None, annotate=True):
+    """Find the hole center, searching only the tracker's predicted window when it has one."""
+    row = hole_id[:1] if hole_id else None
+    prediction = tracker.predict(row) if tracker is not None and row else None
+
+    if prediction is not None:
+        predicted_x, predicted_y, radius, gate = prediction
+        found = detect_circle_fast(image, annotate=False, guess=(predicted_x, predicted_y, radius, gate),
+                                   with_radius=True)
+        if (found is not None and np.hypot(found[0] - predicted_x, found[1] - predicted_y) <= gate
+                and 0.8 * radius <= found[2] <= 1.2 * radius):
+            tracker.hits += 1
+            tracker.update(row, found[:2], found[2])
+            if annotate:
+                cv2.circle(image, (int(round(found[0])), int(round(found[1]))), 2, (0, 0, 255), 3)  # Red center
+            return found[:2]
+        tracker.misses += 1
+
+    # Full-frame search
+    radius = None
+    center = None
+    if (detector or DETECTOR) == "fast":
+        found = detect_circle_fast(image, annotate=annotate, with_radius=True)
+        if found is not None:
+            center, radius = found[:2], found[2]
+    if center is None:
+        center = detect_circle(image, annotate=annotate)
+    if center is not None and tracker is not None and row:
+        tracker.update(row, (float(center[0]), float(center[1])), radius)
+    return center
+
+def compare_detectors(image_paths):
+    """Time both detectors on a set of images and report how far apart their centers are."""
+    fast_time = hough_time = 0.0
+    differences = []
+    for image_path in image_paths:
+        frame = cv2.imread(image_path)
+        if frame is None:
+            continue
+        start = time.perf_counter()
+        hough_center = detect_circle(frame, annotate=False)
+        hough_time += time.perf_counter() - start
+
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        start = time.perf_counter()
+        fast_center = detect_circle_fast(gray, annotate=False)
+        fast_time += time.perf_counter() - start
+
+        if hough_center is not None and fast_center is not None:
+            differences.append(np.hypot(float(hough_center[0]) - fast_center[0],
+                                        float(hough_center[1]) - fast_center[1]))
+        else:
+            print(f"{os.path.basename(image_path)}: hough {hough_center}, fast {fast_center}")
+
+    count = max(len(image_paths), 1)
+    print(f"Hough: {hough_time / count * 1000:.1f} ms/image, Fast: {fast_time / count * 1000:.1f} ms/image")
+    if differences:
+        print(f"Center difference: mean {np.mean(differences):.2f} px, max {np.max(differences):.2f} px")
+
 def calculate_x_distance(circle_center, img_shape):
     """Calculate the horizontal distance between the circle center and the image center."""
     img_center_x = img_shape[1] // 2  # X-coordinate of the image center
     offset_x = circle_center[0] - img_center_x  # Horizontal distance
     return offset_x
 
+@traced("process_latest_image_in_folder")
 def process_latest_image_in_folder(folder_path, ser):
-    """Process the most recent image in a folder and detect the circle center."""
+    """Process the most recent image in a folder and detect the circle center.
+
+    Returns the correction sent to the Arduino, or None if no correction was sent.
+    """
     # Get all image files in the folder (assuming jpg, png, etc.)
     valid_image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
     
@@ -76,7 +299,7 @@ def process_latest_image_in_folder(folder_path, ser):
     
     if not images:
         print("No images found in the folder.")
-        return
+        return None
 
     # Sort images by modification time (latest first)
     images.sort(key=lambda f: os.path.getmtime(os.path.join(folder_path, f)), reverse=True)
@@ -85,40 +308,116 @@ def process_latest_image_in_folder(folder_path, ser):
     latest_image_path = os.path.join(folder_path, images[0])
     print(f"Processing the latest image: {latest_image_path}")
     
-    frame = cv2.imread(latest_image_path)
+    frame = cv2.imread(latest_image_path, cv2.IMREAD_GRAYSCALE if DETECTOR == "fast" else cv2.IMREAD_COLOR)
+    x_distance = None
 
     if frame is None:
         print(f"Error: Could not read image {latest_image_path}")
     else:
-        # Detect circle center
-        circle_center = detect_circle(frame)
-        if circle_center:
-            # Calculate the horizontal distance from the center of the image to the circle's center
-            x_distance_degrees = calculate_x_distance(circle_center, frame.shape) / 248.1111
-            x_distance = round(x_distance_degrees * 100) 
-            cv2.putText(frame, f"Center X: {circle_center[0]} X Distance: {x_distance}",
-                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            print(f"Circle center detected at {circle_center}")
-            print(f"X Distance from center: {x_distance:.2f}")
-            
-            # Send the X distance to the Arduino
-            send_x_distance_to_arduino(ser, x_distance)
+        x_distance = align_frame(frame, ser)
 
         # Display final image (Only for debugging purposes)
         #cv2.imshow(f'Processed Image - {images[0]}', frame)
         #cv2.waitKey(0)  # Wait for a key press to move to the next image
         cv2.destroyAllWindows()
 
+    return x_distance
+
+def process_hole_image(index, hole_id, ser, tolerance=None):
+    """Align the image captured for a specific hole, looked up in the frame index.
+
+    Returns (hole_id, correction sent or None), so the correction can always be
+    matched to the image it came from.
+    """
+    entry = index.lookup(hole_id)
+    if entry is None:
+        print(f"No image recorded for hole {hole_id}.")
+        return hole_id, None
+
+    _, image_path = entry
+    print(f"Processing hole {hole_id}: {image_path}")
+    frame = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE if DETECTOR == "fast" else cv2.IMREAD_COLOR)
+    if frame is None:
+        print(f"Error: Could not read image {image_path}")
+        return hole_id, None
+
+    return hole_id, align_frame(frame, ser, tolerance=tolerance)
+
+def measure_frame(frame, annotate=True, detector=None, hole_id=None, tracker=None):
+    """Detect the circle in a captured frame and return the X correction in steps, without sending it.
+
+    With annotate=False the frame is left untouched. With a HoleTracker and the
+    hole ID the search is narrowed to where the row's previous holes were found.
+    Returns None if no circle was found.
+    """
+    # Detect circle center
+    with span("detect_circle", hole_id):
+        if tracker is not None:
+            circle_center = find_hole_center(frame, hole_id, tracker, detector, annotate)
+        else:
+            circle_center = find_circle_center(frame, detector, annotate)
+    if circle_center is None:
+        return None
+
+    # Calculate the horizontal distance from the center of the image to the circle's center
+    x_distance_degrees = calculate_x_distance(circle_center, frame.shape) / 248.1111
+    x_distance = round(x_distance_degrees * 100) 
+    if annotate:
+        cv2.putText(frame, f"Center X: {circle_center[0]:.1f} X Distance: {x_distance}",
+                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+    print(f"Circle center detected at ({circle_center[0]:.1f}, {circle_center[1]:.1f})")
+    print(f"X Distance from center: {x_distance:.2f}")
+    return x_distance
+
+def align_frame(frame, ser, annotate=True, detector=None, hole_id=None, tracker=None, tolerance=None):
+    """Detect the circle in a captured frame and send the X correction to the Arduino.
+
+    Takes the frame straight from capture, so nothing is re-read from disk (see
+    measure_frame for the other options). With a tolerance, residuals within it
+    are not sent (see needs_correction). Returns the measured correction, or
+    None if no circle was found.
+    """
+    x_distance = measure_frame(frame, annotate, detector, hole_id, tracker)
+    if x_distance is None:
+        return None
+
+    # Send the X distance to the Arduino
+    if needs_correction(x_distance, tolerance):
+        send_x_distance_to_arduino(ser, x_distance)
+    else:
+        print(f"Residual {x_distance} within tolerance, no correction sent.")
+    return x_distance
+
 
 if __name__ == "__main__":
         ## Main script execution
     folder_path = "/home/asmluser/ImageStorage"  # Change to your image folder path
     arduino_port = '/dev/ttyACM0' 
 
+    import argparse
+    parser = argparse.ArgumentParser(description="Align the latest capture and send the X correction.")
+    parser.add_argument("--detector", choices=["fast", "hough"], default=DETECTOR,
+                        help="Circle detector: ROI + sub-pixel fit, or the original Hough transform.")
+    parser.add_argument("--compare-detectors", action="store_true",
+                        help="Time both detectors on every image in the folder instead of aligning.")
+    args = parser.parse_args()
+    DETECTOR = args.detector
+
+    if args.compare_detectors:
+        compare_detectors([os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path))
+                           if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff'))])
+        raise SystemExit
+
     # Initialize serial connection
     ser = init_serial_connection(arduino_port)
 
     if ser:
-        process_latest_image_in_folder(folder_path, ser)
+        # Look the latest capture up in the frame index; scan the folder only if there is no index yet
+        index = FrameIndex(folder_path)
+        latest = index.latest()
+        if latest is not None:
+            process_hole_image(index, latest[0], ser)
+        else:
+            process_latest_image_in_folder(folder_path, ser)
         ser.close()  # Close the serial connection after use
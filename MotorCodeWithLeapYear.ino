@@ -7,6 +7,28 @@ Serial should recieve a name of exactly 5 characters:
 A: Row letter (A-S)
 12: Hole number in row (starting from 1 at center line)
 34: Total holes in current row (lookup table in R-Pi)
+Moving to another row rewinds to the row zero point, moves the row axis and
+then turns on to the hole, so any hole can be sent (retakes), not just 01.
+
+"XP012" / "XN012" (no reply): feed-forward offset in steps, added to the
+next hole move. The R-Pi sends it in the same write as the hole command,
+from the offsets learned in earlier runs, so the hole usually needs no
+T correction afterwards.
+
+READY_ON_STOP: with 1, '1' is sent as soon as distanceToGo() == 0 instead of
+after a fixed 1 s settle delay, and there is no delay after it either. Only
+use it with the R-Pi's settle detection on (ADAPTIVE_SETTLE in RunOrder),
+which waits for the camera image to stop moving before capturing.
+
+"WF000" / "WR000" followed by a hole code (e.g. "WF000A0170"): row sweep.
+The stage visits every hole from the given one to the end of its row
+(F: towards the last hole, R: back towards hole 01) without returning to the
+row zero point, moving the row axis at the same time as the first hole.
+After each hole it sends '1' and waits for single-byte handshakes:
+  N         move on (after the last hole: sweep done, back to 5-char commands)
+  Q         stop the sweep at this hole
+  XP012     feed-forward offset for the next hole (as above)
+  TP012     correction at this hole, answered with '1'
 */
 
 #include <AccelStepper.h>
@@ -18,6 +40,14 @@ A: Row letter (A-S)
 #define STEP_PIN_STEP 6 //Ensure this is digital pin with ~ 
 #define DIR_PIN_STEP 2
 
+#define READY_ON_STOP 0
+#if READY_ON_STOP
+#define SETTLE_MS 0
+#else
+#define SETTLE_MS 1000  // Fixed wait for the stage to stop vibrating before and after reporting ready
+#endif
+#define SWEEP_SETTLE_MS 100  // Short settle before each ready in a row sweep; the R-Pi can also detect it
+
 AccelStepper stepperStage(AccelStepper::DRIVER, STEP_PIN_STAGE, DIR_PIN_STAGE);
 AccelStepper stepperStep(AccelStepper::DRIVER, STEP_PIN_STEP, DIR_PIN_STEP);
 
@@ -27,6 +57,76 @@ char curRow = curHole[0];
 int num = (curHole[3] - '0') * 10 + (curHole[4] - '0');  // Convert characters to an integer with charater vals
 int curRotate = stepPerRevStage / num;  // Set rotation val for new row to curRotate
 String oldHole = "";
+long pendingFix = 0;  // Feed-forward offset (X command) for the next hole move
+
+// Row axis position of a row in steps from row A: 1500 to row B, then 2000 per row
+long rowAxisSteps(char row) {
+  return row == 'A' ? 0 : 1500L + 2000L * (row - 'B');
+}
+
+char readByte() {
+  while (!Serial.available());
+  return Serial.read();
+}
+
+// Read the 3-digit signed step count that follows P/N in X and T commands
+long readSteps() {
+  char cmd[5];
+  for (int i = 0; i < 4; i++) cmd[i] = readByte();
+  cmd[4] = '\0';
+  long steps = atol(&cmd[1]);
+  return (cmd[0] == 'N') ? -steps : steps;
+}
+
+// Row sweep (W command): visit holes startNum..end of row in direction dir without stopping at the zero point
+void sweepRow(char row, int startNum, int holesInRow, int dir) {
+  long pitch = stepPerRevStage / holesInRow;
+  if (row != curRow) {
+    // New row: from the center line, as a hole command would. The row axis moves while the stage turns
+    stepperStep.moveTo(rowAxisSteps(row));
+    stepperStage.moveTo(-(startNum - 1) * pitch + pendingFix);
+  } else {
+    // Same row: turn on from the current hole, keeping any T correction already made there
+    int oldNum = (curHole[1] - '0') * 10 + (curHole[2] - '0');
+    stepperStage.move(-pitch * (startNum - oldNum) + pendingFix);
+  }
+
+  int lastNum = startNum;
+  for (int holeNum = startNum; holeNum >= 1 && holeNum <= holesInRow; holeNum += dir) {
+    if (holeNum != startNum) {
+      // Relative, like the hole command, so a T correction carries over and X offsets mean the same in both modes
+      stepperStage.move(-dir * pitch + pendingFix);
+    }
+    pendingFix = 0;
+    while (stepperStage.distanceToGo() != 0 || stepperStep.distanceToGo() != 0) {
+      stepperStage.run();
+      stepperStep.run();
+    }
+    lastNum = holeNum;
+    delay(SWEEP_SETTLE_MS);
+    Serial.println('1');
+
+    char handshake = readByte();
+    while (handshake != 'N' && handshake != 'Q') {
+      if (handshake == 'X') {
+        pendingFix = readSteps();
+      } else if (handshake == 'T') {
+        stepperStage.move(readSteps());
+        while (stepperStage.distanceToGo() != 0) stepperStage.run();
+        Serial.println('1');
+      }
+      handshake = readByte();
+    }
+    if (handshake == 'Q') break;
+  }
+
+  // Leave the state as if the last hole had been reached with a hole command
+  char hole[6];
+  sprintf(hole, "%c%02d%02d", row, lastNum, holesInRow);
+  curHole = hole;
+  curRow = row;
+  curRotate = pitch;
+}
 
 void setup() {
   Serial.begin(9600);  // Initialize serial communication
@@ -78,6 +178,25 @@ void loop() {
 
 
 
+  // Row sweep: the next 5 characters are the first hole
+  if (buffer[0] == 'W') {
+    char first[6];
+    for (int i = 0; i < 5; i++) first[i] = readByte();
+    first[5] = '\0';
+    sweepRow(first[0], (first[1] - '0') * 10 + (first[2] - '0'), (first[3] - '0') * 10 + (first[4] - '0'),
+             buffer[1] == 'R' ? -1 : 1);
+    return;
+  }
+
+  // Feed-forward offset: remember it for the next hole command, no reply
+  if (buffer[0] == 'X') {
+    pendingFix = atoi(&buffer[2]);
+    if (buffer[1] == 'N') {
+      pendingFix = -pendingFix;
+    }
+    return;
+  }
+
   //Wait for tolerance flag
   //If bad fix
 if (buffer[0] == 'T') {
@@ -102,7 +221,7 @@ if (buffer[0] == 'T') {
     while (stepperStage.distanceToGo() != 0) stepperStage.run();
 
     Serial.println('1');
-    delay(1000);
+    delay(SETTLE_MS);
     return; // Skip the rest of the loop
 }
    curHole = buffer;
@@ -113,32 +232,32 @@ if (buffer[0] == 'T') {
     int holesFromZero = (oldHole[1] - '0') * 10 + (oldHole[2] - '0') - 1;  // Convert characters to an integer with charater vals
     
     //stepperStage.move(stepPerRevStage-curRotate); //in steps
-    stepperStage.moveTo(0); //in steps
+    stepperStage.moveTo(pendingFix); //in steps, center line plus any feed-forward offset
     while(stepperStage.distanceToGo() != 0) {
       stepperStage.run();
     }
-    delay(1000);
+    delay(SETTLE_MS);
     //Adjust vertical
-    if(curRow == 'A') {
-      stepperStep.move(1500); //in steps
-      while(stepperStep.distanceToGo() != 0) {
-        stepperStep.run();
-      }
-      delay(1000);
-    }
-    else {
-      int rowDiff = curHole[0] - curRow;
-      stepperStep.move(2000*rowDiff); //in steps
-      while(stepperStep.distanceToGo() != 0) {
-        stepperStep.run();
-      }
-      delay(1000);
+    stepperStep.moveTo(rowAxisSteps(curHole[0])); //in steps
+    while(stepperStep.distanceToGo() != 0) {
+      stepperStep.run();
     }
+    delay(SETTLE_MS);
 
     //Update current rotation based on new row
     int num = (curHole[3] - '0') * 10 + (curHole[4] - '0') ;  // Convert characters to an integer with charater vals
     curRotate = stepPerRevStage / num;  // Set rotation val for new row to curRotate
     curRow = curHole[0];
+
+    // Turn on to the hole if it isn't the first in the row
+    int holeNum = (curHole[1] - '0') * 10 + (curHole[2] - '0');
+    if (holeNum > 1) {
+      stepperStage.move(-(long)curRotate * (holeNum - 1));
+      while(stepperStage.distanceToGo() != 0) {
+        stepperStage.run();
+      }
+      delay(SETTLE_MS);
+    }
     
     
   }
@@ -148,9 +267,9 @@ if (buffer[0] == 'T') {
     int moveHoles = num - oldNum;
   
 
-    if (num != oldNum) {
+    if (num != oldNum || pendingFix != 0) {
       //stepperStage.move(-curRotate*moveHoles);
-      stepperStage.move(-curRotate*moveHoles);
+      stepperStage.move(-curRotate*moveHoles + pendingFix);
 
       // Wait for the motor to finish moving
       while(stepperStage.distanceToGo() != 0) {
@@ -160,13 +279,14 @@ if (buffer[0] == 'T') {
   
       
     }
-    delay(1000);
+    delay(SETTLE_MS);
 
   }
+  pendingFix = 0;
 
 
   //Send update to say picture is ready
   Serial.println('1');
-  delay(1000);
+  delay(SETTLE_MS);
 
 }
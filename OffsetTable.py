@@ -0,0 +1,61 @@
+import json
+import os
+
+OFFSET_TABLE_PATH = "/home/asmluser/Baseline Image/offset_table.json"
+
+class OffsetTable:
+    """X correction learned per hole from past runs, used to pre-compensate hole commands.
+
+    The stage error at a hole is largely systematic (step rounding across a row,
+    backlash, plate mounting), so the total correction a hole needed last time is
+    a good prediction for the next run. For each hole ID the table keeps an
+    exponentially weighted mean of that total (pre-compensation sent with the
+    hole command plus the residual measured after the move). RunOrder sends the rounded mean with the hole command, and the T
+    correction round trip is only needed when the measured residual is outside
+    the tolerance.
+    """
+
+    def __init__(self, path=OFFSET_TABLE_PATH, alpha=0.5):
+        self.path = path
+        self.alpha = alpha
+        self.entries = {}  # hole_id -> {"offset": mean steps, "count": runs}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            print(f"Error reading offset table {self.path}, starting empty: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Write the table atomically so an interrupted run can't leave a corrupt file."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".part"
+            with open(temp_path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving offset table {self.path}: {e}")
+
+    def predict(self, hole_id):
+        """Return the pre-compensation (in correction steps) to send with a hole command, 0 if unknown."""
+        entry = self.entries.get(hole_id)
+        if entry is None:
+            return 0
+        return int(round(entry["offset"]))
+
+    def record(self, hole_id, applied, residual):
+        """Learn from one hole: applied pre-compensation plus the residual measured after the move."""
+        total = applied + residual
+        entry = self.entries.get(hole_id)
+        if entry is None:
+            self.entries[hole_id] = {"offset": float(total), "count": 1}
+            return
+
+        entry["offset"] += self.alpha * (total - entry["offset"])
+        entry["count"] += 1
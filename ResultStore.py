@@ -0,0 +1,190 @@
+import csv
+import sqlite3
+import time
+
+RESULTS_DB = "/home/asmluser/ImageStorage/results.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    finished REAL,
+    note TEXT
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL,
+    hole TEXT NOT NULL,
+    score REAL NOT NULL,
+    scale REAL,
+    loc_x INTEGER,
+    loc_y INTEGER,
+    scored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alignments (
+    run_id INTEGER NOT NULL,
+    hole TEXT NOT NULL,
+    x_offset INTEGER,
+    captured_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_run_hole ON scores (run_id, hole);
+CREATE INDEX IF NOT EXISTS scores_hole ON scores (hole, run_id);
+CREATE INDEX IF NOT EXISTS alignments_run_hole ON alignments (run_id, hole);
+"""
+
+class ResultStore:
+    """Append-only SQLite store of every hole's result, across runs.
+
+    Each scored hole (score, best scale, match location) and each aligned hole
+    (correction offset) is inserted as soon as it finishes, so a crash loses at
+    most the hole in progress. Rows are never updated: a hole scored twice in a
+    run (e.g. a retake) has two rows and queries use the latest. The database is
+    in WAL mode, so RunOrder, the scorer and the GUI can read and write it at
+    the same time.
+    """
+
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # A power cut can lose the last few holes, never corrupt the file
+        self.db.executescript(_SCHEMA)
+
+    def start_run(self, note=None):
+        """Open a new run and return its ID."""
+        return self.db.execute("INSERT INTO runs (started, note) VALUES (?, ?)", (time.time(), note)).lastrowid
+
+    def finish_run(self, run_id):
+        self.db.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def latest_run(self):
+        row = self.db.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return row[0]
+
+    def latest_finished_run(self, note):
+        """Most recent completed run started with this note (e.g. "RunOrder"), or None."""
+        row = self.db.execute("SELECT MAX(run_id) FROM runs WHERE finished IS NOT NULL AND note = ?",
+                              (note,)).fetchone()
+        return row[0]
+
+    def latest_unfinished_run(self):
+        row = self.db.execute("SELECT MAX(run_id) FROM runs WHERE finished IS NULL").fetchone()
+        return row[0]
+
+    def latest_scored_run(self):
+        """Most recent run with any scores (a scan, not an alignment-only retake session), or None."""
+        row = self.db.execute("SELECT MAX(run_id) FROM scores").fetchone()
+        return row[0]
+
+    def scored_holes(self, run_id):
+        """Holes that already have a score in a run (for resuming it)."""
+        return {hole for (hole,) in self.db.execute("SELECT DISTINCT hole FROM scores WHERE run_id = ?", (run_id,))}
+
+    def record_score(self, run_id, hole, score, scale=None, location=None):
+        loc_x, loc_y = (int(location[0]), int(location[1])) if location is not None else (None, None)
+        self.db.execute("INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, hole, float(score), None if scale is None else float(scale), loc_x, loc_y,
+                         time.time()))
+
+    def record_alignment(self, run_id, hole, x_offset):
+        self.db.execute("INSERT INTO alignments VALUES (?, ?, ?, ?)", (run_id, hole, x_offset, time.time()))
+
+    def run_results(self, run_id):
+        """Latest result per hole of a run: (hole, score, scale, loc_x, loc_y, scored_at, x_offset, captured_at)."""
+        return self.db.execute("""
+            SELECT s.hole, s.score, s.scale, s.loc_x, s.loc_y, s.scored_at, a.x_offset, a.captured_at
+            FROM scores s
+            LEFT JOIN alignments a ON a.rowid = (
+                SELECT MAX(rowid) FROM alignments WHERE run_id = s.run_id AND hole = s.hole)
+            WHERE s.rowid IN (SELECT MAX(rowid) FROM scores WHERE run_id = ? GROUP BY hole)
+            ORDER BY s.hole""", (run_id,)).fetchall()
+
+    def row_times(self, run_id):
+        """Seconds per hole for each row of a run, from its alignment timestamps: {row letter: (seconds, holes)}."""
+        times = {}
+        for row, first, last, holes in self.db.execute("""
+                SELECT substr(hole, 1, 1), MIN(captured_at), MAX(captured_at), COUNT(DISTINCT hole)
+                FROM alignments WHERE run_id = ? GROUP BY substr(hole, 1, 1)""", (run_id,)):
+            if holes > 1:
+                times[row] = ((last - first) / (holes - 1), holes)
+        return times
+
+    def holes_below(self, threshold=0.6, last_runs=5):
+        """Holes scoring below threshold in any of the last runs: (hole, run_id, score), by hole then run."""
+        return self.db.execute("""
+            SELECT hole, run_id, score FROM scores
+            WHERE rowid IN (
+                SELECT MAX(rowid) FROM scores
+                WHERE run_id IN (SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?)
+                GROUP BY run_id, hole)
+              AND score < ?
+            ORDER BY hole, run_id""", (last_runs, threshold)).fetchall()
+
+    def hole_history(self, hole):
+        """Every score a hole has had: (run_id, score, scored_at), oldest first."""
+        return self.db.execute("SELECT run_id, score, scored_at FROM scores WHERE hole = ? ORDER BY rowid",
+                               (hole,)).fetchall()
+
+    def export_cleaning_csv(self, run_id, csv_path, threshold=0.6):
+        """Write holes_needing_cleaning.csv for a run, in the same format ImageProcessing.py always has."""
+        failures = [(hole, score) for hole, score, *_ in self.run_results(run_id) if score < threshold]
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Hole Number', 'Percent difference from Baseline Image'])
+            for hole, score in failures:
+                writer.writerow([hole, f"{score * 100:.2f}%"])
+        return len(failures)
+
+    def for_run(self, run_id):
+        """Recorder bound to one run, for code that only writes results (see RunResults)."""
+        return RunResults(self, run_id)
+
+    def close(self):
+        self.db.close()
+
+class RunResults:
+    """Writes one run's results; passed as results= through the scoring and alignment code."""
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+
+    def record_score(self, hole, score, scale=None, location=None):
+        try:
+            self.store.record_score(self.run_id, hole, score, scale, location)
+        except sqlite3.Error as e:
+            print(f"Error recording score for hole {hole}: {e}")
+
+    def record_alignment(self, hole, x_offset):
+        try:
+            self.store.record_alignment(self.run_id, hole, x_offset)
+        except sqlite3.Error as e:
+            print(f"Error recording alignment for hole {hole}: {e}")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Query hole results across runs.")
+    parser.add_argument("--db", default=RESULTS_DB)
+    parser.add_argument("--threshold", type=float, default=0.60)
+    parser.add_argument("--below", action="store_true", help="List holes below the threshold in recent runs.")
+    parser.add_argument("--runs", type=int, default=5, help="How many recent runs --below looks at.")
+    parser.add_argument("--hole", help="Show one hole's score history.")
+    parser.add_argument("--export-csv", metavar="CSV", help="Write the cleaning report for a run.")
+    parser.add_argument("--run-id", type=int, help="Run for --export-csv (default: latest).")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.below:
+        for hole, run_id, score in store.holes_below(args.threshold, args.runs):
+            print(f"{hole}\trun {run_id}\t{score * 100:.2f}%")
+    elif args.hole:
+        for run_id, score, scored_at in store.hole_history(args.hole):
+            print(f"run {run_id}\t{score * 100:.2f}%\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(scored_at))}")
+    elif args.export_csv:
+        run_id = args.run_id or store.latest_run()
+        count = store.export_cleaning_csv(run_id, args.export_csv, args.threshold)
+        print(f"Run {run_id}: {count} holes need cleaning, written to {args.export_csv}")
+    else:
+        for run_id, started, finished, note in store.db.execute("SELECT * FROM runs ORDER BY run_id"):
+            status = "finished" if finished else "incomplete"
+            print(f"run {run_id}\t{time.strftime('%Y-%m-%d %H:%M', time.localtime(started))}\t{status}\t{note or ''}")
+    store.close()
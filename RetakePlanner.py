@@ -0,0 +1,255 @@
+import argparse
+import csv
+import os
+import time
+import cv2
+import HoleLayout
+import ImageProcessing
+from ArduinoLink import SWEEP_STOP, sweep_command
+from CameraCapture import open_camera
+from ResultStore import ResultStore
+from ScanService import SCRIPT_DIR, ScanService, load_script_module
+from StatusChannel import StatusSubscriber
+
+run_order = load_script_module("RunOrder", os.path.join(SCRIPT_DIR, "RunOrder"))
+
+IMAGE_FOLDER = "/home/asmluser/ImageStorage"
+CLEANING_LOG_FILE = "/home/asmluser/ImageStorage/holes_needing_cleaning.csv"
+# Same baseline and template crop as ImageProcessing.py, so retake scores compare with the scan's
+BASELINE_IMAGES = {"default": "/home/asmluser/Baseline Image/A-13.jpg"}
+TEMPLATE_BANK_DIR = "/home/asmluser/Baseline Image/template_bank"
+CROP_PARAMS = (150, 150, 50, 50, -15, -45)
+
+RESET_STATE = ("A", 1)  # Firmware position after RR000: row A, hole 01
+
+def read_cleaning_log(csv_path=CLEANING_LOG_FILE):
+    """Hole IDs listed in holes_needing_cleaning.csv, in file order (unknown IDs are skipped)."""
+    holes = []
+    try:
+        with open(csv_path, newline='') as file:
+            for row in csv.reader(file):
+                if row and HoleLayout.is_hole(row[0].strip()):
+                    holes.append(row[0].strip())
+    except FileNotFoundError:
+        print(f"No cleaning log at {csv_path}.")
+    return holes
+
+def holes_below_threshold(store, run_id, threshold=0.6):
+    """Holes of a run whose latest score is below threshold."""
+    return [hole for hole, score, *_ in store.run_results(run_id) if score < threshold and HoleLayout.is_hole(hole)]
+
+def _stage_seconds(steps):
+    return run_order.move_seconds(steps, run_order.STAGE_MAX_SPEED, run_order.STAGE_ACCELERATION)
+
+def _row_axis_seconds(steps):
+    return run_order.move_seconds(steps, run_order.ROW_AXIS_MAX_SPEED, run_order.ROW_AXIS_ACCELERATION)
+
+def _pitch(letter):
+    return HoleLayout.STEPS_PER_REV_STAGE // len(HoleLayout.ROW_HOLES[letter])
+
+def hole_move_seconds(state, hole, sweep_entry=False):
+    """Firmware time to get from state (row letter, hole number) to a hole and take the next command.
+
+    Within a row the stage turns straight to the hole. A hole command to another
+    row rewinds the stage to the row zero point, moves the row axis and turns on
+    to the hole, settling after each. With sweep_entry (W firmware) a new row
+    is entered with a one-hole row sweep instead: the stage turns straight to
+    the hole while the row axis moves, with only the short sweep settle.
+    """
+    letter, number = state
+    target_letter, target_number = HoleLayout.row_of(hole), HoleLayout.number_in_row(hole)
+    settle = run_order.SETTLE_SECONDS
+    if target_letter == letter:
+        # Settles before the ready signal and again before the next command is read
+        return _stage_seconds(abs(target_number - number) * _pitch(letter)) + 2 * settle
+
+    position = (number - 1) * _pitch(letter)
+    target_position = (target_number - 1) * _pitch(target_letter)
+    row_axis = _row_axis_seconds(abs(HoleLayout.row_axis_steps(target_letter) - HoleLayout.row_axis_steps(letter)))
+    if sweep_entry:
+        return max(_stage_seconds(abs(target_position - position)), row_axis) + run_order.SWEEP_SETTLE_SECONDS
+    seconds = _stage_seconds(position) + settle + row_axis + settle
+    if target_number > 1:
+        seconds += _stage_seconds(target_position) + settle
+    return seconds + settle
+
+def sequence_seconds(holes, sweep_entry=False, start=RESET_STATE):
+    """Estimated motion time to visit holes in the given order."""
+    seconds = 0.0
+    state = start
+    for hole in holes:
+        seconds += hole_move_seconds(state, hole, sweep_entry)
+        state = (HoleLayout.row_of(hole), HoleLayout.number_in_row(hole))
+    return seconds
+
+def plan_retakes(holes, sweep_entry=False, start=RESET_STATE):
+    """Order holes for the least estimated stage time. Returns (ordered holes, estimated motion seconds).
+
+    Rows are visited in plate order, since the row axis only has to travel
+    down the plate once. Within a row the holes lie along one arc, so the
+    row is covered from one end to the other; which end to enter from
+    depends on where the previous row was left and what the row change
+    costs, and is chosen for all rows together by keeping the cheapest plan
+    ending at each end of each row.
+    """
+    rows = {}
+    for hole in dict.fromkeys(holes):
+        if HoleLayout.is_hole(hole):
+            rows.setdefault(HoleLayout.row_of(hole), []).append(hole)
+
+    plans = {start: (0.0, [])}  # Stage state at the end of the plan -> (seconds, holes)
+    for letter, _ in HoleLayout.ROW_SIZES:
+        if letter not in rows:
+            continue
+        row = sorted(rows[letter], key=HoleLayout.number_in_row)
+        across_row = sequence_seconds(row[1:], start=(letter, HoleLayout.number_in_row(row[0])))
+        extended = {}
+        for order in (row, row[::-1]):
+            seconds, plan = min(((seconds + hole_move_seconds(state, order[0], sweep_entry), plan)
+                                 for state, (seconds, plan) in plans.items()), key=lambda option: option[0])
+            end = (letter, HoleLayout.number_in_row(order[-1]))
+            if end not in extended or seconds + across_row < extended[end][0]:
+                extended[end] = (seconds + across_row, plan + order)
+        plans = extended
+    seconds, plan = min(plans.values(), key=lambda option: option[0])
+    return plan, seconds
+
+def print_plan(plan, seconds, listed, sweep_entry=False):
+    """Print the planned order with its estimate against the listed order and a full rescan."""
+    if not plan:
+        print("No holes to retake.")
+        return
+    rows = sorted({HoleLayout.row_of(hole) for hole in plan}, key=HoleLayout.ROW_INDEX.get)
+    full_scan = sum(run_order.estimated_row_seconds(letter, sweep=False) for letter, _ in HoleLayout.ROW_SIZES)
+    print(f"Retake plan: {len(plan)} holes in {len(rows)} rows ({', '.join(rows)})")
+    print(" ".join(plan))
+    print(f"Estimated motion: {seconds / 60:.1f} minutes planned, {sequence_seconds(listed, sweep_entry) / 60:.1f} "
+          f"in the listed order, {full_scan / 60:.0f} for a full rescan")
+
+def load_template_bank():
+    return ImageProcessing.load_or_build_template_bank(BASELINE_IMAGES, CROP_PARAMS, TEMPLATE_BANK_DIR)
+
+def run_retakes(ser, plan, merge_run=None, threshold=0.6, sweep_entry=False, search="exhaustive", camera=None):
+    """Capture, align and re-score the planned holes in one session. Returns {hole: (old score, new score)}.
+
+    The stage is reset once, then moved hole to hole in plan order; the run
+    count is left alone. Each frame is scored in-process as soon as it is
+    aligned, and the score is recorded into merge_run (the scan being
+    retaken) where it replaces the hole's earlier score. Alignments and
+    frames go into a "Retake" run of their own.
+    """
+    bank = load_template_bank()
+    if not bank:
+        print("Failed to crop the template.")
+        return {}
+    template = bank["default"]["template"]
+
+    run_order.status_subscriber = StatusSubscriber("retake")  # Pause/resume from the GUI, as in RunOrder
+    service = ScanService(ser, camera=camera, note="Retake", archive=False)
+    merged = service.results
+    old_scores = {}
+    if service.store is not None and merge_run is not None:
+        merged = service.store.for_run(merge_run)
+        old_scores = {hole: score for hole, score, *_ in service.store.run_results(merge_run)}
+
+    retaken = {}
+    if not ser.reset(timeout=60):
+        print("Arduino did not report the reset, stage position may be off.")
+    state = RESET_STATE
+    for hole in plan:
+        while run_order.is_paused():
+            print("Paused... waiting.")
+            run_order.status_subscriber.wait_for("paused", lambda paused: not paused, timeout=1)
+
+        offset = service.hole_offset(hole)
+        entering_row = HoleLayout.row_of(hole) != state[0]
+        print(f"Retaking {hole}")
+        if sweep_entry and entering_row:
+            ser.clear_replies()
+            ser.send(sweep_command(hole, offset=offset))
+        else:
+            run_order.send_motor_control_command(ser, hole, offset)
+        ready = run_order.wait_for_arduino_signal(ser)
+        if ready:
+            service.process_hole(hole, offset, by_name=True, advance=False)
+        if sweep_entry and entering_row:
+            ser.send(SWEEP_STOP)  # Leaves the firmware at this hole, as if sent with a hole command
+        state = (HoleLayout.row_of(hole), HoleLayout.number_in_row(hole))
+        if not ready or service.last_frame is None:
+            print(f"No frame for {hole}, skipping.")
+            continue
+
+        gray = cv2.cvtColor(service.last_frame, cv2.COLOR_BGR2GRAY)
+        match = ImageProcessing.match_frame(template, gray, hole, search=search, bank=bank,
+                                            cascade_threshold=threshold)
+        if match is None:
+            print(f"Could not score {hole}.")
+            continue
+        ImageProcessing.record_match(merged, hole, match)
+        old_score = old_scores.get(hole)
+        retaken[hole] = (old_score, match[0])
+        service.status.publish("hole_result", {"hole": hole, "score": match[0]})
+        before = f"{old_score * 100:.2f}%" if old_score is not None else "unscored"
+        print(f"Hole {hole}: {before} -> {match[0] * 100:.2f}%")
+
+    service.report()
+    service.close()
+    run_order.status_subscriber.close()
+    run_order.status_subscriber = None
+    return retaken
+
+def report_retakes(retaken, seconds, threshold=0.6):
+    if not retaken:
+        print("No holes were retaken.")
+        return
+    passing = [hole for hole, (_, score) in retaken.items() if score >= threshold]
+    print(f"Retook {len(retaken)} holes in {seconds:.0f} s ({len(retaken) / seconds * 60:.1f} holes/minute); "
+          f"{len(passing)} now pass, {len(retaken) - len(passing)} still need cleaning")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retake flagged holes in one session, in the order that "
+                                                 "needs the least stage travel, and merge the new scores.")
+    parser.add_argument("--source", choices=["csv", "results"], default="csv",
+                        help="Take the holes from holes_needing_cleaning.csv or from the run's scores in the "
+                             "result store.")
+    parser.add_argument("--csv", default=CLEANING_LOG_FILE, help="Cleaning log to read with --source csv.")
+    parser.add_argument("--holes", nargs="+", metavar="HOLE", help="Retake these holes instead (e.g. A0170).")
+    parser.add_argument("--run-id", type=int, help="Run to merge the new scores into (default: the latest scan).")
+    parser.add_argument("--threshold", type=float, default=0.60, help="Score below which a hole needs cleaning.")
+    parser.add_argument("--search", choices=["exhaustive", "pyramid", "cascade"], default="exhaustive")
+    parser.add_argument("--sweep-entry", action="store_true",
+                        help="Enter each row with a one-hole row sweep (needs the W command in the firmware).")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan.")
+    parser.add_argument("--port", default="/dev/ttyACM0")
+    args = parser.parse_args()
+
+    store = ResultStore(os.path.join(IMAGE_FOLDER, "results.sqlite"))
+    merge_run = args.run_id or store.latest_scored_run()
+    if args.holes:
+        listed = [hole.upper() for hole in args.holes]
+    elif args.source == "results":
+        listed = holes_below_threshold(store, merge_run, args.threshold) if merge_run is not None else []
+    else:
+        listed = read_cleaning_log(args.csv)
+    store.close()
+
+    plan, seconds = plan_retakes(listed, args.sweep_entry)
+    print_plan(plan, seconds, listed, args.sweep_entry)
+    if args.dry_run or not plan:
+        raise SystemExit(0)
+
+    ser = run_order.init_serial_connection(args.port)
+    if ser is None:
+        raise SystemExit(1)
+    start = time.perf_counter()
+    retaken = run_retakes(ser, plan, merge_run, args.threshold, args.sweep_entry, args.search,
+                          open_camera(run_order.CAMERA_BACKEND, settle=run_order.ADAPTIVE_SETTLE))
+    seconds = time.perf_counter() - start
+    ser.close()
+
+    report_retakes(retaken, seconds, args.threshold)
+    if merge_run is not None:
+        store = ResultStore(os.path.join(IMAGE_FOLDER, "results.sqlite"))
+        count = store.export_cleaning_csv(merge_run, CLEANING_LOG_FILE, args.threshold)
+        store.close()
+        print(f"Run {merge_run}: {count} holes need cleaning, written to {CLEANING_LOG_FILE}")
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import HoleLayout
+import ImageProcessing
+import ImageQuality
+from Tracing import span
+
+PIPELINE_DEPTH = 4  # Frames waiting to be scored before the stage waits for analysis
+MOVE_TIMEOUT = 60  # Seconds to wait for the ready signal (row changes take well over the link default)
+MOVE_RETRIES = 3  # Times a hole is re-sent when no ready signal comes back before the scan stops on it
+STEADY_TRIM = 0.1  # Fraction of holes at each end left out of the steady-state rate (start-up and drain)
+
+class ScanPipeline:
+    """Runs a scan as an asyncio pipeline so the stage never waits for scoring.
+
+    Per hole, the motion stage sends the hole command and awaits the ready
+    signal (ArduinoLink.amove_to_hole), grabs the frame and measures its
+    alignment on the capture thread, and awaits the T correction if one is
+    needed. As soon as the alignment is accepted the frame is queued for
+    analysis and the next move is sent, while the frame is scored on the score
+    executor and appended to the archive on its own thread.
+
+    At most depth frames wait for scoring; when analysis falls that far behind,
+    the stage waits, so memory stays bounded. Scores are recorded, logged and
+    published in capture order whatever order the score threads finish in.
+    Pause is checked before each move and again before each capture, as in
+    RunOrder; frames already captured keep being scored while paused.
+
+    A hole that gets no ready signal (or no frame) is re-sent, like the
+    hole-by-hole loop does. The run count only moves on once a hole is
+    captured and aligned, so if a hole still fails after MOVE_RETRIES tries
+    the scan stops on it (self.missed) with the run count pointing at it, and
+    relaunching RunOrder resumes from it.
+    """
+
+    def __init__(self, service, link, template, bank=None, threshold=0.6, search="exhaustive",
+                 depth=PIPELINE_DEPTH, workers=1, cleaning_log_file=None, is_paused=None):
+        self.service = service
+        self.link = link
+        self.template = template
+        self.bank = bank
+        self.threshold = threshold
+        self.search = search
+        self.depth = depth
+        self.cleaning_log_file = cleaning_log_file
+        self.is_paused = is_paused or (lambda: False)
+        self.capture_executor = ThreadPoolExecutor(max_workers=1)  # Camera and alignment, one hole at a time
+        self.score_executor = ThreadPoolExecutor(max_workers=workers)
+        self.archive_executor = ThreadPoolExecutor(max_workers=1)  # Keeps archive appends in capture order
+        self.needs_cleaning_log = []
+        self.scored = 0
+        self.timings = {}  # hole -> {"move", "ready", "captured", "accepted", "scored"} perf_counter times
+        self.analysis_wait = 0.0  # Seconds the stage waited for a free pipeline slot
+        self.missed = None  # Hole the scan stopped on, if it never got a ready signal
+
+    async def _wait_while_paused(self, where):
+        if self.is_paused():
+            print(f"Paused {where}... waiting.")
+            while self.is_paused():
+                await asyncio.sleep(0.2)
+
+    async def _move_capture_align(self, hole):
+        """Move to the hole, capture it and settle its alignment. Returns the frame, or None if the hole was missed."""
+        loop = asyncio.get_running_loop()
+        times = self.timings[hole] = {}
+        offset = self.service.hole_offset(hole)
+        print(f"Sending Motor to next hole: {hole}")
+        times["move"] = time.perf_counter()
+        with span("move", hole):
+            ready = await self.link.amove_to_hole(hole, timeout=MOVE_TIMEOUT, offset=offset)
+        times["ready"] = time.perf_counter()
+        if not ready:
+            print(f"No ready signal for {hole}.")
+            return None
+
+        await self._wait_while_paused("before camera")
+        with span("capture", hole):
+            # The run count only moves on once the hole is captured and aligned, so a retry reuses it
+            await loop.run_in_executor(self.capture_executor, self.service.capture, hole, False, False)
+        times["captured"] = time.perf_counter()
+        frame = self.service.last_frame
+        if frame is None:
+            print(f"No frame captured at {hole}.")
+            return None
+
+        with span("align", hole):
+            _, x_distance = await loop.run_in_executor(self.capture_executor, self.service.measure, offset)
+            if ImageQuality.needs_correction(x_distance, self.service.tolerance):
+                self.service.corrections_sent += 1
+                if not await self.link.acorrect(x_distance, timeout=MOVE_TIMEOUT):
+                    print(f"Timed out waiting for the correction at {hole}.")
+            elif x_distance is not None:
+                self.service.corrections_avoided += 1
+        self.service.advance()
+        times["accepted"] = time.perf_counter()
+        self.service.latencies.append((hole, times["captured"] - times["ready"], times["accepted"] - times["captured"],
+                                       times["accepted"] - times["ready"]))
+        return frame
+
+    def _score(self, hole, frame):
+        """Score one frame (score executor thread)."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return ImageProcessing.match_frame(self.template, gray, hole, search=self.search, bank=self.bank,
+                                           cascade_threshold=self.threshold)
+
+    def _archive(self, hole, frame):
+        with span("archive_frame", hole):
+            self.service.archive.put(hole, frame)
+
+    def _record(self, hole, match):
+        """Record, log and publish a hole's score; called in capture order."""
+        self.timings[hole]["scored"] = time.perf_counter()
+        self.scored += 1
+        if match is None:
+            print(f"Could not score {hole}.")
+            return
+        ImageProcessing.record_match(self.service.results, hole, match)
+        entry = ImageProcessing.log_if_needs_cleaning(hole, match[0], self.needs_cleaning_log, self.threshold)
+        if entry is not None and self.cleaning_log_file:
+            ImageProcessing.append_cleaning_log_entry(entry, self.cleaning_log_file)
+        ImageProcessing.publish_progress(self.service.status, self.scored, HoleLayout.TOTAL_HOLES, hole, match[0])
+
+    async def _analyse(self, queue):
+        """Await each queued score in capture order and record it, until the None sentinel."""
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            hole, scoring = item
+            try:
+                match = await scoring
+            except Exception as e:
+                print(f"Error scoring {hole}: {e}")
+                match = None
+            self._record(hole, match)
+
+    async def run(self, holes):
+        """Capture, align and score holes in order."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.depth)
+        analysis = asyncio.create_task(self._analyse(queue))
+        try:
+            for hole in holes:
+                frame = None
+                for attempt in range(MOVE_RETRIES + 1):
+                    await self._wait_while_paused("before move")
+                    frame = await self._move_capture_align(hole)
+                    if frame is not None:
+                        break
+                    if attempt < MOVE_RETRIES:
+                        print(f"Retrying {hole} ({attempt + 1}/{MOVE_RETRIES})...")
+                if frame is None:
+                    self.missed = hole
+                    print(f"Stopping the scan at {hole}; relaunch RunOrder to resume from it.")
+                    break
+                if self.service.archive is not None:
+                    loop.run_in_executor(self.archive_executor, self._archive, hole, frame)
+                waiting = time.perf_counter()
+                scoring = loop.run_in_executor(self.score_executor, self._score, hole, frame)
+                await queue.put((hole, scoring))  # Blocks while depth frames are still waiting for scoring
+                self.analysis_wait += time.perf_counter() - waiting
+        finally:
+            await queue.put(None)
+            await analysis
+            self.capture_executor.shutdown()
+            self.score_executor.shutdown()
+            self.archive_executor.shutdown()
+
+    def report(self):
+        """Print overall and steady-state holes/minute and where the cycle time goes."""
+        done = [times for times in self.timings.values() if "scored" in times]
+        if len(done) < 2:
+            print("Too few holes for pipeline throughput.")
+            return
+
+        accepted = np.array([times["accepted"] for times in done])
+        total = done[-1]["scored"] - done[0]["move"]
+        print(f"Pipeline: {len(done)} holes in {total:.1f} s ({len(done) / total * 60:.1f} holes/minute overall)")
+
+        # Steady state: the time between holes being accepted, leaving out start-up and the final drain
+        trim = max(1, int(len(accepted) * STEADY_TRIM)) if len(accepted) > 4 else 0
+        cycles = np.diff(accepted[trim:len(accepted) - trim] if trim else accepted)
+        if len(cycles):
+            print(f"Steady state: {60 / cycles.mean():.1f} holes/minute ({cycles.mean() * 1000:.0f} ms per hole, "
+                  f"p95 {np.percentile(cycles, 95) * 1000:.0f} ms)")
+
+        moving = np.array([times["ready"] - times["move"] for times in done])
+        on_frame = np.array([times["accepted"] - times["ready"] for times in done])
+        lag = np.array([times["scored"] - times["accepted"] for times in done]) * 1000
+        print(f"Per hole: move {moving.mean() * 1000:.0f} ms, capture and align {on_frame.mean() * 1000:.0f} ms; "
+              f"scored {np.percentile(lag, 50):.0f} ms after acceptance (p95 {np.percentile(lag, 95):.0f} ms)")
+        print(f"Stage waited {self.analysis_wait:.1f} s for scoring to catch up (pipeline depth {self.depth})")
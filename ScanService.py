@@ -0,0 +1,242 @@
+import os
+import time
+import importlib.machinery
+import importlib.util
+import numpy as np
+import ImageQuality
+from CameraCapture import AsyncFrameWriter
+from FrameArchive import KEEP_ARCHIVES, FrameArchive, archive_path, prune_archives
+from FrameIndex import FrameIndex
+from FrameRing import FrameRing
+from OffsetTable import OffsetTable
+from ResultStore import ResultStore
+from StatusChannel import StatusPublisher
+from Tracing import span
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_script_module(name, path):
+    """Import one of the extensionless scripts (e.g. guvcviewCameraControl) as a module."""
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+camera_control = load_script_module("guvcviewCameraControl", os.path.join(SCRIPT_DIR, "guvcviewCameraControl"))
+
+class ScanService:
+    """Capture and alignment kept loaded in the RunOrder process.
+
+    Replaces launching guvcviewCameraControl and ImageQuality.py with python3 for
+    every hole: cv2/numpy are imported once and the Arduino connection owned by
+    RunOrder is reused, so there is no per-hole interpreter start, serial reopen or
+    reset sleep.
+
+    Captured frames stay in memory: alignment uses the frame directly, a copy goes
+    into the shared-memory FrameRing for ImageProcessing.py's follow mode (announced
+    with a "frame" status event), and the JPEG is written by a background writer.
+
+    Each hole's total correction is learned into the OffsetTable, which RunOrder
+    uses to pre-compensate the next run's hole commands; residuals within
+    ImageQuality.CORRECTION_TOLERANCE then need no T correction round trip.
+
+    The run is opened in the ResultStore, and each hole's alignment offset is
+    recorded there as it is aligned; the scorer records the match scores under
+    the same run_id.
+
+    Every frame is also appended, as grayscale, to the run's FrameArchive
+    (run_<run_id>.frames in the image folder), which can be re-scored or
+    reviewed later without decoding any JPEGs. Only the last KEEP_ARCHIVES
+    runs keep their archive, and a run that archived nothing has its archive
+    removed on close. archive=False (retake sessions) creates none.
+    """
+
+    def __init__(self, ser, image_folder="/home/asmluser/ImageStorage", camera=None, note="RunOrder", archive=True):
+        self.ser = ser
+        self.image_folder = image_folder
+        self.camera = camera  # Persistent capture backend; None launches guvcview per hole
+        self.latencies = []  # (hole, capture seconds, align seconds, total seconds)
+        self.settle_times = []  # (hole, seconds waiting for the image to stop moving, settled before timeout)
+        self.status = StatusPublisher()
+        self.writer = AsyncFrameWriter()
+        self.index = FrameIndex(image_folder)
+        self.last_frame = None
+        self.last_hole_id = None
+        self.tracker = ImageQuality.HoleTracker()  # Narrows the alignment search using the row's earlier holes
+        self.offsets = OffsetTable()
+        self.tolerance = ImageQuality.CORRECTION_TOLERANCE
+        self.corrections_sent = 0
+        self.corrections_avoided = 0
+        self.results = None
+        self.run_id = None
+        try:
+            self.store = ResultStore(os.path.join(image_folder, "results.sqlite"))
+            self.run_id = self.store.start_run(note)
+            self.results = self.store.for_run(self.run_id)
+        except Exception as e:
+            print(f"Error opening the result store, alignments will not be recorded: {e}")
+            self.store = None
+        self.archive = None
+        if archive:
+            try:
+                prune_archives(image_folder, keep=KEEP_ARCHIVES - 1)  # Room for this run's archive
+                self.archive = FrameArchive(archive_path(image_folder, self.run_id), create=True)
+            except Exception as e:
+                print(f"Error creating frame archive, frames will only be saved as JPEGs: {e}")
+        try:
+            self.ring = FrameRing(create=True)
+        except Exception as e:
+            print(f"Error creating frame ring, follow mode will read image files: {e}")
+            self.ring = None
+
+    def capture(self, hole_id=None, advance=True, archive=True):
+        """Take a picture for the current run count (or of hole_id), hand the frame on, and publish the new count.
+
+        advance=False takes the picture without moving the run count on (retakes).
+        archive=False leaves appending the frame to the archive to the caller
+        (ScanPipeline does it off the capture path).
+        """
+        started = time.time()
+        count, hole_id, filename, frame = camera_control.capture_frame(self.camera, self.writer, self.index, hole_id,
+                                                                       advance)
+        self.last_frame = frame
+        self.last_hole_id = hole_id
+        if advance:
+            self.status.publish("run_count", count)
+
+        if frame is not None:
+            slot = seq = None
+            if self.ring is not None and frame.shape == self.ring.frame_shape:
+                slot, seq = self.ring.put(frame, os.path.splitext(os.path.basename(filename))[0])
+            self.status.publish("frame", {"hole": hole_id, "filename": filename, "slot": slot, "seq": seq,
+                                          "started": started})
+            if self.archive is not None and archive:
+                with span("archive_frame", hole_id):
+                    self.archive.put(hole_id, frame)
+        return count
+
+    def advance(self):
+        """Move the run count on past a hole captured with advance=False, and publish the new count."""
+        count = camera_control.get_run_count() + 1
+        camera_control.save_run_count(count)
+        self.status.publish("run_count", count)
+        return count
+
+    def hole_offset(self, hole_name):
+        """Pre-compensation to send with the hole command, learned from earlier runs."""
+        return self.offsets.predict(hole_name)
+
+    def measure(self, offset=0):
+        """Detect the hole in the captured frame and record its residual, without sending a correction.
+
+        For callers that send the correction themselves (ScanPipeline awaits it
+        with ArduinoLink.acorrect). Returns (hole ID, residual or None).
+        """
+        hole_id = self.last_hole_id
+        if self.last_frame is None:
+            return hole_id, None
+        x_distance = ImageQuality.measure_frame(self.last_frame, annotate=False, hole_id=hole_id, tracker=self.tracker)
+        if x_distance is not None:
+            if self.results is not None:
+                self.results.record_alignment(hole_id, x_distance)
+            self.offsets.record(hole_id, offset, x_distance)
+        return hole_id, x_distance
+
+    def align(self, offset=0):
+        """Detect the hole in the captured frame and send the correction, waiting for the Arduino to finish it.
+
+        The correction is skipped when the residual is within tolerance. offset is
+        the pre-compensation the hole command was sent with, for the offset table.
+        Returns (hole ID, measured residual or None).
+        """
+        if self.last_frame is not None:
+            hole_id = self.last_hole_id
+            x_distance = ImageQuality.align_frame(self.last_frame, self.ser, annotate=False,
+                                                  hole_id=hole_id, tracker=self.tracker, tolerance=self.tolerance)
+        else:
+            hole_id, x_distance = ImageQuality.process_hole_image(self.index, self.last_hole_id, self.ser,
+                                                                  self.tolerance)
+        if x_distance is None:
+            return hole_id, None
+
+        if self.results is not None:
+            self.results.record_alignment(hole_id, x_distance)
+        self.offsets.record(hole_id, offset, x_distance)
+        if ImageQuality.needs_correction(x_distance, self.tolerance):
+            self.corrections_sent += 1
+            ImageQuality.wait_for_correction_ack(self.ser)
+        else:
+            self.corrections_avoided += 1
+        return hole_id, x_distance
+
+    def process_hole(self, hole_name, offset=0, by_name=False, advance=True):
+        """Capture and align one hole, recording how long each step took.
+
+        by_name names the capture after hole_name instead of the run count, for
+        row sweeps and retakes whose scan order is not the run count order.
+        advance=False leaves the run count alone (see capture).
+        """
+        start = time.perf_counter()
+        self.capture(hole_name if by_name else None, advance)
+        captured = time.perf_counter()
+        settle = getattr(self.camera, "last_settle", None)  # Set by CameraCapture.SettlingCamera
+        if settle is not None:
+            self.settle_times.append((hole_name,) + settle)
+        with span("align", hole_name):
+            hole_id, x_distance = self.align(offset)
+        finished = time.perf_counter()
+        if hole_id != hole_name:
+            print(f"Warning: captured hole {hole_id} but the stage was sent to {hole_name}.")
+
+        latency = (hole_name, captured - start, finished - captured, finished - start)
+        self.latencies.append(latency)
+        settle_note = f" (settle {settle[0] * 1000:.0f} ms)" if settle is not None else ""
+        print(f"Hole {hole_name}: capture {latency[1] * 1000:.0f} ms{settle_note}, align {latency[2] * 1000:.0f} ms, "
+              f"total {latency[3] * 1000:.0f} ms")
+        self.status.publish("hole_aligned", {"hole": hole_id, "x_distance": x_distance, "seconds": latency[3]})
+        return x_distance
+
+    def close(self):
+        self.offsets.save()
+        if self.store is not None:
+            self.store.finish_run(self.run_id)
+            self.store.close()
+        if self.camera is not None:
+            self.camera.close()
+        self.writer.close()
+        if self.archive is not None:
+            empty = len(self.archive) == 0
+            self.archive.close()
+            if empty:
+                os.remove(self.archive.path)  # Nothing was captured; don't let it push out a real run's archive
+        if self.ring is not None:
+            self.ring.close()
+        self.status.close()
+
+    def report(self):
+        """Print per-hole latency percentiles for the run."""
+        if not self.latencies:
+            print("No holes processed.")
+            return
+
+        for index, label in ((1, "Capture"), (2, "Align"), (3, "Total")):
+            values = np.array([latency[index] for latency in self.latencies]) * 1000
+            print(f"{label}: p50 {np.percentile(values, 50):.0f} ms, p95 {np.percentile(values, 95):.0f} ms, "
+                  f"max {values.max():.0f} ms over {len(values)} holes")
+
+        if self.settle_times:
+            values = np.array([seconds for _, seconds, _ in self.settle_times]) * 1000
+            timeouts = sum(1 for _, _, settled in self.settle_times if not settled)
+            print(f"Settle: p50 {np.percentile(values, 50):.0f} ms, p95 {np.percentile(values, 95):.0f} ms, "
+                  f"{timeouts} timeouts over {len(values)} holes (fixed settle was 1000 ms)")
+
+        aligned = self.corrections_sent + self.corrections_avoided
+        if aligned:
+            print(f"Correction round trips avoided: {self.corrections_avoided}/{aligned} holes "
+                  f"({self.corrections_sent} T corrections sent)")
+
+        predicted = self.tracker.hits + self.tracker.misses
+        if predicted:
+            print(f"Predicted search window: {self.tracker.hits}/{predicted} hits, "
+                  f"{self.tracker.misses} full-frame fallbacks")
@@ -0,0 +1,109 @@
+import hashlib
+import sqlite3
+import time
+import numpy as np
+
+SCORE_CACHE_DB = "/home/asmluser/ImageStorage/score_cache.sqlite"
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+EVICT_CHECK_EVERY = 500  # Inserts between size checks
+EVICT_FRACTION = 0.1  # Share of entries dropped, least recently used first, when over the limit
+
+class ScoreCache:
+    """Best match per (image content, template and search parameters), kept across runs.
+
+    The key is a hash of the image file's bytes plus a hash of everything that
+    changes the match: the template pixels, the scales, the search mode, ROI
+    and method. Re-running over the same folder (after a crash, or with a new
+    threshold) then costs one file read and hash per image instead of a decode
+    and a multi-scale match, and the raw score is kept so any threshold can be
+    applied afterwards. Entries are evicted least recently used first once the
+    database grows past max_bytes.
+    """
+
+    def __init__(self, path=SCORE_CACHE_DB, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS matches (
+            image TEXT NOT NULL, params TEXT NOT NULL, score REAL NOT NULL, loc_x INTEGER, loc_y INTEGER,
+            scale REAL, last_used REAL NOT NULL, PRIMARY KEY (image, params)) WITHOUT ROWID""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)")
+        self._params = {}  # (id(template), settings) -> (template, digest); keeps the template alive
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def params_key(self, template, settings):
+        """Hash of the template pixels and a tuple of search settings (memoized per template object)."""
+        memo_key = (id(template), settings)
+        if memo_key not in self._params:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.ascontiguousarray(template).tobytes())
+            digest.update(repr((template.shape, settings)).encode())
+            self._params[memo_key] = (template, digest.hexdigest())
+        return self._params[memo_key][1]
+
+    @staticmethod
+    def image_key(captured_image_path):
+        """Hash of the image file's bytes, or None if it can't be read."""
+        try:
+            with open(captured_image_path, "rb") as f:
+                return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        except OSError:
+            return None
+
+    def get(self, key):
+        """Return the cached (score, location, scale) for a key, or None."""
+        if key is None:
+            self.misses += 1
+            return None
+        row = self.db.execute("SELECT score, loc_x, loc_y, scale FROM matches WHERE image = ? AND params = ?",
+                              key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE matches SET last_used = ? WHERE image = ? AND params = ?", (time.time(),) + key)
+        score, loc_x, loc_y, scale = row
+        return score, (loc_x, loc_y) if loc_x is not None else None, scale
+
+    def put(self, key, match):
+        if key is None or match is None:
+            return
+        score, location, scale = match
+        loc_x, loc_y = (int(location[0]), int(location[1])) if location is not None else (None, None)
+        try:
+            self.db.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            key + (float(score), loc_x, loc_y, None if scale is None else float(scale), time.time()))
+        except sqlite3.Error as e:
+            print(f"Error writing score cache: {e}")
+            return
+        self._inserts += 1
+        if self._inserts % EVICT_CHECK_EVERY == 0:
+            self.evict()
+
+    def size_bytes(self):
+        page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free_pages) * page_size
+
+    def evict(self):
+        """Drop the least recently used entries until the cache is under max_bytes."""
+        while self.size_bytes() > self.max_bytes:
+            count = self.db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+            if count == 0:
+                return
+            self.db.execute("DELETE FROM matches WHERE (image, params) IN "
+                            "(SELECT image, params FROM matches ORDER BY last_used LIMIT ?)",
+                            (max(int(count * EVICT_FRACTION), 1),))
+
+    def report(self):
+        total = self.hits + self.misses
+        if total:
+            print(f"Score cache: {self.hits}/{total} hits ({self.hits / total * 100:.0f}%)")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,197 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import HoleLayout
+from ArduinoLink import ArduinoLink
+from Benchmark import EDGE_FRACTION, FRAME_HEIGHT, FRAME_WIDTH, HOLE_RADIUS, draw_hole
+from CameraCapture import FakeCamera
+from FakeArduino import FakeArduino
+import RetakePlanner
+from ResultStore import ResultStore
+from ScanService import SCRIPT_DIR, load_script_module
+
+# Everything runs against /home/asmluser as usual; inside the simulator that path is a private copy
+SIM_HOME = "/home/asmluser"
+STATUS_DIR = "/tmp/asml-status"
+INSIDE_ENV = "ASML_SIMULATOR"
+
+PIXELS_PER_STEP = 248.1111 / 100  # Inverse of ImageQuality.align_frame's pixel -> step conversion
+TEMPLATE_CENTER = (135, 105)  # Where ImageProcessing.py crops its template from the baseline image
+
+# Hardware timings per command, in real seconds (scaled down by --speed), from the firmware's
+# motion settings and fixed delays: move + 1 s settle + 1 s before the next command is read
+HOLE_MOVE_SECONDS = 3.4
+ROW_CHANGE_SECONDS = 25.0  # Rewind to the row zero point, row axis, and their settles
+CORRECTION_SECONDS = 1.2
+RESET_SECONDS = 20.0
+
+class SimPlate:
+    """Ground truth for a simulated plate: which holes are plugged and each hole's stage error.
+
+    The x error of each hole (in motor steps) is a per-row bias plus a slow
+    variation around the row and some noise, so the offset table and the hole
+    tracker have something to learn. Everything is drawn from the seed.
+    """
+
+    def __init__(self, seed=0, dirty_fraction=0.05, error_steps=6.0, debris_per_hole=1.5):
+        self.rng = np.random.default_rng(seed)
+        self.debris_per_hole = debris_per_hole
+        holes = HoleLayout.HOLE_IDS[1:]
+        self.dirty = {hole for hole in holes if self.rng.random() < dirty_fraction}
+        row_bias = {letter: self.rng.normal(0, error_steps) for letter, _ in HoleLayout.ROW_SIZES}
+        self.errors = {}
+        for hole in holes:
+            angle = np.radians(HoleLayout.angle_degrees(hole))
+            error = row_bias[HoleLayout.row_of(hole)] + error_steps * np.sin(angle) + self.rng.normal(0, 1)
+            self.errors[hole] = int(round(error))
+
+    def error(self, hole):
+        return self.errors.get(hole, 0)
+
+    def frame(self, hole, error_steps):
+        """BGR frame of a hole whose stage position is error_steps off, with debris (and a plug if dirty)."""
+        center = (FRAME_WIDTH / 2 + error_steps * PIXELS_PER_STEP, FRAME_HEIGHT / 2 + self.rng.normal(0, 0.5))
+        debris = []
+        for _ in range(self.rng.poisson(self.debris_per_hole)):
+            debris.append((self.rng.uniform(0, FRAME_WIDTH), self.rng.uniform(0, FRAME_HEIGHT),
+                           self.rng.uniform(2, 8), self.rng.uniform(2, 8), self.rng.uniform(0, 180),
+                           self.rng.choice([20, 255])))
+        if hole in self.dirty:
+            debris.append((center[0], center[1], 1.2 * HOLE_RADIUS, 1.2 * HOLE_RADIUS, 0, 200))
+        gray = draw_hole(center, HOLE_RADIUS, debris=debris, rng=self.rng)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+def prepare_home(home):
+    """Lay out a fresh /home/asmluser: empty ImageStorage and a clean baseline image for the template."""
+    os.makedirs(os.path.join(home, "ImageStorage"), exist_ok=True)
+    baseline_folder = os.path.join(home, "Baseline Image")
+    os.makedirs(baseline_folder, exist_ok=True)
+    center = (TEMPLATE_CENTER[0] + HOLE_RADIUS * EDGE_FRACTION, TEMPLATE_CENTER[1])
+    cv2.imwrite(os.path.join(baseline_folder, "A-13.jpg"), draw_hole(center, HOLE_RADIUS, noise=0))
+
+def run_isolated(root, argv):
+    """Re-run this script in a private mount namespace where root/home is /home and the status/shm dirs are fresh.
+
+    A real run on the same machine keeps its files, status channel and frame
+    ring; unprivileged users get a user namespace mapped to root for the mounts.
+    """
+    os.makedirs(STATUS_DIR, exist_ok=True)  # Mount point for the private status folder
+    os.makedirs(os.path.join(root, "status"), exist_ok=True)
+    setup = ('mount --bind "$1/home" /home && mount --bind "$1/status" ' + STATUS_DIR +
+             ' && mount -t tmpfs tmpfs /dev/shm && shift && exec "$@"')
+    command = ["unshare", "--mount"] + ([] if os.geteuid() == 0 else ["--user", "--map-root-user"])
+    command += ["sh", "-c", setup, "sh", root, sys.executable, os.path.abspath(__file__)] + argv
+    return subprocess.call(command, env=dict(os.environ, **{INSIDE_ENV: "1"}))
+
+def simulate(args):
+    """Run RunOrder end to end against the fake Arduino and camera, then report throughput and accuracy."""
+    os.chdir(SCRIPT_DIR)  # RunOrder starts "python3 ImageProcessing.py" from here
+    os.environ["PATH"] = os.path.dirname(sys.executable) + os.pathsep + os.environ.get("PATH", "")
+
+    plate = SimPlate(args.seed, args.dirty_fraction, args.error_steps)
+    arduino = FakeArduino(move_time=HOLE_MOVE_SECONDS / args.speed, reset_time=RESET_SECONDS / args.speed,
+                          row_change_time=ROW_CHANGE_SECONDS / args.speed,
+                          correction_time=CORRECTION_SECONDS / args.speed, error_model=plate.error)
+    camera = FakeCamera(frame_source=lambda index: plate.frame(arduino.hole, arduino.error))
+
+    run_order = load_script_module("RunOrder", os.path.join(SCRIPT_DIR, "RunOrder"))
+    run_order.open_camera = lambda backend, settle=False: camera
+    if args.sweep:
+        run_order.SCAN_MODE = "sweep"
+    elif args.pipeline:
+        run_order.SCAN_MODE = "pipeline"
+
+    # Start the run count (and the stage) just before the last --holes holes, so only those are left
+    start_count = HoleLayout.TOTAL_HOLES - args.holes
+    with open(os.path.join(SIM_HOME, "ImageStorage", "run_count.txt"), "w") as f:
+        f.write(str(start_count))
+    order = HoleLayout.SWEEP_ORDER if args.sweep else HoleLayout.HOLE_IDS  # Sweep mode reverses every other row
+    arduino.move_to(HoleLayout.hole_id(start_count, sweep=args.sweep), 0)
+    holes = set(order[start_count + 1:HoleLayout.END_COUNT])
+
+    link = ArduinoLink(arduino.port, boot_delay=0)
+    start = time.perf_counter()
+    run_order.run_all_scripts(link)
+    seconds = time.perf_counter() - start
+
+    store = ResultStore(os.path.join(SIM_HOME, "ImageStorage", "results.sqlite"))
+    note = "RunOrder" if run_order.SCAN_MODE == "holes" else f"RunOrder {run_order.SCAN_MODE}"
+    run_id = store.latest_finished_run(note)
+    scores = {row[0]: row[1] for row in store.run_results(run_id)} if run_id is not None else {}
+    flagged = RetakePlanner.holes_below_threshold(store, run_id, args.threshold) if run_id is not None else []
+    store.close()
+    report(args, plate, holes, scores, seconds, arduino.busy_seconds)
+
+    if args.retake and flagged:
+        retake(args, plate, arduino, link, camera, flagged, run_id)
+    link.close()
+    arduino.close()
+
+def retake(args, plate, arduino, link, camera, flagged, run_id):
+    """Clean the flagged holes on the simulated plate and retake them with RetakePlanner, reporting its throughput."""
+    plate.dirty -= set(flagged)
+    plan, estimate = RetakePlanner.plan_retakes(flagged, args.sweep)
+    print(f"\nRetaking {len(plan)} flagged holes, estimated {estimate / 60:.1f} minutes of motion at real speed")
+    busy = arduino.busy_seconds
+    start = time.perf_counter()
+    retaken = RetakePlanner.run_retakes(link, plan, run_id, args.threshold, args.sweep, camera=camera)
+    seconds = time.perf_counter() - start
+    motion_seconds = arduino.busy_seconds - busy
+    RetakePlanner.report_retakes(retaken, seconds, args.threshold)
+    real_seconds = seconds + motion_seconds * (args.speed - 1)
+    print(f"At real motion times the retake would take about {real_seconds / 60:.1f} minutes "
+          f"({len(retaken) / real_seconds * 60:.1f} holes/minute)")
+
+def report(args, plate, holes, scores, seconds, motion_seconds):
+    """Print throughput (as run, and projected to real motion times) and how well dirty holes were caught."""
+    real_seconds = seconds + motion_seconds * (args.speed - 1)
+    print(f"\nSimulated {len(holes)} holes in {seconds:.1f} s with motion {args.speed:g}x faster: "
+          f"{len(holes) / seconds * 60:.1f} holes/minute end to end")
+    print(f"Stage busy {motion_seconds:.1f} s; at real motion times the run would take about "
+          f"{real_seconds / 60:.1f} minutes, {len(holes) / real_seconds * 60:.1f} holes/minute")
+
+    scored = {hole: score for hole, score in scores.items() if hole in holes}
+    if not scored:
+        print("No scores were recorded.")
+        return
+    failed = {hole for hole, score in scored.items() if score < args.threshold}
+    dirty = {hole for hole in scored if hole in plate.dirty}
+    print(f"Scored {len(scored)}/{len(holes)} holes; {len(failed)} flagged for cleaning, {len(dirty)} plugged "
+          f"({len(failed & dirty)} caught, {len(dirty - failed)} missed, {len(failed - dirty)} false alarms)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run RunOrder, ImageQuality and ImageProcessing end to end "
+                                                 "against a fake Arduino and camera.")
+    parser.add_argument("--holes", type=int, default=HoleLayout.TOTAL_HOLES,
+                        help="Capture the last N holes of the plate (default: all of them).")
+    parser.add_argument("--speed", type=float, default=20.0, help="How much faster than the real stage to move.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dirty-fraction", type=float, default=0.05, help="Share of holes that are plugged.")
+    parser.add_argument("--error-steps", type=float, default=6.0, help="Typical stage error per hole, in steps.")
+    parser.add_argument("--threshold", type=float, default=0.60, help="Score ImageProcessing.py fails holes below.")
+    parser.add_argument("--sweep", action="store_true", help="Use RunOrder's row-sweep scan mode.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Use RunOrder's asyncio pipeline scan mode (scores in-process while the stage moves).")
+    parser.add_argument("--retake", action="store_true",
+                        help="After the scan, clean the flagged holes and retake them with RetakePlanner.")
+    parser.add_argument("--keep", action="store_true", help="Keep the simulated home folder and print its path.")
+    args = parser.parse_args()
+    args.holes = max(1, min(args.holes, HoleLayout.TOTAL_HOLES))
+
+    if os.environ.get(INSIDE_ENV):
+        simulate(args)
+    else:
+        root = tempfile.mkdtemp(prefix="asml-sim-")
+        prepare_home(os.path.join(root, "home", "asmluser"))
+        code = run_isolated(root, sys.argv[1:])
+        if args.keep:
+            print(f"Simulated files kept in {os.path.join(root, 'home', 'asmluser')}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+        sys.exit(code)
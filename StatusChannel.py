@@ -0,0 +1,136 @@
+import json
+import os
+import socket
+import threading
+import time
+
+STATUS_DIR = "/tmp/asml-status"
+RELIABLE_TOPICS = {"paused"}  # Control events retried for up to RELIABLE_TIMEOUT seconds when a queue is full
+RELIABLE_TIMEOUT = 0.5
+
+class StatusPublisher:
+    """Publishes status events (counters, per-hole results, pause) to every subscriber.
+
+    Each subscriber binds a Unix datagram socket in status_dir; publish() sends one
+    small JSON datagram to each of them without blocking, so a slow or missing
+    consumer never holds up the scan. Delivery is local and typically well under a
+    millisecond. A datagram to a full queue is dropped and counted in dropped,
+    except for RELIABLE_TOPICS (pause), which are retried briefly and printed if
+    they still can't be delivered.
+
+    mirror_files optionally maps a topic to one of the old text files
+    (e.g. "image_counter" -> image_counter.txt), which is rewritten on every
+    publish for tools that still poll the files.
+    """
+
+    def __init__(self, status_dir=STATUS_DIR, mirror_files=None):
+        self.status_dir = status_dir
+        self.mirror_files = mirror_files or {}
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.dropped = {}  # topic -> datagrams dropped because a subscriber's queue was full
+
+    def _subscriber_paths(self):
+        try:
+            return [entry.path for entry in os.scandir(self.status_dir) if entry.name.endswith(".sock")]
+        except FileNotFoundError:
+            return []
+
+    def publish(self, topic, value):
+        message = json.dumps({"topic": topic, "value": value, "time": time.time()}).encode()
+        for path in self._subscriber_paths():
+            try:
+                self._send(message, path, topic in RELIABLE_TOPICS)
+            except ConnectionRefusedError:
+                # Subscriber exited without cleaning up its socket
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                self.dropped[topic] = self.dropped.get(topic, 0) + 1
+                if topic in RELIABLE_TOPICS:
+                    print(f"Dropped {topic}={value} for {os.path.basename(path)}: its queue stayed full.")
+            except FileNotFoundError:
+                pass  # Subscriber just exited
+
+        if topic in self.mirror_files:
+            try:
+                with open(self.mirror_files[topic], "w") as file:
+                    file.write(f"{value:.2f}" if isinstance(value, float) else str(value))
+            except Exception as e:
+                print(f"Error writing {self.mirror_files[topic]}: {e}")
+
+    def _send(self, message, path, reliable):
+        """Send one datagram; if reliable, retry a full queue until RELIABLE_TIMEOUT before raising."""
+        deadline = time.monotonic() + RELIABLE_TIMEOUT
+        while True:
+            try:
+                self.sock.sendto(message, path)
+                return
+            except BlockingIOError:
+                if not reliable or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def close(self):
+        self.sock.close()
+
+class StatusSubscriber:
+    """Receives status events on a background thread.
+
+    The latest value of every topic is kept for get(), wait_for() blocks until a
+    topic meets a condition, and callback(topic, value), if given, is called on the
+    receiving thread for each event.
+    """
+
+    def __init__(self, name, callback=None, status_dir=STATUS_DIR):
+        os.makedirs(status_dir, exist_ok=True)
+        self.path = os.path.join(status_dir, f"{name}-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.settimeout(0.5)
+        self.callback = callback
+        self.latest = {}
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        while self._running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+
+            with self._condition:
+                self.latest[message["topic"]] = message["value"]
+                self._condition.notify_all()
+            if self.callback:
+                self.callback(message["topic"], message["value"])
+
+    def get(self, topic, default=None):
+        return self.latest.get(topic, default)
+
+    def wait_for(self, topic, predicate, timeout=None):
+        """Block until predicate(latest value of topic) is true. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: topic in self.latest and predicate(self.latest[topic]), timeout)
+
+    def close(self):
+        self._running = False
+        self.sock.close()
+        self._thread.join(timeout=1)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,193 @@
+import atexit
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Tracing is on when ASML_TRACE names a folder (child processes inherit it), or after enable()
+TRACE_ENV = "ASML_TRACE"
+TRACE_OWNER_ENV = "ASML_TRACE_OWNER"  # PID of the top-level process of the traced run, inherited by its children
+TRACE_DIR = "/home/asmluser/ImageStorage/trace"
+FLUSH_EVERY = 256  # Spans buffered before they are appended to the log
+
+class _NullSpan:
+    """Shared do-nothing span handed out while tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("stage", "hole", "start")
+
+    def __init__(self, stage, hole):
+        self.stage = stage
+        self.hole = hole
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.stage, self.hole, self.start, time.monotonic_ns() - self.start)
+        return False
+
+_enabled = False
+_log_path = None
+_buffer = []
+_lock = threading.Lock()
+
+def enable(trace_dir=TRACE_DIR):
+    """Start tracing this process into trace_dir (and any child started after this call).
+
+    The top-level process of a run clears the folder first, so report() only
+    summarizes this run; its children append to the same folder.
+    """
+    global _enabled, _log_path
+    os.makedirs(trace_dir, exist_ok=True)
+    if not os.environ.get(TRACE_OWNER_ENV):
+        clear(trace_dir)
+        os.environ[TRACE_OWNER_ENV] = str(os.getpid())
+    os.environ[TRACE_ENV] = trace_dir
+    _log_path = os.path.join(trace_dir, f"trace-{os.getpid()}.log")
+    if not _enabled:
+        atexit.register(flush)
+    _enabled = True
+
+def _after_fork():
+    """Forked pool workers get their own log instead of appending to the parent's."""
+    global _log_path, _lock
+    _lock = threading.Lock()
+    _buffer.clear()
+    if _enabled:
+        _log_path = os.path.join(os.environ[TRACE_ENV], f"trace-{os.getpid()}.log")
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def is_enabled():
+    return _enabled
+
+def span(stage, hole=None):
+    """Context manager timing one stage (for one hole, if given). Costs one check when tracing is off."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(stage, hole)
+
+def traced(stage):
+    """Decorator form of span() for whole functions."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(stage, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _record(stage, hole, start, duration):
+    line = f"{threading.get_native_id()}\t{stage}\t{hole or ''}\t{start}\t{duration}\n"
+    with _lock:
+        _buffer.append(line)
+        if len(_buffer) < FLUSH_EVERY:
+            return
+        lines = _buffer[:]
+        _buffer.clear()
+    _write(lines)
+
+def flush():
+    """Append buffered spans to this process's log (pool workers are killed without running atexit)."""
+    with _lock:
+        lines = _buffer[:]
+        _buffer.clear()
+    if lines:
+        _write(lines)
+
+def _write(lines):
+    try:
+        with open(_log_path, "a") as f:
+            f.writelines(lines)
+    except OSError as e:
+        print(f"Error writing trace log {_log_path}: {e}")
+
+def read_spans(trace_dir=TRACE_DIR):
+    """Read every process's log: a list of (pid, tid, stage, hole, start ns, duration ns)."""
+    spans = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "trace-*.log"))):
+        pid = int(os.path.basename(path)[len("trace-"):-len(".log")])
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 5:
+                    continue  # Partially written line
+                tid, stage, hole, start, duration = fields
+                spans.append((pid, int(tid), stage, hole, int(start), int(duration)))
+    return spans
+
+def export_chrome_trace(spans, output_path):
+    """Write spans as Chrome trace JSON (open in chrome://tracing or ui.perfetto.dev)."""
+    origin = min((start for _, _, _, _, start, _ in spans), default=0)
+    events = []
+    for pid, tid, stage, hole, start, duration in spans:
+        event = {"name": stage, "cat": "scan", "ph": "X", "pid": pid, "tid": tid,
+                 "ts": (start - origin) / 1000, "dur": duration / 1000}
+        if hole:
+            event["args"] = {"hole": hole}
+        events.append(event)
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def summarize(spans):
+    """Print count, p50, p95, max and total time per stage, slowest total first."""
+    stages = {}
+    for _, _, stage, _, _, duration in spans:
+        stages.setdefault(stage, []).append(duration / 1e6)
+    print(f"{'Stage':28s} {'count':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s} {'total s':>9s}")
+    for stage, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        values = np.array(values)
+        print(f"{stage:28s} {len(values):6d} {np.percentile(values, 50):9.1f} {np.percentile(values, 95):9.1f} "
+              f"{values.max():9.1f} {values.sum() / 1000:9.1f}")
+
+def report():
+    """Flush this process's spans and print the summary for every process tracing into the same folder."""
+    if not _enabled:
+        return
+    flush()
+    trace_dir = os.environ[TRACE_ENV]
+    summarize(read_spans(trace_dir))
+    print(f"Export a timeline with: python3 Tracing.py --dir {trace_dir} --export trace.json")
+
+def clear(trace_dir=TRACE_DIR):
+    """Delete the logs from earlier runs."""
+    for path in glob.glob(os.path.join(trace_dir, "trace-*.log")):
+        os.remove(path)
+
+if os.environ.get(TRACE_ENV) and __name__ != "__main__":  # The command line below only reads the logs
+    enable(os.environ[TRACE_ENV])
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize or export the per-stage scan trace.")
+    parser.add_argument("--dir", default=os.environ.get(TRACE_ENV, TRACE_DIR), help="Folder holding the trace logs.")
+    parser.add_argument("--export", metavar="JSON", help="Write a Chrome-trace/Perfetto JSON file.")
+    parser.add_argument("--clear", action="store_true", help="Delete the trace logs.")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear(args.dir)
+    else:
+        spans = read_spans(args.dir)
+        if not spans:
+            print(f"No trace logs in {args.dir}. Run with {TRACE_ENV}=<folder> set to record one.")
+        else:
+            summarize(spans)
+            if args.export:
+                export_chrome_trace(spans, args.export)
+                print(f"Chrome trace written to {args.export}")
@@ -0,0 +1,123 @@
+import contextlib
+import io
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+import cv2
+import numpy as np
+import Benchmark
+import ImageProcessing
+from FrameIndex import FrameIndex
+from ResultStore import ResultStore
+
+def write_benchmark_images(count, seed=0):
+    """Benchmark's synthetic holes and its clean baseline in a temporary folder: (folder, template, cases, paths)."""
+    folder = tempfile.mkdtemp(prefix="asml-test-")
+    baseline_path = os.path.join(folder, "baseline.png")
+    center = (Benchmark.FRAME_WIDTH / 2, Benchmark.FRAME_HEIGHT / 2)
+    cv2.imwrite(baseline_path, Benchmark.draw_hole(center, Benchmark.HOLE_RADIUS, noise=0))
+    cases = Benchmark.generate_dataset(count, seed)
+    paths = Benchmark.write_dataset(cases, folder)
+    with contextlib.redirect_stdout(io.StringIO()):
+        template = ImageProcessing.crop_center_template(
+            baseline_path, center[0] - Benchmark.HOLE_RADIUS * Benchmark.EDGE_FRACTION, center[1],
+            Benchmark.TEMPLATE_SIZE, Benchmark.TEMPLATE_SIZE)
+    return folder, template, cases, paths
+
+class SequentialProcessingTest(unittest.TestCase):
+    def setUp(self):
+        self.folder, self.template, self.cases, self.paths = write_benchmark_images(8)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_workers_1_scores_logs_and_records_every_image(self):
+        # Options as ImageProcessing.py's main builds them for every mode, pool workers included
+        bank = {"default": ImageProcessing.build_bank_entry(self.template)}
+        search_options = {"search": "cascade", "roi": None, "cascade_threshold": 0.6, "bank": bank}
+        store = ResultStore(os.path.join(self.folder, "results.sqlite"))
+        results = store.for_run(store.start_run("test"))
+        needs_cleaning_log = []
+        progress = []
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            scores = ImageProcessing.process_images(
+                self.template, self.paths, needs_cleaning_log, threshold=0.6, search_options=search_options,
+                results=results, on_progress=lambda done, hole, score: progress.append((done, hole, score)))
+
+        holes = [ImageProcessing.hole_number_from_path(path) for path in self.paths]
+        self.assertEqual(len(scores), len(self.paths))
+        self.assertTrue(all(score is not None for score in scores))
+        self.assertEqual([hole for _, hole, _ in progress], holes)
+        self.assertEqual([done for done, _, _ in progress], list(range(1, len(holes) + 1)))
+        self.assertEqual([entry[0] for entry in needs_cleaning_log],
+                         [hole for hole, score in zip(holes, scores) if score < 0.6])
+        self.assertEqual([row[0] for row in store.run_results(results.run_id)], holes)
+        store.close()
+
+    def test_workers_1_matches_the_pool(self):
+        search_options = {"search": "exhaustive", "roi": None, "cascade_threshold": 0.6}
+        with contextlib.redirect_stdout(io.StringIO()):
+            sequential = ImageProcessing.process_images(self.template, self.paths, [],
+                                                        search_options=search_options)
+            pooled = ImageProcessing.process_images_parallel(self.template, self.paths, [], workers=2,
+                                                             search_options=search_options)
+        np.testing.assert_allclose(sequential, pooled)
+
+class PyramidSearchTest(unittest.TestCase):
+    def test_pyramid_stays_within_tolerance_on_benchmark_dataset(self):
+        folder, template, _, paths = write_benchmark_images(60, seed=0)
+        try:
+            bank = {"default": ImageProcessing.build_bank_entry(template)}
+            worst = 0.0
+            for path in paths:
+                image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                entry = bank["default"]
+                exhaustive, _, _ = ImageProcessing.match_template(template, image, search="exhaustive",
+                                                                  bank_entry=entry)
+                pyramid, _, _ = ImageProcessing.match_template(template, image, search="pyramid", bank_entry=entry)
+                worst = max(worst, abs(exhaustive - pyramid))
+            self.assertLessEqual(worst, ImageProcessing.PYRAMID_SCORE_TOLERANCE)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(ImageProcessing.compare_search_modes(template, paths, bank=bank))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+class StaleRing:
+    """FrameRing stand-in whose slots have always been overwritten, so follow mode reads the image files."""
+
+    def is_current(self, slot, seq):
+        return False
+
+class FollowRingTest(unittest.TestCase):
+    def test_captures_without_a_frame_event_are_still_scored(self):
+        folder, template, _, paths = write_benchmark_images(4)
+        try:
+            index = FrameIndex(folder)
+            index.record("OLD", 0, paths[0])  # A previous run's capture, not part of this run
+            start = index.position()
+
+            frame_events = queue.Queue()
+            for count, path in enumerate(paths):
+                hole = ImageProcessing.hole_number_from_path(path)
+                index.record(hole, count, path)
+                if count != 2:  # The third capture's event was dropped
+                    frame_events.put({"hole": hole, "filename": path, "slot": 0, "seq": 0, "started": 0})
+            progress = []
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                ImageProcessing.follow_ring(template, StaleRing(), frame_events, [], lambda: True,
+                                            os.path.join(folder, "cleaning.csv"), index=index, index_start=start,
+                                            on_progress=lambda done, hole, score: progress.append((hole, score)))
+
+            self.assertEqual(sorted(hole for hole, _ in progress),
+                             sorted(ImageProcessing.hole_number_from_path(path) for path in paths))
+            self.assertTrue(all(score is not None for _, score in progress))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()